@@ -1,13 +1,31 @@
 import asyncio
+import bisect
+import contextlib
+import contextvars
+import csv
+import heapq
+import html
+import inspect
 import logging
 import json
+import itertools
 import os
 import re
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Set
 
-from aiogram import Bot, Dispatcher, F, Router
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -20,9 +38,20 @@ from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
     FSInputFile,
+    Update,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.enums import ParseMode
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    DeleteMessage,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendMessage,
+)
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 # ========== КОНФИГУРАЦИЯ ==========
 BOT_TOKEN = "8414739699:AAGxLHowv9Pm893jBawx-DnbHnm8hMA3W34"
@@ -39,6 +68,100 @@ STATE_FILE = os.path.join(DATA_DIR, "bot_security_state.json")
 # Файл для сохранения данных (задачи/пользователи), чтобы прогресс переживал перезапуск
 DATA_FILE = os.path.join(DATA_DIR, "bot_data.json")
 
+# Архив (append-only JSONL) давно выполненных задач: не попадает в bot_data.json,
+# в память не загружается (подгружается для истории «✅ Выполненные» и экспорта);
+# в счетчиках и статистике архивные задачи учитываются — агрегаты хранятся в bot_data.json,
+# при старте архив не читается
+ARCHIVE_FILE = os.path.join(DATA_DIR, "bot_archive.jsonl")
+ARCHIVE_COMPLETED_AFTER_DAYS = 30  # 0 — не архивировать
+ARCHIVE_CHECK_INTERVAL_HOURS = 6
+
+# Ограничение памяти: в памяти держатся задачи только недавно активных пользователей
+# (LRU по last_active), задачи остальных выгружаются в PAGE_FILE (блок на пользователя) до их
+# следующего update — в памяти от них остается только агрегат для статистики.
+# Бюджет — число задач в памяти; 0 — выключено (все задачи в памяти)
+PAGING_MAX_RESIDENT_TASKS = 0
+PAGE_FILE = os.path.join(DATA_DIR, "bot_pages.jsonl")
+
+# Импорт задач из присланного CSV/JSON (/import): файл читается потоково в отдельном потоке,
+# задачи добавляются пачками — одно сохранение на пачку
+IMPORT_MAX_FILE_MB = 10
+IMPORT_MAX_TASKS = 5000  # на один файл
+IMPORT_BATCH_SIZE = 200
+IMPORT_PROGRESS_INTERVAL_SEC = 2  # не чаще — правка статус-сообщения
+
+# Журнал модерации (ban/unban/warn/clearwarn/promote/demote): append-only JSONL-сегменты
+# bot_audit.000001.jsonl, ... — новый сегмент по достижении лимита, старые удаляются
+AUDIT_FILE = os.path.join(DATA_DIR, "bot_audit.jsonl")
+AUDIT_SEGMENT_MAX_MB = 50
+AUDIT_MAX_SEGMENTS = 20
+AUDIT_PAGE_SIZE = 10
+
+# Суточные счетчики для админ-статистики (сегодня / 7 / 30 дней): сколько дней хранить
+STATS_WINDOW_DAYS = 30
+
+# LRU-кэш отрисованных карточек задач (текст + клавиатура) по (task_id, версия задачи, вид)
+RENDER_CACHE_SIZE = 1000
+
+# Кэш текста админ-статистики: пересчет только после изменений данных (по версии Database).
+# >0 — при нагрузке можно отдавать снимок не старше N секунд даже после изменений
+ADMIN_STATS_MAX_STALENESS_SEC = 0
+
+# Массовая модерация (/massban, /masstban, /massunban, /masswarn и «Массовый бан» в админ-панели)
+MASS_MODERATION_MAX_IDS = 1000
+
+# HTTP-сессия бота (aiohttp): пул соединений к Bot API переиспользуется между запросами
+BOT_API_BASE_URL = ""  # пусто — api.telegram.org; например "http://localhost:8081" для локального Bot API
+BOT_API_IS_LOCAL = False  # локальный Bot API сервер (файлы отдаются путями на диске)
+BOT_HTTP_POOL_SIZE = 100  # одновременных соединений (с запасом к UPDATE_MAX_CONCURRENCY и OUTBOUND_*)
+BOT_HTTP_KEEPALIVE_SEC = 60  # сколько держать простаивающее соединение открытым
+BOT_REQUEST_TIMEOUT_SEC = 30  # таймаут запроса (к getUpdates aiogram добавляет время long polling)
+
+# Получение обновлений: webhook (встроенный aiohttp-сервер) или polling.
+# WEBHOOK_BASE_URL пустой — polling; иначе Telegram шлет обновления на WEBHOOK_BASE_URL + WEBHOOK_PATH
+WEBHOOK_BASE_URL = ""  # например "https://bot.example.com"
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = ""  # X-Telegram-Bot-Api-Secret-Token: 1-256 символов A-Z, a-z, 0-9, _ и -
+WEBHOOK_MAX_CONNECTIONS = 40  # параллельных соединений от Telegram (1-100)
+WEBHOOK_LISTEN_HOST = "0.0.0.0"
+WEBHOOK_LISTEN_PORT = 8080
+
+# Параллельная обработка обновлений: разные чаты — одновременно, внутри чата — строго по порядку
+UPDATE_MAX_CONCURRENCY = 64  # одновременно выполняемых обработчиков на весь бот
+UPDATE_CHAT_QUEUE_LIMIT = 20  # обновлений одного чата в очереди; сверх — отбрасываются
+
+# Допуск обновлений по классам (админы/модерация, продолжение FSM-сценария, навигация,
+# листание страниц): сколько обновлений класса может быть в очереди и в работе одновременно,
+# 0 — без лимита. Сверх лимита обновление отбрасывается с ответом «бот занят».
+# Свободные слоты обработки достаются сначала более важным классам
+UPDATE_CLASS_LIMITS = {"admin": 0, "fsm": 500, "navigation": 300, "pagination": 100}
+
+# Повторные нажатия: одинаковый callback на том же сообщении в пределах окна отбрасывается,
+# из нескольких ожидающих листаний одного сообщения выполняется только последнее
+CALLBACK_COALESCE_WINDOW_SEC = 1.0
+
+# Пропуск правок сообщений без изменений: хэш последнего показанного текста и клавиатуры
+# по (чат, сообщение) в LRU на столько сообщений
+EDIT_HASH_CACHE_SIZE = 10000
+
+# Исходящие запросы к Telegram (отправка/правка/удаление сообщений): общий и по-чатовый
+# лимит скорости (token bucket), интерактивные ответы обслуживаются раньше массовых
+# рассылок, на RetryAfter — пауза и повтор
+OUTBOUND_GLOBAL_RATE = 25  # запросов в секунду на весь бот (лимит Telegram ~30)
+OUTBOUND_GLOBAL_BURST = 25
+OUTBOUND_CHAT_RATE = 1.0  # запросов в секунду в один чат
+OUTBOUND_CHAT_BURST = 3  # ответ + правка + уведомление проходят без ожидания
+OUTBOUND_BULK_RESERVE = 5  # токенов общего лимита, которые рассылки не трогают (запас для ответов)
+OUTBOUND_MAX_RETRIES = 3  # повторов после RetryAfter
+
+# Обновления, накопившиеся за время перезапуска: разбираются при старте (вместо сброса).
+# False — сбрасывать их, как раньше
+CATCHUP_PENDING_UPDATES = True
+CATCHUP_MAX_AGE_SEC = 3600  # сообщения старше — пропускаются
+CATCHUP_MAX_UPDATES = 1000  # при большем хвосте разбираются только самые свежие
+CATCHUP_CONCURRENCY = 8  # сколько чатов обрабатывается параллельно
+CALLBACK_ANSWER_WINDOW_SEC = 15  # нажатия старше этого Telegram уже не даст ответить — пропускаются
+
 # Поведение при бане: удалять ли задачи пользователя
 PURGE_TASKS_ON_BAN = True
 
@@ -56,8 +179,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ========== ИНИЦИАЛИЗАЦИЯ ==========
+def _create_session() -> AiohttpSession:
+    """HTTP-сессия бота с настроенным пулом соединений, keep-alive и таймаутом"""
+    kwargs: Dict[str, Any] = {"limit": BOT_HTTP_POOL_SIZE, "timeout": BOT_REQUEST_TIMEOUT_SEC}
+    if BOT_API_BASE_URL:
+        kwargs["api"] = TelegramAPIServer.from_base(BOT_API_BASE_URL, is_local=BOT_API_IS_LOCAL)
+    session = AiohttpSession(**kwargs)
+    # Параметры TCPConnector, с которыми aiogram создает соединения при первом запросе
+    session._connector_init["keepalive_timeout"] = BOT_HTTP_KEEPALIVE_SEC
+    return session
+
 bot = Bot(
     token=BOT_TOKEN, 
+    session=_create_session(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 storage = MemoryStorage()
@@ -65,25 +199,1102 @@ dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
 
+# ========== МОДЕЛИ ДАННЫХ ==========
+# Задачи и пользователи — компактные объекты со __slots__: на миллионах задач
+# накладные расходы обычных dict съедают большую часть памяти.
+# Время хранится как epoch-секунды (int), в JSON по-прежнему пишется ISO-строка.
+
+class Priority(IntEnum):
+    """Приоритет задачи (в JSON и callback_data — строки low/medium/high)"""
+    LOW = 0
+    MEDIUM = 1
+    HIGH = 2
+
+    @property
+    def key(self) -> str:
+        return self.name.lower()
+
+    @classmethod
+    def parse(cls, raw: Any) -> "Priority":
+        """Приоритет из строки ('high'), числа или Priority; неизвестное значение -> MEDIUM."""
+        if isinstance(raw, cls):
+            return raw
+        try:
+            if isinstance(raw, int):
+                return cls(raw)
+            return cls[str(raw).strip().upper()]
+        except (KeyError, ValueError):
+            return cls.MEDIUM
+
+
+PRIORITY_EMOJI = {Priority.HIGH: "🔴", Priority.MEDIUM: "🟡", Priority.LOW: "🟢"}
+PRIORITY_TITLE = {Priority.HIGH: "Высокий", Priority.MEDIUM: "Средний", Priority.LOW: "Низкий"}
+
+
+def _now_ts() -> int:
+    return int(datetime.now().timestamp())
+
+def _ts_to_dt(ts: Optional[int]) -> Optional[datetime]:
+    return datetime.fromtimestamp(ts) if ts is not None else None
+
+def _ts_to_str(ts: Optional[int]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+def _str_to_ts(s: Optional[str]) -> Optional[int]:
+    if not s:
+        return None
+    try:
+        return int(datetime.fromisoformat(s).timestamp())
+    except Exception:
+        return None
+
+def _fmt_ts(ts: Optional[int], fmt: str = '%d.%m.%Y %H:%M', default: str = 'Неизвестно') -> str:
+    return datetime.fromtimestamp(ts).strftime(fmt) if ts is not None else default
+
+
+@dataclass(slots=True)
+class Task:
+    id: int
+    user_id: int
+    text: str
+    category: str  # интернированная строка: категорий мало, задач много
+    priority: Priority
+    created: int  # epoch, сек
+    completed: bool = False
+    completed_at: Optional[int] = None
+
+    def to_dict(self) -> Dict:
+        """Запись в формате bot_data.json"""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "text": self.text,
+            "category": self.category,
+            "created": _ts_to_str(self.created),
+            "completed": self.completed,
+            "completed_at": _ts_to_str(self.completed_at),
+            "priority": self.priority.key,
+        }
+
+    @classmethod
+    def from_dict(cls, t: Dict) -> Optional["Task"]:
+        """Разбор записи из bot_data.json (None — если запись битая)."""
+        if not isinstance(t, dict):
+            return None
+        tid_raw = t.get("id")
+        if tid_raw is None:
+            return None
+        tid = int(tid_raw)
+        if tid <= 0:
+            return None
+        return cls(
+            id=tid,
+            user_id=int(t.get("user_id", 0)),
+            text=str(t.get("text", "")),
+            category=sys.intern(str(t.get("category", "Общее"))),
+            priority=Priority.parse(t.get("priority", "medium")),
+            created=_str_to_ts(t.get("created")) or _now_ts(),
+            completed=bool(t.get("completed", False)),
+            completed_at=_str_to_ts(t.get("completed_at")),
+        )
+
+
+@dataclass(slots=True)
+class User:
+    user_id: int
+    username: str
+    full_name: str
+    joined: int  # epoch, сек
+    last_active: int  # epoch, сек
+    task_count: int = 0
+    completed_count: int = 0
+    warnings: int = 0
+
+    def to_dict(self) -> Dict:
+        """Запись в формате bot_data.json"""
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "full_name": self.full_name,
+            "task_count": self.task_count,
+            "completed_count": self.completed_count,
+            "warnings": self.warnings,
+            "joined": _ts_to_str(self.joined),
+            "last_active": _ts_to_str(self.last_active),
+        }
+
+    @classmethod
+    def from_dict(cls, u: Dict) -> Optional["User"]:
+        """Разбор записи из bot_data.json (None — если запись битая)."""
+        if not isinstance(u, dict):
+            return None
+        uid_raw = u.get("user_id")
+        if uid_raw is None:
+            return None
+        joined = _str_to_ts(u.get("joined")) or _now_ts()
+        return cls(
+            user_id=int(uid_raw),
+            username=u.get("username") or "Без имени",
+            full_name=u.get("full_name") or "",
+            joined=joined,
+            last_active=_str_to_ts(u.get("last_active")) or joined,
+            task_count=int(u.get("task_count", 0)),
+            completed_count=int(u.get("completed_count", 0)),
+            warnings=int(u.get("warnings", 0)),
+        )
+
+
+# ========== ПОТОКОВОЕ ЧТЕНИЕ JSON ==========
+class _JsonStream:
+    """Чтение JSON из файла кусками фиксированного размера (буфер + raw_decode)."""
+
+    def __init__(self, f, chunk_size: int = 64 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Прочитанное выбрасываем, чтобы буфер не рос вместе с файлом
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Следующий значащий символ (пробелы пропускаются); '' — конец файла."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"JSON: ожидался {ch!r}, получен {got!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Следующее JSON-значение целиком (для одной записи или скаляра)."""
+        self.peek()
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self.buf) and self._fill():
+                continue  # значение (например, число) могло оборваться на границе буфера
+            self.pos = end
+            return val
+
+
+def _iter_json_array(s: _JsonStream):
+    """Элементы JSON-массива по одному"""
+    s.expect("[")
+    if s.peek() == "]":
+        s.expect("]")
+        return
+    while True:
+        yield s.value()
+        if s.peek() != ",":
+            break
+        s.expect(",")
+    s.expect("]")
+
+
+def _iter_json_keys(s: _JsonStream):
+    """Ключи JSON-объекта по одному; значение ключа читает вызывающий код до следующего шага"""
+    s.expect("{")
+    if s.peek() == "}":
+        s.expect("}")
+        return
+    while True:
+        key = s.value()
+        s.expect(":")
+        yield key
+        if s.peek() != ",":
+            break
+        s.expect(",")
+    s.expect("}")
+
+
+def _stream_json_object(f, array_handlers: Dict[str, Any]) -> Dict:
+    """Потоковый разбор JSON-объекта верхнего уровня.
+
+    Элементы массивов из array_handlers (ключ -> callable) передаются в обработчик
+    по одному, не собираясь в список; остальные значения возвращаются словарем.
+    """
+    s = _JsonStream(f)
+    result: Dict = {}
+    for key in _iter_json_keys(s):
+        handler = array_handlers.get(key)
+        if handler is not None and s.peek() == "[":
+            for item in _iter_json_array(s):
+                handler(item)
+        else:
+            result[key] = s.value()
+    return result
+
+
+def _iter_json_records(f, array_key: str = "tasks"):
+    """Записи из JSON-массива верхнего уровня или из массива array_key объекта верхнего уровня"""
+    s = _JsonStream(f)
+    if s.peek() == "[":
+        yield from _iter_json_array(s)
+        return
+    for key in _iter_json_keys(s):
+        if key == array_key and s.peek() == "[":
+            yield from _iter_json_array(s)
+        else:
+            s.value()
+
+
+# ========== КОЛОНОЧНОЕ ХРАНИЛИЩЕ ДЛЯ СТАТИСТИКИ ==========
+@dataclass(slots=True)
+class UserTaskStats:
+    """Агрегат задач одного пользователя, обновляется инкрементально при каждом изменении"""
+    total: int = 0
+    completed: int = 0
+    by_priority: List[int] = field(default_factory=lambda: [0] * len(Priority))
+    by_category: Dict[int, int] = field(default_factory=dict)  # category_id -> число задач
+    top_category: int = -1  # category_id самой частой категории; -1 — пересчитать при чтении
+    top_count: int = 0
+
+    def add_category(self, cid: int, delta: int) -> None:
+        count = self.by_category.get(cid, 0) + delta
+        if count:
+            self.by_category[cid] = count
+        else:
+            self.by_category.pop(cid, None)
+
+        if delta > 0:
+            if self.top_category >= 0 and count > self.top_count:
+                self.top_category, self.top_count = cid, count
+        elif cid == self.top_category:
+            self.top_category = -1  # лидер мог смениться — пересчет при следующем чтении
+
+    def top(self) -> tuple:
+        """(category_id, count) самой частой категории; (-1, 0) — задач нет"""
+        if self.top_category < 0 and self.by_category:
+            self.top_category, self.top_count = max(self.by_category.items(), key=lambda x: x[1])
+        return (self.top_category, self.top_count) if self.by_category else (-1, 0)
+
+
+class TaskColumns:
+    """Колоночное (array-backed) представление задач для статистики.
+
+    Строки (набор компактных массивов) есть только у задач в памяти — Database держит их
+    в синхронизации с self.tasks. Агрегаты (по пользователям, по приоритетам, выполненные)
+    учитывают все задачи, включая архивные: архивация снимает только строку (unload),
+    возврат из архива ставит ее обратно (load), не трогая агрегатов. Агрегаты сохраняются
+    в снапшот (stats_to_dict/load_stats), чтобы при старте не перечитывать архив.
+    completed_at == 0 означает «не выполнена».
+    """
+
+    def __init__(self):
+        self.task_ids = array('q')
+        self.user_ids = array('q')
+        self.priorities = array('b')
+        self.category_ids = array('l')
+        self.created = array('q')
+        self.completed_at = array('q')
+        self.completed = array('b')
+
+        self.categories: List[str] = []  # category_id -> имя
+        self._category_ids: Dict[str, int] = {}
+        self._rows: Dict[int, int] = {}  # task_id -> номер строки
+        self._user_rows: Dict[int, Set[int]] = {}  # user_id -> номера строк
+        self._user_stats: Dict[int, UserTaskStats] = {}  # user_id -> агрегат для /stats
+
+        self.total = 0  # задач всего, включая архивные
+        self.priority_counts = [0] * len(Priority)
+        self.completed_total = 0
+
+    def __len__(self) -> int:
+        return len(self.task_ids)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._rows
+
+    def _category_id(self, name: str) -> int:
+        cid = self._category_ids.get(name)
+        if cid is None:
+            cid = len(self.categories)
+            self.categories.append(name)
+            self._category_ids[name] = cid
+        return cid
+
+    def rebuild(self, tasks) -> None:
+        """Полная пересборка колонок (после загрузки данных)."""
+        self.__init__()
+        for task in tasks:
+            self.add(task)
+
+    def _count(self, user_id: int, priority: int, cid: int, completed: int, sign: int) -> None:
+        """Учесть задачу в агрегатах (sign=-1 — вычесть)"""
+        self.total += sign
+        self.priority_counts[priority] += sign
+        self.completed_total += sign * completed
+
+        stats = self._user_stats.get(user_id)
+        if stats is None:
+            stats = self._user_stats[user_id] = UserTaskStats()
+        stats.total += sign
+        stats.completed += sign * completed
+        stats.by_priority[priority] += sign
+        stats.add_category(cid, sign)
+        if not stats.total:
+            del self._user_stats[user_id]
+
+    def count(self, task: Task, sign: int = 1) -> None:
+        """Учесть в агрегатах задачу без строки (архивную); sign=-1 — вычесть"""
+        self._count(task.user_id, int(task.priority), self._category_id(task.category),
+                    1 if task.completed else 0, sign)
+
+    def add(self, task: Task) -> None:
+        """Новая задача: строка + агрегаты"""
+        if task.id in self._rows:
+            self.update(task)
+            return
+        self.load(task)
+        self.count(task)
+
+    def load(self, task: Task) -> None:
+        """Строка для задачи, уже учтенной в агрегатах (загрузка снапшота, возврат из архива)"""
+        if task.id in self._rows:
+            return
+        row = len(self.task_ids)
+        self.task_ids.append(task.id)
+        self.user_ids.append(task.user_id)
+        self.priorities.append(int(task.priority))
+        self.category_ids.append(self._category_id(task.category))
+        self.created.append(task.created)
+        self.completed_at.append(task.completed_at or 0)
+        self.completed.append(1 if task.completed else 0)
+
+        self._rows[task.id] = row
+        self._user_rows.setdefault(task.user_id, set()).add(row)
+
+    def update(self, task: Task) -> None:
+        """Перезапись строки задачи после изменения (статус/приоритет/категория)."""
+        row = self._rows.get(task.id)
+        if row is None:
+            self.add(task)
+            return
+        self._count(self.user_ids[row], self.priorities[row], self.category_ids[row], self.completed[row], -1)
+
+        self.priorities[row] = int(task.priority)
+        self.category_ids[row] = self._category_id(task.category)
+        self.completed_at[row] = task.completed_at or 0
+        self.completed[row] = 1 if task.completed else 0
+
+        self._count(self.user_ids[row], self.priorities[row], self.category_ids[row], self.completed[row], 1)
+
+    def remove(self, task_id: int) -> None:
+        """Удаление задачи: строка и ее вклад в агрегаты."""
+        row = self._rows.get(task_id)
+        if row is None:
+            return
+        self._count(self.user_ids[row], self.priorities[row], self.category_ids[row], self.completed[row], -1)
+        self.unload(task_id)
+
+    def unload(self, task_id: int) -> None:
+        """Снять строку, оставив задачу в агрегатах: последняя строка переносится на место снятой."""
+        row = self._rows.pop(task_id, None)
+        if row is None:
+            return
+        uid = self.user_ids[row]
+        rows = self._user_rows.get(uid)
+        if rows is not None:
+            rows.discard(row)
+            if not rows:
+                del self._user_rows[uid]
+
+        last = len(self.task_ids) - 1
+        if row != last:
+            moved_id = self.task_ids[last]
+            moved_uid = self.user_ids[last]
+            for col in (self.task_ids, self.user_ids, self.priorities, self.category_ids,
+                        self.created, self.completed_at, self.completed):
+                col[row] = col[last]
+            self._rows[moved_id] = row
+            moved_rows = self._user_rows[moved_uid]
+            moved_rows.discard(last)
+            moved_rows.add(row)
+
+        for col in (self.task_ids, self.user_ids, self.priorities, self.category_ids,
+                    self.created, self.completed_at, self.completed):
+            col.pop()
+
+    def shrink(self) -> None:
+        """Пересобрать словарь и массивы строк после массового снятия (сами они не сжимаются)"""
+        self._rows = dict(self._rows)
+        for name in ("task_ids", "user_ids", "priorities", "category_ids", "created", "completed_at", "completed"):
+            col = getattr(self, name)
+            setattr(self, name, array(col.typecode, col))
+
+    # ---- агрегаты в снапшоте ----
+    def stats_to_dict(self) -> Dict:
+        """user_id -> [всего, выполнено, [по приоритетам], {категория: число}]"""
+        return {
+            str(uid): [s.total, s.completed, list(s.by_priority),
+                       {self.categories[cid]: n for cid, n in s.by_category.items()}]
+            for uid, s in self._user_stats.items()
+        }
+
+    def load_stats(self, data: Dict) -> None:
+        """Агрегаты из снапшота (вместо пересчета по всем задачам); строки не меняются"""
+        self._user_stats = {}
+        self.total = 0
+        self.priority_counts = [0] * len(Priority)
+        self.completed_total = 0
+        for uid, (total, completed, by_priority, by_category) in data.items():
+            stats = UserTaskStats(total=int(total), completed=int(completed))
+            for p, n in enumerate(by_priority[:len(Priority)]):
+                stats.by_priority[p] = int(n)
+                self.priority_counts[p] += int(n)
+            for name, n in by_category.items():
+                stats.add_category(self._category_id(sys.intern(name)), int(n))
+            if stats.total:
+                self._user_stats[int(uid)] = stats
+                self.total += stats.total
+                self.completed_total += stats.completed
+
+    # ---- запросы ----
+    def user_task_ids(self, user_id: int) -> List[int]:
+        return [self.task_ids[row] for row in self._user_rows.get(user_id, ())]
+
+    def user_totals(self, user_id: int) -> tuple:
+        """(всего, выполнено) по всем задачам пользователя, включая архивные"""
+        stats = self._user_stats.get(user_id)
+        return (stats.total, stats.completed) if stats else (0, 0)
+
+    def users_with_tasks(self) -> Set[int]:
+        return set(self._user_stats)
+
+    def user_summary(self, user_id: Optional[int]) -> Dict:
+        """Сводка по задачам пользователя из готового агрегата: статусы, приоритеты, самая частая категория."""
+        stats = self._user_stats.get(user_id) or UserTaskStats()
+        cid, count = stats.top()
+        return {
+            "total": stats.total,
+            "completed": stats.completed,
+            "active": stats.total - stats.completed,
+            "by_priority": {p: stats.by_priority[p] for p in Priority},
+            "top_category": (self.categories[cid], count) if cid >= 0 else ("Нет", 0),
+        }
+
+
+# ========== СУТОЧНЫЕ СЧЕТЧИКИ ==========
+def _day_of(ts: int) -> int:
+    """Номер календарного дня (локальное время) для epoch-секунд"""
+    return datetime.fromtimestamp(ts).date().toordinal()
+
+
+class DailyCounters:
+    """Счетчики событий по календарным дням в кольцевом буфере на STATS_WINDOW_DAYS дней.
+
+    Ячейка дня переиспользуется, когда в нее впервые пишут новый день (смена суток
+    не требует таймера). Запрос «за N дней» — сумма N ячеек.
+    Активные пользователи считаются без множеств: у каждого пользователя хранится день
+    последней активности, а в ячейке дня — число пользователей, последний раз активных в этот день.
+    """
+
+    METRICS = ("tasks_created", "tasks_completed", "new_users", "active_users")
+    # Хранятся в снапшоте; пользовательские метрики при старте считаются заново по users
+    SAVED_METRICS = ("tasks_created", "tasks_completed")
+
+    def __init__(self, days: int = STATS_WINDOW_DAYS):
+        self.days = days
+        self._slot_day = array('l', [0] * days)
+        self._counts = {m: array('l', [0] * days) for m in self.METRICS}
+        self._last_day: Dict[int, int] = {}  # user_id -> день последней активности
+
+    def _in_window(self, day: int) -> bool:
+        today = datetime.now().date().toordinal()
+        return today - self.days < day <= today
+
+    def _slot(self, day: int) -> int:
+        idx = day % self.days
+        if self._slot_day[idx] != day:
+            self._slot_day[idx] = day
+            for counts in self._counts.values():
+                counts[idx] = 0
+        return idx
+
+    def add(self, metric: str, ts: Optional[int], n: int = 1) -> None:
+        if ts is None:
+            return
+        day = _day_of(ts)
+        if self._in_window(day):
+            self._counts[metric][self._slot(day)] += n
+
+    def mark_active(self, user_id: int, ts: int) -> bool:
+        """Отметить активность; True — если счетчики изменились (первая активность за день)"""
+        day = _day_of(ts)
+        prev = self._last_day.get(user_id)
+        if prev is not None and prev >= day:
+            return False
+        self._last_day[user_id] = day
+        if prev is not None and self._in_window(prev) and self._slot_day[prev % self.days] == prev:
+            self._counts["active_users"][prev % self.days] -= 1
+        if self._in_window(day):
+            self._counts["active_users"][self._slot(day)] += 1
+        return True
+
+    def forget_user(self, user_id: int) -> None:
+        """Убрать пользователя из счетчика активных (бан)"""
+        prev = self._last_day.pop(user_id, None)
+        if prev is not None and self._in_window(prev) and self._slot_day[prev % self.days] == prev:
+            self._counts["active_users"][prev % self.days] -= 1
+
+    def to_dict(self) -> Dict:
+        """Ячейки SAVED_METRICS для снапшота: номера дней и счетчики по ним"""
+        return {"days": list(self._slot_day), **{m: list(self._counts[m]) for m in self.SAVED_METRICS}}
+
+    def load(self, data: Dict) -> None:
+        """Ячейки из снапшота; дни вне окна (или окно сменили в конфиге) раскладываются заново"""
+        for i, day in enumerate(data.get("days", ())):
+            if not day or not self._in_window(day):
+                continue
+            idx = self._slot(day)
+            for metric in self.SAVED_METRICS:
+                values = data.get(metric, ())
+                if i < len(values):
+                    self._counts[metric][idx] += int(values[i])
+
+    def total(self, metric: str, days: int = 1) -> int:
+        """Сумма за последние days дней, включая сегодня"""
+        today = datetime.now().date().toordinal()
+        counts = self._counts[metric]
+        total = 0
+        for day in range(today - min(days, self.days) + 1, today + 1):
+            idx = day % self.days
+            if self._slot_day[idx] == day:
+                total += counts[idx]
+        return total
+
+
+# ========== АРХИВ ВЫПОЛНЕННЫХ ЗАДАЧ ==========
+class TaskArchive:
+    """Append-only архив задач в JSONL (одна задача — одна строка в формате Task.to_dict).
+
+    Файл только дописывается: возврат задачи из архива записывается строкой-надгробием
+    {"id": ..., "removed": true}, при чтении побеждает последняя строка по id.
+    Индекс смещений строится лениво — при первом обращении к архиву.
+    Когда мертвых строк (надгробия и перезаписанные) становится больше живых,
+    файл переписывается только с живыми строками.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index: Optional[Dict[int, Dict[int, int]]] = None  # user_id -> {task_id: offset}
+        self._owners: Dict[int, int] = {}  # task_id -> user_id
+        self._dead = 0  # строк в файле, которые уже ничего не значат
+
+    def _index_record(self, rec: Dict, offset: int) -> None:
+        tid = int(rec.get("id", 0))
+        old_uid = self._owners.pop(tid, None)
+        if old_uid is not None:
+            self._index[old_uid].pop(tid, None)
+            self._dead += 1
+        if rec.get("removed"):
+            self._dead += 1
+        else:
+            uid = int(rec.get("user_id", 0))
+            self._index.setdefault(uid, {})[tid] = offset
+            self._owners[tid] = uid
+
+    def _ensure_index(self) -> None:
+        if self._index is not None:
+            return
+        self._index = {}
+        self._owners = {}
+        self._dead = 0
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                offset = 0
+                for line in f:
+                    try:
+                        self._index_record(json.loads(line), offset)
+                    except Exception:
+                        pass  # битая строка (например, оборванная запись) — пропускаем
+                    offset += len(line)
+        except Exception as e:
+            logger.exception(f"Failed to index task archive: {e}")
+        self._maybe_compact()
+
+    def _append_records(self, records: List[Dict]) -> None:
+        with open(self.path, "ab") as f:
+            for rec in records:
+                offset = f.tell()
+                f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+                if self._index is not None:
+                    self._index_record(rec, offset)
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if self._index is not None and self._dead > len(self._owners):
+            self.compact()
+
+    def compact(self) -> None:
+        """Переписать файл только с живыми строками (через временный файл)"""
+        self._ensure_index()
+        live = sorted((off, uid, tid) for uid, offsets in self._index.items() for tid, off in offsets.items())
+        index: Dict[int, Dict[int, int]] = {}
+        tmp = self.path + ".tmp"
+        try:
+            with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                for off, uid, tid in live:
+                    src.seek(off)
+                    index.setdefault(uid, {})[tid] = dst.tell()
+                    dst.write(src.readline())
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.exception(f"Failed to compact {self.path}: {e}")
+            return
+        self._index = index
+        self._dead = 0
+
+    def append(self, tasks: List[Task]) -> None:
+        """Дописать задачи в архив."""
+        self._append_records([t.to_dict() for t in tasks])
+
+    def remove(self, task_ids: List[int]) -> None:
+        """Пометить задачи как убранные из архива (возврат в оперативные данные или удаление)."""
+        self._append_records([{"id": tid, "removed": True} for tid in task_ids])
+
+    def _read_at(self, f, offset: int) -> Optional[Task]:
+        f.seek(offset)
+        try:
+            return Task.from_dict(json.loads(f.readline()))
+        except Exception:
+            return None
+
+    def get(self, task_id: int) -> Optional[Task]:
+        self._ensure_index()
+        uid = self._owners.get(task_id)
+        if uid is None:
+            return None
+        with open(self.path, "rb") as f:
+            return self._read_at(f, self._index[uid][task_id])
+
+    def get_user_tasks(self, user_id: int) -> List[Task]:
+        self._ensure_index()
+        offsets = self._index.get(user_id)
+        if not offsets:
+            return []
+        with open(self.path, "rb") as f:
+            tasks = [self._read_at(f, off) for off in sorted(offsets.values())]
+        return [t for t in tasks if t is not None]
+
+    def user_ids(self) -> List[int]:
+        """Пользователи, у которых есть задачи в файле."""
+        self._ensure_index()
+        return [uid for uid, offsets in self._index.items() if offsets]
+
+    def task_ids(self) -> List[int]:
+        self._ensure_index()
+        return list(self._owners)
+
+    def iter_tasks(self):
+        """Потоковый обход всех актуальных задач архива (для экспорта)."""
+        self._ensure_index()
+        if not self._owners:
+            return
+        live = {off for offsets in self._index.values() for off in offsets.values()}
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if offset in live:
+                    try:
+                        task = Task.from_dict(json.loads(line))
+                    except Exception:
+                        task = None
+                    if task is not None:
+                        yield task
+                offset += len(line)
+
+
+# ========== ВЫГРУЗКА ЗАДАЧ НА ДИСК ==========
+class TaskPages:
+    """Файл страниц: задачи выгруженных пользователей, по одному блоку на пользователя.
+
+    Блок — строка-заголовок {"page": user_id, "tasks": n, "bytes": L, "min": id, "max": id}
+    и n строк задач (формат Task.to_dict) общей длиной L байт. Побеждает последний блок
+    пользователя; блок с n == 0 — надгробие. В памяти — только положение блока на
+    пользователя (не на задачу); при старте читаются одни заголовки, тела пропускаются.
+    Когда мертвых байт становится больше живых, файл переписывается только с живыми блоками.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # user_id -> (смещение тела, длина тела, задач, min id, max id, байт блока с заголовком)
+        self._blocks: Dict[int, tuple] = {}
+        self._size = 0
+        self._dead = 0  # байт в файле, которые уже ничего не значат
+        self._scan()
+
+    def _scan(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                offset = 0
+                while offset < size:
+                    f.seek(offset)
+                    line = f.readline()
+                    try:
+                        head = json.loads(line)
+                        uid, count, length = int(head["page"]), int(head["tasks"]), int(head["bytes"])
+                    except Exception:
+                        break  # оборванная запись в конце файла
+                    body = offset + len(line)
+                    if body + length > size:
+                        break  # блок дописан не до конца
+                    span = len(line) + length
+                    self._set_block(uid, (body, length, count, head.get("min", 0), head.get("max", 0), span) if count else None,
+                                    span)
+                    offset = body + length
+                self._size = offset
+        except Exception as e:
+            logger.exception(f"Failed to index page file: {e}")
+        if self._size < os.path.getsize(self.path):
+            self._truncate()
+        self._maybe_compact()
+
+    def _truncate(self) -> None:
+        try:
+            with open(self.path, "r+b") as f:
+                f.truncate(self._size)
+        except Exception as e:
+            logger.exception(f"Failed to truncate {self.path}: {e}")
+
+    def _set_block(self, user_id: int, block: Optional[tuple], written: int) -> None:
+        """Новый блок пользователя (None — надгробие) занял written байт файла"""
+        old = self._blocks.pop(user_id, None)
+        if old is not None:
+            self._dead += old[5]
+        if block is None:
+            self._dead += written
+        else:
+            self._blocks[user_id] = block
+
+    def _write_blocks(self, blocks: List[tuple]) -> None:
+        """Дописать блоки [(user_id, задачи)] одной записью"""
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            for uid, tasks in blocks:
+                body = b"".join((json.dumps(t.to_dict(), ensure_ascii=False) + "\n").encode("utf-8") for t in tasks)
+                head = {"page": uid, "tasks": len(tasks), "bytes": len(body)}
+                if tasks:
+                    head["min"] = min(t.id for t in tasks)
+                    head["max"] = max(t.id for t in tasks)
+                head_line = (json.dumps(head) + "\n").encode("utf-8")
+                f.write(head_line + body)
+                start = offset + len(head_line)
+                span = len(head_line) + len(body)
+                self._set_block(uid, (start, len(body), len(tasks), head.get("min", 0), head.get("max", 0), span) if tasks else None,
+                                span)
+                offset = start + len(body)
+            self._size = offset
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if self._dead > self._size - self._dead:
+            self.compact()
+
+    def compact(self) -> None:
+        """Переписать файл только с живыми блоками (через временный файл)"""
+        live = sorted((block[0], uid) for uid, block in self._blocks.items())
+        blocks: Dict[int, tuple] = {}
+        tmp = self.path + ".tmp"
+        try:
+            with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                for body, uid in live:
+                    _, length, count, lo, hi, _ = self._blocks[uid]
+                    head_line = (json.dumps({"page": uid, "tasks": count, "bytes": length, "min": lo, "max": hi}) + "\n").encode("utf-8")
+                    dst.write(head_line)
+                    blocks[uid] = (dst.tell(), length, count, lo, hi, len(head_line) + length)
+                    src.seek(body)
+                    dst.write(src.read(length))
+                size = dst.tell()
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.exception(f"Failed to compact {self.path}: {e}")
+            return
+        self._blocks = blocks
+        self._size = size
+        self._dead = 0
+
+    def _read_block(self, f, block: tuple) -> List[Task]:
+        f.seek(block[0])
+        tasks = []
+        for line in f.read(block[1]).splitlines():
+            try:
+                task = Task.from_dict(json.loads(line))
+            except Exception:
+                task = None
+            if task is not None:
+                tasks.append(task)
+        return tasks
+
+    def write(self, user_id: int, tasks: List[Task]) -> None:
+        """Выгрузить задачи пользователя (новый блок заменяет прежний)"""
+        self._write_blocks([(user_id, tasks)])
+
+    def drop(self, user_ids) -> None:
+        """Надгробия для блоков пользователей (их задачи снова в снапшоте)"""
+        dropped = [(uid, []) for uid in user_ids if uid in self._blocks]
+        if dropped:
+            self._write_blocks(dropped)
+
+    def read(self, user_id: int) -> List[Task]:
+        block = self._blocks.get(user_id)
+        if block is None:
+            return []
+        with open(self.path, "rb") as f:
+            return self._read_block(f, block)
+
+    def user_ids(self) -> List[int]:
+        return list(self._blocks)
+
+    def owner(self, task_id: int) -> Optional[int]:
+        """Владелец выгруженной задачи: поиск по диапазонам id блоков, затем по строкам блока"""
+        prefix = b'{"id": %d,' % task_id
+        with open(self.path, "rb") as f:
+            for uid, block in self._blocks.items():
+                if block[3] <= task_id <= block[4]:
+                    f.seek(block[0])
+                    if any(line.startswith(prefix) for line in f.read(block[1]).splitlines()):
+                        return uid
+        return None
+
+    def iter_tasks(self):
+        """Потоковый обход всех выгруженных задач (экспорт, пересчет статистики)"""
+        if not self._blocks:
+            return
+        # Положения блоков фиксируются вместе с открытым файлом: сжатие во время обхода
+        # заменит файл, но этот дескриптор продолжит читать прежний
+        blocks = sorted(self._blocks.values())
+        with open(self.path, "rb") as f:
+            for block in blocks:
+                yield from self._read_block(f, block)
+
+
+# ========== ЖУРНАЛ МОДЕРАЦИИ ==========
+class AuditLog:
+    """Append-only журнал модерации в JSONL-сегментах с ротацией.
+
+    Индексы по цели (user_id) и по модератору (by) хранят упакованные позиции записей
+    (номер сегмента << 40 | смещение) в array('q') — 8 байт на запись, порядок по времени.
+    Строятся при старте бота в рабочем потоке (build_index), чтобы чтение сегментов не
+    блокировало event loop; при удалении старого сегмента подрезаются.
+    """
+
+    _OFFSET_BITS = 40
+
+    def __init__(self, path: str, max_bytes: int, max_segments: int):
+        self._base, self._ext = os.path.splitext(path)
+        self._dir = os.path.dirname(path) or "."
+        self._segment_re = re.compile(
+            re.escape(os.path.basename(self._base)) + r"\.(\d{6})" + re.escape(self._ext) + "$"
+        )
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self._by_target: Optional[Dict[int, array]] = None
+        self._by_moderator: Dict[int, array] = {}
+        self._segments: List[int] = self._list_segments()
+        self._index_task: Optional[asyncio.Task] = None
+
+    def _segment_path(self, seq: int) -> str:
+        return f"{self._base}.{seq:06d}{self._ext}"
+
+    def _list_segments(self) -> List[int]:
+        if not os.path.isdir(self._dir):
+            return []
+        found = (self._segment_re.match(name) for name in os.listdir(self._dir))
+        return sorted(int(m.group(1)) for m in found if m)
+
+    @staticmethod
+    def _add_to_index(by_target: Dict[int, array], by_moderator: Dict[int, array], rec: Dict, pos: int) -> None:
+        for index, key in ((by_target, "user_id"), (by_moderator, "by")):
+            uid = rec.get(key)
+            if isinstance(uid, int):
+                index.setdefault(uid, array('q')).append(pos)
+
+    def _index_record(self, rec: Dict, pos: int) -> None:
+        self._add_to_index(self._by_target, self._by_moderator, rec, pos)
+
+    def _segment_size(self, seq: int) -> int:
+        try:
+            return os.path.getsize(self._segment_path(seq))
+        except OSError:
+            return 0
+
+    def _scan(self, ranges: List[tuple]) -> tuple:
+        """Индексы по участкам сегментов [(seq, start, end)] -> (by_target, by_moderator).
+        Не трогает состояние журнала — безопасно выполнять в рабочем потоке."""
+        by_target: Dict[int, array] = {}
+        by_moderator: Dict[int, array] = {}
+        for seq, start, end in ranges:
+            try:
+                with open(self._segment_path(seq), "rb") as f:
+                    f.seek(start)
+                    offset = start
+                    while offset < end:
+                        line = f.readline()
+                        if not line:
+                            break
+                        try:
+                            self._add_to_index(by_target, by_moderator, json.loads(line), seq << self._OFFSET_BITS | offset)
+                        except Exception:
+                            pass  # битая строка — пропускаем
+                        offset += len(line)
+            except FileNotFoundError:
+                pass  # сегмент удален ротацией во время сборки
+            except Exception as e:
+                logger.exception(f"Failed to index audit segment {seq}: {e}")
+        return by_target, by_moderator
+
+    def _ensure_index(self) -> None:
+        if self._by_target is None:
+            self._by_target, self._by_moderator = self._scan(
+                [(seq, 0, self._segment_size(seq)) for seq in self._segments]
+            )
+
+    async def _build_index(self) -> None:
+        snapshot = {seq: self._segment_size(seq) for seq in self._segments}
+        by_target, by_moderator = await asyncio.to_thread(
+            self._scan, [(seq, 0, size) for seq, size in snapshot.items()]
+        )
+        if self._by_target is not None:
+            return
+        # Записи, дописанные во время сборки (append не индексирует без индекса), — хвостом
+        tail = [(seq, snapshot.get(seq, 0), self._segment_size(seq)) for seq in self._segments]
+        tail_target, tail_moderator = self._scan([r for r in tail if r[2] > r[1]])
+        for index, extra in ((by_target, tail_target), (by_moderator, tail_moderator)):
+            for uid, positions in extra.items():
+                index.setdefault(uid, array('q')).extend(positions)
+        self._by_target, self._by_moderator = by_target, by_moderator
+        self._trim_index()
+        logger.info(f"Audit index built: {len(self._segments)} segments, {len(by_target)} users")
+
+    async def build_index(self) -> None:
+        """Построить индексы в рабочем потоке; повторные вызовы дожидаются той же сборки"""
+        if self._by_target is not None:
+            return
+        if self._index_task is None:
+            self._index_task = asyncio.create_task(self._build_index())
+        await asyncio.shield(self._index_task)
+
+    def _trim_index(self) -> None:
+        """Отрезать позиции сегментов, удаленных ротацией (они в начале каждого списка)"""
+        if self._by_target is None or not self._segments:
+            return
+        cutoff = self._segments[0] << self._OFFSET_BITS
+        for index in (self._by_target, self._by_moderator):
+            for uid in list(index):
+                positions = index[uid]
+                del positions[:bisect.bisect_left(positions, cutoff)]
+                if not positions:
+                    del index[uid]
+
+    def _rotate(self) -> None:
+        self._segments.append(self._segments[-1] + 1)
+        while len(self._segments) > self.max_segments:
+            old = self._segments.pop(0)
+            try:
+                os.remove(self._segment_path(old))
+            except FileNotFoundError:
+                pass
+        self._trim_index()
+
+    def append(self, records: List[Dict]) -> None:
+        """Дописать записи в текущий сегмент (с ротацией по размеру)."""
+        if not records:
+            return
+        if not self._segments:
+            self._segments.append(1)
+        elif os.path.exists(self._segment_path(self._segments[-1])) and \
+                os.path.getsize(self._segment_path(self._segments[-1])) >= self.max_bytes:
+            self._rotate()
+        seq = self._segments[-1]
+        with open(self._segment_path(seq), "ab") as f:
+            offset = f.tell()
+            for rec in records:
+                line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                if self._by_target is not None:
+                    self._index_record(rec, seq << self._OFFSET_BITS | offset)
+                offset += len(line)
+
+    def query(self, user_id: int, by_moderator: bool = False, offset: int = 0, limit: int = 10) -> tuple:
+        """Записи о пользователе (или действия модератора), новые первыми. -> (records, total)"""
+        self._ensure_index()
+        index = self._by_moderator if by_moderator else self._by_target
+        positions = index.get(user_id, array('q'))
+        total = len(positions)
+        end = max(total - offset, 0)
+        records = []
+        for pos in reversed(positions[max(end - limit, 0):end]):
+            try:
+                with open(self._segment_path(pos >> self._OFFSET_BITS), "rb") as f:
+                    f.seek(pos & ((1 << self._OFFSET_BITS) - 1))
+                    records.append(json.loads(f.readline()))
+            except Exception:
+                continue  # сегмент удален ротацией между запросами
+        return records, total
+
+
 # ========== БАЗА ДАННЫХ С СИСТЕМОЙ РОЛЕЙ И БАНОМ ==========
 class Database:
     def __init__(self):
-        self.users: Dict[int, Dict] = {}
-        self.tasks: Dict[int, Dict] = {}
+        self.users: Dict[int, User] = {}
+        self.tasks: Dict[int, Task] = {}
+        self.columns = TaskColumns()  # колоночная копия tasks для статистики
+        self.archive = TaskArchive(ARCHIVE_FILE)  # давно выполненные задачи (вне self.tasks)
+        # Задачи неактивных пользователей, выгруженные из памяти (блок на пользователя)
+        self.pages = TaskPages(PAGE_FILE)
+        self._paged_users: Set[int] = set()
+        # Пользователи, подгруженные из PAGE_FILE: их блоки убираются после ближайшего сохранения снапшота
+        self._paged_in: Set[int] = set()
+        self._lru: "OrderedDict[int, None]" = OrderedDict()  # пользователи с задачами в памяти
+        self.paging_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
         self.task_counter = 0
+        self.version = 0  # растет при каждом изменении данных (инвалидация кэшей)
+        self._task_versions: Dict[int, int] = {}  # task_id -> штамп последнего изменения (0 — не менялась)
+        self._task_stamps = itertools.count(1)
         self.admin_stats = {
             'total_tasks': 0,
             'completed_tasks': 0,
-            'active_users': set(),
-            'tasks_today': 0,
-            'users_today': set()
+            'active_users': set()
         }
+        self.daily = DailyCounters()  # события по дням: сегодня / 7 / 30 дней
+        self._stats_loaded = False  # агрегаты задач прочитаны из снапшота (иначе — пересчет при старте)
         
                 # Система ролей и банов
         self.roles: Dict[int, str] = {}  # user_id -> role (creator/admin/user)
         self.banned_users: Set[int] = set()  # Забаненные пользователи (для быстрого подсчета/экспорта)
         self.ban_info: Dict[int, Dict] = {}  # user_id -> {reason, by, at, until}
-        self.user_warnings: Dict[int, int] = {}  # user_id -> warnings        self.ban_history: List[Dict] = []  # аудит банов/разбанов
+        self.user_warnings: Dict[int, int] = {}  # user_id -> warnings
+        self.audit = AuditLog(AUDIT_FILE, AUDIT_SEGMENT_MAX_MB * 1024 * 1024, AUDIT_MAX_SEGMENTS)
+        self._pending_audit: List[Dict] = []  # пишутся вместе с состоянием безопасности
         self.security_state_file = STATE_FILE
         self.data_file = DATA_FILE
 
@@ -99,23 +1310,24 @@ class Database:
 
         # Создателя тоже держим в users (чтобы не терялся в экспорте/статистике)
         if CREATOR_ID not in self.users:
-            self.users[CREATOR_ID] = {
-                'user_id': CREATOR_ID,
-                'username': 'creator',
-                'full_name': 'Создатель бота',
-                'joined': datetime.now(),
-                'task_count': 0,
-                'completed_count': 0,
-                'last_active': datetime.now(),
-                'warnings': 0
-            }
+            now = _now_ts()
+            self.users[CREATOR_ID] = User(
+                user_id=CREATOR_ID,
+                username='creator',
+                full_name='Создатель бота',
+                joined=now,
+                last_active=now,
+            )
 
         # Синхронизируем warnings из security-state в users
         for uid, user in self.users.items():
-            user['warnings'] = int(self.user_warnings.get(uid, user.get('warnings', 0)))
+            user.warnings = int(self.user_warnings.get(uid, user.warnings))
 
+        self._init_paging()
         self._rebuild_admin_stats()
+        self.archive_completed_tasks()
         self._save_data()
+        self._enforce_memory_budget()
     
     def add_user(self, user_id: int, username: str, full_name: str):
         """Добавление пользователя с проверкой на бан"""
@@ -123,16 +1335,15 @@ class Database:
             return False
         
         if user_id not in self.users:
-            self.users[user_id] = {
-                'user_id': user_id,
-                'username': username,
-                'full_name': full_name,
-                'joined': datetime.now(),
-                'task_count': 0,
-                'completed_count': 0,
-                'last_active': datetime.now(),
-                'warnings': self.user_warnings.get(user_id, 0)  # Количество предупреждений
-            }
+            now = _now_ts()
+            self.users[user_id] = User(
+                user_id=user_id,
+                username=username,
+                full_name=full_name,
+                joined=now,
+                last_active=now,
+                warnings=self.user_warnings.get(user_id, 0)  # Количество предупреждений
+            )
             
             # Установка роли по умолчанию
             if user_id not in self.roles:
@@ -141,8 +1352,8 @@ class Database:
                 else:
                     self.roles[user_id] = 'user'
             
-            if datetime.now().date() == self.users[user_id]['joined'].date():
-                self.admin_stats['users_today'].add(user_id)
+            self.daily.add('new_users', now)
+            self.daily.mark_active(user_id, now)
 
             self._save_data()
         return True
@@ -186,7 +1397,8 @@ class Database:
         target_id: int,
         reason: str = "Нарушение правил",
         duration_seconds: Optional[int] = None,
-        purge_tasks: Optional[bool] = None
+        purge_tasks: Optional[bool] = None,
+        save: bool = True
     ) -> bool:
         """Бан пользователя.
 
@@ -197,6 +1409,8 @@ class Database:
         purge_tasks:
             • None -> берется из PURGE_TASKS_ON_BAN
             • bool -> принудительно
+
+        save=False — не сохранять состояние (сохраняет вызывающий, см. moderate_users)
         """
         if target_id == CREATOR_ID:
             return False  # Нельзя банить создателя
@@ -220,31 +1434,20 @@ class Database:
 
         # Удаляем задачи забаненного пользователя (если включено)
         if purge_tasks:
-            task_ids_to_delete = [tid for tid, task in self.tasks.items() if task['user_id'] == target_id]
-            for task_id in task_ids_to_delete:
-                self.delete_task(task_id)
+            self.delete_user_tasks(target_id, save=save)
 
         # Удаляем из статистики
         self.admin_stats['active_users'].discard(target_id)
-        self.admin_stats['users_today'].discard(target_id)
+        self.daily.forget_user(target_id)
 
-        # Журнал действий (не обязателен, но удобен для аудита)
-        if not hasattr(self, "ban_history"):
-            self.ban_history: List[Dict] = []
-        self.ban_history.append({
-            "action": "ban",
-            "user_id": target_id,
-            "by": manager_id,
-            "reason": reason,
-            "at": now.isoformat(),
-            "until": until.isoformat() if until else None,
-        })
+        self._audit("ban", target_id, manager_id, reason=reason, until=until.isoformat() if until else None)
 
-        self._save_security_state()
+        if save:
+            self._save_security_state()
         logger.info(f"User {target_id} banned by {manager_id}. Reason: {reason}. Until: {until}")
         return True
 
-    def unban_user(self, manager_id: int, target_id: int, note: str = "") -> bool:
+    def unban_user(self, manager_id: int, target_id: int, note: str = "", save: bool = True) -> bool:
         """Разбан пользователя"""
         if not self.can_unban_user(manager_id, target_id):
             return False
@@ -253,22 +1456,15 @@ class Database:
             self.ban_info.pop(target_id, None)
             self.banned_users.discard(target_id)
 
-            if not hasattr(self, "ban_history"):
-                self.ban_history: List[Dict] = []
-            self.ban_history.append({
-                "action": "unban",
-                "user_id": target_id,
-                "by": manager_id,
-                "note": note,
-                "at": datetime.now().isoformat(),
-            })
+            self._audit("unban", target_id, manager_id, note=note)
 
-            self._save_security_state()
+            if save:
+                self._save_security_state()
             logger.info(f"User {target_id} unbanned by {manager_id}")
             return True
         return False
 
-    def warn_user(self, manager_id: int, target_id: int, reason: str = "") -> int:
+    def warn_user(self, manager_id: int, target_id: int, reason: str = "", save: bool = True) -> int:
         """Выдать предупреждение. Возвращает текущее число предупреждений.
 
         При достижении WARN_LIMIT — автоматически банит на AUTO_BAN_HOURS (без удаления задач).
@@ -279,38 +1475,112 @@ class Database:
         current = self.user_warnings.get(target_id, 0) + 1
         self.user_warnings[target_id] = current
         if target_id in self.users:
-            self.users[target_id]['warnings'] = current
+            self.users[target_id].warnings = current
+
+        self._audit("warn", target_id, manager_id, reason=reason, count=current)
 
         if current >= WARN_LIMIT:
             # Сбрасываем предупреждения и выдаем временный бан
             self.user_warnings[target_id] = 0
             if target_id in self.users:
-                self.users[target_id]['warnings'] = 0
+                self.users[target_id].warnings = 0
             self.ban_user(
                 manager_id,
                 target_id,
                 reason=reason or f"Автобан после {WARN_LIMIT} предупреждений",
                 duration_seconds=AUTO_BAN_HOURS * 3600,
-                purge_tasks=False
+                purge_tasks=False,
+                save=save
             )
 
-        self._save_security_state()
-        self._save_data()
+        if save:
+            self._save_security_state()
+            self._save_data()
         return self.user_warnings.get(target_id, 0)
 
+    def moderate_users(
+        self,
+        manager_id: int,
+        action: str,
+        target_ids,
+        reason: str = "",
+        duration_seconds: Optional[int] = None
+    ) -> Dict[str, List[int]]:
+        """Массовая модерация одним пакетом: права проверяются по каждому id,
+        состояние безопасности и данные сохраняются один раз в конце.
+
+        action: 'ban' | 'tban' | 'unban' | 'warn'
+        Возвращает {"done": [...], "denied": [...], "skipped": [...]}
+        """
+        result: Dict[str, List[int]] = {"done": [], "denied": [], "skipped": []}
+        for target_id in dict.fromkeys(target_ids):  # без дублей, порядок сохраняется
+            if action == 'warn':
+                if not self.can_manage_user(manager_id, target_id):
+                    result["denied"].append(target_id)
+                    continue
+                self.warn_user(manager_id, target_id, reason=reason, save=False)
+                result["done"].append(target_id)
+                continue
+
+            if not self.can_ban_user(manager_id, target_id):
+                result["denied"].append(target_id)
+            elif action == 'unban':
+                ok = self.unban_user(manager_id, target_id, note=reason, save=False)
+                result["done" if ok else "skipped"].append(target_id)
+            else:
+                ok = self.ban_user(
+                    manager_id,
+                    target_id,
+                    reason=reason or "Нарушение правил",
+                    duration_seconds=duration_seconds if action == 'tban' else None,
+                    purge_tasks=False if action == 'tban' else None,
+                    save=False
+                )
+                result["done" if ok else "skipped"].append(target_id)
+
+        if result["done"]:
+            self._save_security_state()
+            if action != 'unban':
+                self._save_data()  # удаленные задачи / счетчики предупреждений
+            logger.info(f"Mass {action} by {manager_id}: {len(result['done'])} users")
+        return result
+
     def clear_warnings(self, manager_id: int, target_id: int) -> bool:
         """Сброс предупреждений"""
         if not self.can_manage_user(manager_id, target_id):
             return False
         self.user_warnings[target_id] = 0
         if target_id in self.users:
-            self.users[target_id]['warnings'] = 0
+            self.users[target_id].warnings = 0
+        self._audit("clearwarn", target_id, manager_id)
         self._save_security_state()
         self._save_data()
         return True
 
+    def _audit(self, action: str, target_id: int, manager_id: Optional[int], **details) -> None:
+        """Запись в журнал модерации (сбрасывается на диск в _save_security_state)"""
+        self._pending_audit.append({
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "action": action,
+            "user_id": target_id,
+            "by": manager_id,
+            **details,
+        })
+
+    async def get_audit(self, user_id: int, by_moderator: bool = False, page: int = 0) -> tuple:
+        """Страница журнала модерации по пользователю/модератору -> (records, total)"""
+        await self.audit.build_index()
+        return self.audit.query(user_id, by_moderator, offset=page * AUDIT_PAGE_SIZE, limit=AUDIT_PAGE_SIZE)
+
     def _save_security_state(self) -> None:
         """Сохранение ролей/банов/предупреждений в файл (переживает перезапуск)."""
+        self.version += 1
+        if self._pending_audit:
+            records, self._pending_audit = self._pending_audit, []
+            try:
+                self.audit.append(records)
+            except Exception as e:
+                logger.exception(f"Failed to write audit log: {e}")
         try:
             data = {
                 "roles": {str(k): v for k, v in self.roles.items()},
@@ -360,38 +1630,20 @@ class Database:
             logger.exception(f"Failed to load security state: {e}")
 
     # ====== ПЕРСИСТЕНТНОЕ ХРАНЕНИЕ ДАННЫХ (users/tasks) ======
-    def _dt_to_str(self, dt: Optional[datetime]) -> Optional[str]:
-        return dt.isoformat() if isinstance(dt, datetime) else None
-
-    def _str_to_dt(self, s: Optional[str]) -> Optional[datetime]:
-        if not s:
-            return None
-        try:
-            return datetime.fromisoformat(s)
-        except Exception:
-            return None
-
     def _save_data(self) -> None:
-        """Сохранение users/tasks/task_counter в JSON (переживает перезапуск)."""
+        """Сохранение users/tasks/task_counter в JSON (переживает перезапуск).
+
+        Каждое изменение данных заканчивается сохранением — здесь же растет self.version.
+        """
+        self.version += 1
         try:
             data = {
                 "task_counter": int(self.task_counter),
-                "users": [
-                    {
-                        **{k: v for k, v in u.items() if k not in ("joined", "last_active")},
-                        "joined": self._dt_to_str(u.get("joined")),
-                        "last_active": self._dt_to_str(u.get("last_active")),
-                    }
-                    for u in self.users.values()
-                ],
-                "tasks": [
-                    {
-                        **{k: v for k, v in t.items() if k not in ("created", "completed_at")},
-                        "created": self._dt_to_str(t.get("created")),
-                        "completed_at": self._dt_to_str(t.get("completed_at")),
-                    }
-                    for t in self.tasks.values()
-                ],
+                "users": [u.to_dict() for u in self.users.values()],
+                "tasks": [t.to_dict() for t in self.tasks.values()],
+                # Агрегаты по всем задачам (включая архив) — чтобы не пересчитывать их при старте
+                "task_stats": self.columns.stats_to_dict(),
+                "daily": self.daily.to_dict(),
                 "saved_at": datetime.now().isoformat(),
             }
 
@@ -401,114 +1653,88 @@ class Database:
             os.replace(tmp, self.data_file)
         except Exception as e:
             logger.exception(f"Failed to save data state: {e}")
+            return
+        
+        if self._paged_in:
+            # Подгруженные задачи теперь есть в снапшоте — их блоки в PAGE_FILE больше не нужны
+            self.pages.drop(self._paged_in)
+            self._paged_in.clear()
 
     def _load_data(self) -> None:
-        """Загрузка users/tasks/task_counter из JSON."""
+        """Загрузка users/tasks/task_counter из JSON.
+
+        Файл разбирается потоково: каждая запись users/tasks сразу превращается
+        в User/Task (и строку колонок статистики), без полного дерева JSON в памяти.
+        Агрегаты задач и суточные счетчики берутся из снапшота, если он их содержит.
+        """
         try:
             if not os.path.exists(self.data_file):
                 return
 
+            users: Dict[int, User] = {}
+            tasks: Dict[int, Task] = {}
+            columns = TaskColumns()
+
+            def on_user(u) -> None:
+                user = User.from_dict(u)
+                if user is not None:
+                    users[user.user_id] = user
+
+            def on_task(t) -> None:
+                task = Task.from_dict(t)
+                if task is not None:
+                    tasks[task.id] = task
+                    columns.load(task)
+
             with open(self.data_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+                data = _stream_json_object(f, {"users": on_user, "tasks": on_task})
 
-            # users
-            users: Dict[int, Dict] = {}
-            for u in data.get("users", []) or []:
-                if not isinstance(u, dict):
-                    continue
-                uid_raw = u.get("user_id")
-                if uid_raw is None:
-                    continue
-                uid = int(uid_raw)
-                u2 = dict(u)
-                u2["user_id"] = uid
-                u2["joined"] = self._str_to_dt(u.get("joined")) or datetime.now()
-                u2["last_active"] = self._str_to_dt(u.get("last_active")) or u2["joined"]
-                u2["warnings"] = int(u2.get("warnings", 0))
-                u2["task_count"] = int(u2.get("task_count", 0))
-                u2["completed_count"] = int(u2.get("completed_count", 0))
-                users[uid] = u2
             self.users = users
-
-            # tasks
-            tasks: Dict[int, Dict] = {}
-            max_task_id = 0
-            for t in data.get("tasks", []) or []:
-                if not isinstance(t, dict):
-                    continue
-                tid_raw = t.get("id")
-                if tid_raw is None:
-                    continue
-                tid = int(tid_raw)
-                if tid <= 0:
-                    continue
-                t2 = dict(t)
-                t2["id"] = tid
-                t2["user_id"] = int(t2.get("user_id", 0))
-                t2["text"] = str(t2.get("text", ""))
-                t2["category"] = str(t2.get("category", "Общее"))
-                t2["priority"] = str(t2.get("priority", "medium"))
-                t2["created"] = self._str_to_dt(t.get("created")) or datetime.now()
-                t2["completed"] = bool(t2.get("completed", False))
-                t2["completed_at"] = self._str_to_dt(t.get("completed_at"))
-                tasks[tid] = t2
-                max_task_id = max(max_task_id, tid)
             self.tasks = tasks
+            self.columns = columns
+            max_task_id = max(tasks, default=0)
 
             self.task_counter = int(data.get("task_counter", max_task_id) or max_task_id)
             if self.task_counter < max_task_id:
                 self.task_counter = max_task_id
+            
+            if isinstance(data.get("task_stats"), dict):
+                columns.load_stats(data["task_stats"])
+                self.daily.load(data.get("daily") or {})
+                self._stats_loaded = True
         except Exception as e:
             logger.exception(f"Failed to load data state: {e}")
 
     def _rebuild_admin_stats(self) -> None:
-        """Пересчет статистики по данным (на случай перезапуска/битых счетчиков)."""
-        # Сбрасываем счетчики у пользователей, затем считаем по tasks
-        for u in self.users.values():
-            u["task_count"] = 0
-            u["completed_count"] = 0
-
-        total_tasks = 0
-        completed_tasks = 0
-        active_users: Set[int] = set()
+        """Счетчики при старте. Агрегаты задач и суточные счетчики берутся из снапшота;
+        полный проход по всем задачам (с выгруженными и архивом) — только если их там нет
+        (файл старого формата), после первого сохранения он больше не нужен."""
+        if not self._stats_loaded:
+            self._recount_tasks()
 
-        today = datetime.now().date()
-        tasks_today = 0
-
-        for t in self.tasks.values():
-            total_tasks += 1
-            if t.get("completed"):
-                completed_tasks += 1
-
-            uid = int(t.get("user_id", 0))
-            active_users.add(uid)
-
-            if uid in self.users:
-                self.users[uid]["task_count"] += 1
-                if t.get("completed"):
-                    self.users[uid]["completed_count"] += 1
-
-            created = t.get("created")
-            if isinstance(created, datetime) and created.date() == today:
-                tasks_today += 1
-
-        users_today: Set[int] = set()
         for uid, u in self.users.items():
-            joined = u.get("joined")
-            if isinstance(joined, datetime) and joined.date() == today:
-                users_today.add(uid)
+            u.task_count, u.completed_count = self.columns.user_totals(uid)
+            self.daily.add('new_users', u.joined)
+            if uid not in self.banned_users:
+                self.daily.mark_active(uid, u.last_active)
 
         self.admin_stats = {
-            "total_tasks": total_tasks,
-            "completed_tasks": completed_tasks,
-            "active_users": active_users,
-            "tasks_today": tasks_today,
-            "users_today": users_today,
+            "total_tasks": self.columns.total,
+            "completed_tasks": self.columns.completed_total,
+            "active_users": self.columns.users_with_tasks(),
         }
 
-
-
-    def set_admin(self, user_id: int) -> bool:
+    def _recount_tasks(self) -> None:
+        """Пересчет агрегатов и суточных счетчиков задач по всем задачам, включая архив"""
+        self.daily = DailyCounters()
+        for t in itertools.chain(self.tasks.values(), self.pages.iter_tasks(), self.archive.iter_tasks()):
+            self.columns.count(t)
+            self.daily.add('tasks_created', t.created)
+            if t.completed:
+                self.daily.add('tasks_completed', t.completed_at)
+        logger.info(f"Task stats recounted: {self.columns.total} tasks")
+
+    def set_admin(self, user_id: int, manager_id: Optional[int] = None) -> bool:
         """Назначение пользователя админом"""
         if user_id == CREATOR_ID:
             return False  # Создатель уже выше админа
@@ -522,11 +1748,12 @@ class Database:
         if user_id not in ADMIN_IDS:
             ADMIN_IDS.add(user_id)
 
+        self._audit("promote", user_id, manager_id)
         self._save_security_state()
         logger.info(f"User {user_id} promoted to admin")
         return True
 
-    def remove_admin(self, user_id: int) -> bool:
+    def remove_admin(self, user_id: int, manager_id: Optional[int] = None) -> bool:
         """Снятие пользователя с админки"""
         if user_id == CREATOR_ID:
             return False  # Нельзя снять создателя
@@ -538,6 +1765,7 @@ class Database:
             if user_id in ADMIN_IDS:
                 ADMIN_IDS.remove(user_id)
 
+            self._audit("demote", user_id, manager_id)
             self._save_security_state()
             logger.info(f"User {user_id} demoted from admin")
             return True
@@ -576,10 +1804,10 @@ class Database:
         return [user_id for user_id, role in self.roles.items() if role == 'admin']
     
     def get_all_users_with_roles(self) -> List[Dict]:
-        """Получение всех пользователей с информацией о ролях и бане"""
+        """Получение всех пользователей (dict для экспорта) с информацией о ролях и бане"""
         result = []
         for user_id, user_data in self.users.items():
-            user_copy = user_data.copy()
+            user_copy = user_data.to_dict()
             user_copy['role'] = self.get_user_role(user_id)
             user_copy['banned'] = self.is_banned(user_id)
             result.append(user_copy)
@@ -590,127 +1818,440 @@ class Database:
         if self.is_banned(user_id):
             return None
         
+        task = self._insert_task(user_id, text, category, Priority.MEDIUM)
+        self._save_data()
+        return task.id
+    
+    def add_tasks(self, user_id: int, items) -> int:
+        """Пакетное добавление задач (text, category, priority) с одним сохранением.
+
+        Возвращает число добавленных задач (0 — если пользователь забанен).
+        """
+        if self.is_banned(user_id):
+            return 0
+        
+        added = 0
+        for text, category, priority in items:
+            self._insert_task(user_id, text, category, priority)
+            added += 1
+        if added:
+            self._save_data()
+        return added
+    
+    def _insert_task(self, user_id: int, text: str, category: str, priority: Priority) -> Task:
+        """Создать задачу и обновить индексы/счетчики (без сохранения)"""
+        self._ensure_resident(user_id)  # задачи пользователя либо все в памяти, либо все в блоке
         self.task_counter += 1
-        self.tasks[self.task_counter] = {
-            'id': self.task_counter,
-            'user_id': user_id,
-            'text': text,
-            'category': category,
-            'created': datetime.now(),
-            'completed': False,
-            'completed_at': None,
-            'priority': 'medium'
-        }
+        task = Task(
+            id=self.task_counter,
+            user_id=user_id,
+            text=text,
+            category=sys.intern(category),
+            priority=priority,
+            created=_now_ts(),
+        )
+        self.tasks[task.id] = task
+        self.columns.add(task)
+        self._mark_resident(user_id)
         
         if user_id in self.users:
-            self.users[user_id]['task_count'] += 1
-            self.users[user_id]['last_active'] = datetime.now()
+            self.users[user_id].task_count += 1
+            self.users[user_id].last_active = task.created
         
         self.admin_stats['total_tasks'] += 1
         self.admin_stats['active_users'].add(user_id)
-        
-        if datetime.now().date() == self.tasks[self.task_counter]['created'].date():
-            self.admin_stats['tasks_today'] += 1
-        
-        self._save_data()
-        return self.task_counter
+        self.daily.add('tasks_created', task.created)
+        self.daily.mark_active(user_id, task.created)
+        return task
     
-    def get_user_tasks(self, user_id: int, completed: Optional[bool] = None) -> List[Dict]:
-        """Получение задач пользователя с проверкой на бан"""
+    def get_user_tasks(
+        self,
+        user_id: int,
+        completed: Optional[bool] = None,
+        include_archived: bool = False
+    ) -> List[Task]:
+        """Получение задач пользователя с проверкой на бан
+
+        include_archived — подгрузить из архива давно выполненные задачи (история).
+        """
         if self.is_banned(user_id):
             return []
         
         tasks = []
-        for task in self.tasks.values():
-            if task['user_id'] == user_id:
-                if completed is None or task['completed'] == completed:
-                    tasks.append(task)
-        return sorted(tasks, key=lambda x: x['created'], reverse=True)
+        for task in self._user_tasks(user_id):
+            if completed is None or task.completed == completed:
+                tasks.append(task)
+        if include_archived and completed is not False:
+            tasks.extend(self.archive.get_user_tasks(user_id))
+        return sorted(tasks, key=lambda x: (x.created, x.id), reverse=True)
+    
+    def get_user_summary(self, user_id: int) -> Dict:
+        """Сводка по задачам пользователя из колоночного хранилища (пустая для забаненных)"""
+        if self.is_banned(user_id):
+            return self.columns.user_summary(None)
+        return self.columns.user_summary(user_id)
     
-    def get_task(self, task_id: int) -> Optional[Dict]:
-        return self.tasks.get(task_id)
+    def _bump_task(self, task_id: int) -> None:
+        """Новый штамп версии задачи (инвалидирует ее отрисовку в кэше)"""
+        self._task_versions[task_id] = next(self._task_stamps)
     
-    def toggle_task(self, task_id: int) -> bool:
+    def task_version(self, task_id: int) -> int:
+        return self._task_versions.get(task_id, 0)
+    
+    def get_task(self, task_id: int) -> Optional[Task]:
         task = self.tasks.get(task_id)
-        if task and not self.is_banned(task['user_id']):
-            was_completed = task['completed']
-            task['completed'] = not task['completed']
-            task['completed_at'] = datetime.now() if task['completed'] else None
-            
-            user_id = task['user_id']
-            if user_id in self.users:
-                if task['completed'] and not was_completed:
-                    self.users[user_id]['completed_count'] += 1
-                elif not task['completed'] and was_completed:
-                    self.users[user_id]['completed_count'] -= 1
-            
-            if task['completed'] and not was_completed:
-                self.admin_stats['completed_tasks'] += 1
-            elif not task['completed'] and was_completed:
-                self.admin_stats['completed_tasks'] -= 1
-            
+        if task is None and self._paged_users:
+            # Выгруженная задача чужого пользователя (админка): владелец ищется в PAGE_FILE
+            owner = self.pages.owner(task_id)
+            if owner is not None and self._ensure_resident(owner):
+                task = self.tasks.get(task_id)
+        return task
+    
+    def find_task(self, task_id: int) -> Optional[Task]:
+        """Задача для просмотра: оперативная или архивная (копия из архива, в работу не
+        возвращается — это делают только изменения через _task_for_update)"""
+        return self.get_task(task_id) or self.archive.get(task_id)
+    
+    def _task_for_update(self, task_id: int) -> Optional[Task]:
+        """Задача, которую собираются изменить: архивная при этом возвращается в работу
+        (без сохранения — его делает сама операция)"""
+        return self.get_task(task_id) or self.restore_archived_task(task_id, save=False)
+    
+    def _set_completed(self, task: Task, completed: bool) -> bool:
+        """Сменить статус задачи с пересчетом счетчиков (без сохранения). True — если изменился."""
+        if task.completed == completed:
+            return False
+        if not completed:
+            self.daily.add('tasks_completed', task.completed_at, -1)
+        task.completed = completed
+        task.completed_at = _now_ts() if completed else None
+        self.columns.update(task)
+        self._bump_task(task.id)
+        if completed:
+            self.daily.add('tasks_completed', task.completed_at)
+        
+        delta = 1 if completed else -1
+        if task.user_id in self.users:
+            self.users[task.user_id].completed_count += delta
+        self.admin_stats['completed_tasks'] += delta
+        return True
+    
+    def toggle_task(self, task_id: int) -> bool:
+        task = self._task_for_update(task_id)
+        if task and not self.is_banned(task.user_id):
+            self._set_completed(task, not task.completed)
             self._save_data()
             return True
         return False
     
+    def _discount_task(self, task: Task) -> None:
+        """Вычесть задачу из счетчиков и колонок (без сохранения)"""
+        user_id = task.user_id
+        if user_id in self.users:
+            self.users[user_id].task_count -= 1
+            if task.completed:
+                self.users[user_id].completed_count -= 1
+        
+        if task.id in self.columns:
+            self.columns.remove(task.id)
+        else:
+            self.columns.count(task, -1)  # архивная задача: строки нет, только агрегаты
+        self.admin_stats['total_tasks'] -= 1
+        if task.completed:
+            self.admin_stats['completed_tasks'] -= 1
+    
+    def _unload_task(self, task: Task) -> None:
+        """Убрать задачу из оперативных данных со строкой колонок; счетчики и агрегаты
+        не меняются (архивация)"""
+        del self.tasks[task.id]
+        self.columns.unload(task.id)
+        self._task_versions.pop(task.id, None)
+    
+    def _drop_task(self, task: Task) -> None:
+        """Удалить задачу из оперативных данных и счетчиков (без сохранения)"""
+        self._discount_task(task)
+        self._unload_task(task)
+    
     def delete_task(self, task_id: int) -> bool:
-        task = self.tasks.get(task_id)
-        if task:
-            user_id = task['user_id']
-            if user_id in self.users:
-                self.users[user_id]['task_count'] -= 1
-                if task['completed']:
-                    self.users[user_id]['completed_count'] -= 1
-            
-            del self.tasks[task_id]
-            self.admin_stats['total_tasks'] -= 1
-            if task['completed']:
-                self.admin_stats['completed_tasks'] -= 1
+        return self.delete_tasks([task_id]) > 0
+    
+    def delete_tasks(self, task_ids, save: bool = True) -> int:
+        """Пакетное удаление задач: один проход по счетчикам и одно сохранение.
+
+        Возвращает число реально удаленных задач (несуществующие id пропускаются).
+        """
+        deleted = 0
+        for task_id in task_ids:
+            task = self._task_for_update(task_id)
+            if task is None:
+                continue
+            self._drop_task(task)
+            deleted += 1
+        if deleted and save:
             self._save_data()
-            return True
-        return False
+        return deleted
+    
+    def delete_user_tasks(self, user_id: int, save: bool = True) -> int:
+        """Удалить все задачи пользователя (включая выгруженные на диск и архивные)"""
+        archived = self.archive.get_user_tasks(user_id)
+        for task in archived:
+            self._discount_task(task)
+        if archived:
+            self.archive.remove([task.id for task in archived])
+        
+        self._ensure_resident(user_id)
+        deleted = self.delete_tasks(list(self.columns.user_task_ids(user_id)), save=False) + len(archived)
+        if deleted and save:
+            self._save_data()
+        return deleted
+    
+    # ----- Массовые операции пользователя (одна транзакция — одно сохранение) -----
+    def _owned_tasks(self, user_id: int, task_ids) -> List[Task]:
+        """Задачи из task_ids, принадлежащие пользователю (чужие и несуществующие пропускаются)"""
+        if self.is_banned(user_id):
+            return []
+        tasks = []
+        for task_id in task_ids:
+            task = self.get_task(task_id)
+            if task is not None and task.user_id == user_id:
+                tasks.append(task)
+        return tasks
+    
+    def bulk_complete_tasks(self, user_id: int, task_ids) -> int:
+        """Отметить выбранные задачи выполненными. Возвращает число измененных."""
+        changed = sum(self._set_completed(task, True) for task in self._owned_tasks(user_id, task_ids))
+        if changed:
+            self._save_data()
+        return changed
+    
+    def bulk_delete_tasks(self, user_id: int, task_ids) -> int:
+        """Удалить выбранные задачи пользователя. Возвращает число удаленных."""
+        return self.delete_tasks([task.id for task in self._owned_tasks(user_id, task_ids)])
+    
+    def bulk_move_tasks(self, user_id: int, task_ids, category: str) -> int:
+        """Перенести выбранные задачи в категорию. Возвращает число перенесенных."""
+        category = sys.intern(category)
+        moved = 0
+        for task in self._owned_tasks(user_id, task_ids):
+            if task.category != category:
+                task.category = category
+                self.columns.update(task)
+                self._bump_task(task.id)
+                moved += 1
+        if moved:
+            self._save_data()
+        return moved
+    
+    def archive_completed_tasks(self, older_than_days: Optional[int] = None) -> int:
+        """Перенос давно выполненных задач в архив. Возвращает число перенесенных задач.
+
+        older_than_days:
+            • None -> берется из ARCHIVE_COMPLETED_AFTER_DAYS
+            • 0    -> архивация отключена
+        """
+        days = ARCHIVE_COMPLETED_AFTER_DAYS if older_than_days is None else older_than_days
+        if not days:
+            return 0
+        
+        cutoff = _now_ts() - days * 86400
+        old_tasks = [t for t in self.tasks.values()
+                     if t.completed and t.completed_at is not None and t.completed_at < cutoff]
+        if not old_tasks:
+            return 0
+        
+        try:
+            self.archive.append(old_tasks)
+        except Exception as e:
+            logger.exception(f"Failed to archive tasks: {e}")
+            return 0
+        
+        # Из счетчиков и агрегатов задачи не убираются: статистика учитывает и архив
+        for task in old_tasks:
+            self._unload_task(task)
+        self._save_data()
+        logger.info(f"Archived {len(old_tasks)} completed tasks (older than {days} days)")
+        return len(old_tasks)
     
-    def get_all_tasks(self) -> List[Dict]:
-        return list(self.tasks.values())
+    def restore_archived_task(self, task_id: int, user_id: Optional[int] = None, save: bool = True) -> Optional[Task]:
+        """Вернуть задачу из архива в оперативные данные (user_id — проверка владельца)"""
+        task = self.archive.get(task_id)
+        if task is None or task_id in self.tasks:
+            return None
+        if user_id is not None and task.user_id != user_id:
+            return None
+        if self.is_banned(task.user_id):
+            return None
+        
+        # Счетчики и агрегаты уже учитывают архивную задачу — возвращаем объект и строку
+        self._ensure_resident(task.user_id)
+        self.tasks[task.id] = task
+        self.columns.load(task)
+        self._bump_task(task.id)
+        
+        self.archive.remove([task.id])
+        if save:
+            self._save_data()
+        return task
+    
+    def get_all_tasks(self) -> List[Task]:
+        """Все задачи, включая выгруженные из памяти (читаются с диска, не подгружаются)"""
+        return list(itertools.chain(self.tasks.values(), self.pages.iter_tasks()))
     
-    def get_all_users(self) -> List[Dict]:
+    def get_all_users(self) -> List[User]:
         return list(self.users.values())
     
-    def update_task_priority(self, task_id: int, priority: str) -> bool:
-        task = self.tasks.get(task_id)
-        if task and not self.is_banned(task['user_id']):
-            task['priority'] = priority
+    def update_task_priority(self, task_id: int, priority: Any) -> bool:
+        task = self._task_for_update(task_id)
+        if task and not self.is_banned(task.user_id):
+            task.priority = Priority.parse(priority)
+            self.columns.update(task)
+            self._bump_task(task.id)
             self._save_data()
             return True
         return False
     
     def update_task_category(self, task_id: int, category: str) -> bool:
-        task = self.tasks.get(task_id)
-        if task and not self.is_banned(task['user_id']):
-            task['category'] = category
+        task = self._task_for_update(task_id)
+        if task and not self.is_banned(task.user_id):
+            task.category = sys.intern(category)
+            self.columns.update(task)
+            self._bump_task(task.id)
             self._save_data()
             return True
         return False
     
     def update_task_text(self, task_id: int, text: str) -> bool:
-        task = self.tasks.get(task_id)
-        if task and not self.is_banned(task['user_id']):
-            task['text'] = text
+        task = self._task_for_update(task_id)
+        if task and not self.is_banned(task.user_id):
+            task.text = text
+            self._bump_task(task.id)
             self._save_data()
             return True
         return False
     
-    def get_tasks_by_category(self, user_id: int, category: str) -> List[Dict]:
+    def get_tasks_by_category(self, user_id: int, category: str) -> List[Task]:
         if self.is_banned(user_id):
             return []
-        return [task for task in self.tasks.values() 
-                if task['user_id'] == user_id and task['category'] == category]
+        return [task for task in self._user_tasks(user_id) if task.category == category]
     
-    def search_tasks(self, user_id: int, query: str) -> List[Dict]:
+    def search_tasks(self, user_id: int, query: str) -> List[Task]:
         if self.is_banned(user_id):
             return []
-        return [task for task in self.tasks.values() 
-                if task['user_id'] == user_id and query.lower() in task['text'].lower()]
+        return [task for task in self._user_tasks(user_id) if query.lower() in task.text.lower()]
+    
+    # ====== ОГРАНИЧЕНИЕ ПАМЯТИ (LRU-выгрузка задач неактивных пользователей) ======
+    def _user_tasks(self, user_id: int) -> List[Task]:
+        """Задачи пользователя в памяти (выгруженные подгружаются с диска)"""
+        self._ensure_resident(user_id)
+        return [self.tasks[tid] for tid in self.columns.user_task_ids(user_id) if tid in self.tasks]
+    
+    def _init_paging(self) -> None:
+        """Подготовка выгрузки при старте: сверка bot_data.json с PAGE_FILE и порядок LRU."""
+        resident = {t.user_id for t in self.tasks.values()}
+        # Задачи пользователя могли попасть и в снапшот, и в блок (сбой между записью блока
+        # и сохранением или между сохранением и надгробием) — снапшот новее
+        duplicates = [uid for uid in self.pages.user_ids() if uid in resident]
+        if duplicates:
+            self.pages.drop(duplicates)
+        self._paged_users = set(self.pages.user_ids())
+        
+        if not PAGING_MAX_RESIDENT_TASKS and self._paged_users:
+            # Выгрузку выключили — возвращаем все задачи в память (блоки уберет сохранение в __init__)
+            resident |= self._paged_users
+            for uid in list(self._paged_users):
+                self._ensure_resident(uid)
+        
+        for uid in sorted(resident, key=lambda u: self.users[u].last_active if u in self.users else 0):
+            self._lru[uid] = None
+    
+    def _mark_resident(self, user_id: int) -> None:
+        self._lru[user_id] = None
+        self._lru.move_to_end(user_id)
+    
+    def _ensure_resident(self, user_id: int) -> bool:
+        """Подгрузить задачи пользователя с диска, если они выгружены. True — если подгружали."""
+        if user_id not in self._paged_users:
+            return False
+        self.paging_stats['misses'] += 1
+        for task in self.pages.read(user_id):
+            self.tasks[task.id] = task
+            self.columns.load(task)  # в агрегатах задача учтена и на время выгрузки
+            self._bump_task(task.id)  # версия 0 могла остаться в кэше отрисовки с прошлого раза
+        self._paged_users.discard(user_id)
+        self._mark_resident(user_id)
+        # Блок из PAGE_FILE уберет ближайший _save_data (после того, как задачи попадут в снапшот);
+        # до этого при сбое они просто останутся выгруженными
+        self._paged_in.add(user_id)
+        return True
+    
+    def _evict_user(self, user_id: int) -> int:
+        """Выгрузить задачи пользователя на диск: в памяти остается только его агрегат."""
+        self._lru.pop(user_id, None)
+        task_ids = self.columns.user_task_ids(user_id)
+        if not task_ids:
+            return 0
+        self.pages.write(user_id, [self.tasks[tid] for tid in task_ids])
+        self._paged_in.discard(user_id)  # новый блок — актуальный
+        for tid in task_ids:
+            del self.tasks[tid]
+            self.columns.unload(tid)
+            self._task_versions.pop(tid, None)
+        self._paged_users.add(user_id)
+        self.paging_stats['evictions'] += 1
+        return len(task_ids)
+    
+    def _enforce_memory_budget(self, keep: Optional[int] = None, save: bool = True) -> int:
+        """Выгружать самых давно активных пользователей, пока задач в памяти больше бюджета.
+
+        Возвращает число выгруженных задач; save=False — сохранение делает вызывающий.
+        """
+        if not PAGING_MAX_RESIDENT_TASKS or len(self.tasks) <= PAGING_MAX_RESIDENT_TASKS:
+            return 0
+        evicted = 0
+        for uid in list(self._lru):
+            if len(self.tasks) <= PAGING_MAX_RESIDENT_TASKS:
+                break
+            if uid == keep:
+                continue
+            evicted += self._evict_user(uid)
+        if evicted:
+            if evicted > len(self.tasks):
+                # Словари не сжимаются при удалении — после крупной выгрузки пересобираем
+                self.tasks = dict(self.tasks)
+                self.columns.shrink()
+            if save:
+                self._save_data()
+            logger.info(f"Paged out {evicted} tasks; resident: {len(self.tasks)}")
+        return evicted
+    
+    def touch_user(self, user_id: int) -> None:
+        """Пользователь прислал update: отмечаем активность, обновляем LRU и подгружаем его задачи при необходимости."""
+        user = self.users.get(user_id)
+        if user is not None:
+            user.last_active = _now_ts()
+            if self.daily.mark_active(user_id, user.last_active):
+                self.version += 1
+        if not PAGING_MAX_RESIDENT_TASKS:
+            return
+        paged_in = self._ensure_resident(user_id)
+        if not paged_in:
+            self.paging_stats['hits'] += 1
+        self._mark_resident(user_id)
+        # Одно сохранение на цикл подгрузка + выгрузка
+        if self._enforce_memory_budget(keep=user_id, save=False) or paged_in:
+            self._save_data()
+    
+    def get_paging_stats(self) -> Dict:
+        """Метрики выгрузки: задачи/пользователи в памяти и на диске, hit/miss"""
+        lookups = self.paging_stats['hits'] + self.paging_stats['misses']
+        return {
+            **self.paging_stats,
+            'hit_rate': (self.paging_stats['hits'] / lookups * 100) if lookups else 0.0,
+            'resident_tasks': len(self.tasks),
+            'resident_users': len(self._lru),
+            'paged_users': len(self._paged_users),
+            'budget': PAGING_MAX_RESIDENT_TASKS,
+        }
 
 db = Database()
 
@@ -723,6 +2264,9 @@ class TaskStates(StatesGroup):
     editing_category = State()
     editing_priority = State()
     searching_tasks = State()
+    selecting_tasks = State()  # Мультивыбор в списке задач
+    bulk_custom_category = State()  # Своя категория для переноса выбранных
+    waiting_import_file = State()  # Ожидание CSV/JSON-файла для импорта
 
 class AdminStates(StatesGroup):
     waiting_broadcast = State()
@@ -734,10 +2278,130 @@ class AdminStates(StatesGroup):
     waiting_ban_user_id = State()  # Для бана пользователя
     waiting_unban_user_id = State()  # Для разбана пользователя
     waiting_ban_reason = State()  # Для причины бана
+    waiting_mass_ban_ids = State()  # Список id для массового бана
+
+# ========== CALLBACK-ДАННЫЕ ==========
+# Формат callback_data: "<префикс>:<арг>:<арг>...". Префикс ищется в словаре одним обращением,
+# аргументы приводятся к типам, объявленным в маршруте; последний аргумент забирает остаток
+# строки, поэтому в нем допустим ':' (например, в названии категории).
+CALLBACK_SEP = ":"
+
+def cb(prefix: str, *args) -> str:
+    """Собрать callback_data для маршрута prefix"""
+    return CALLBACK_SEP.join((prefix, *map(str, args)))
+
+class CallbackRoutes:
+    """Таблица обработчиков callback'ов по префиксу"""
+
+    def __init__(self):
+        # префикс -> (обработчик, типы аргументов, нужен ли state, ответ до обработчика)
+        self._routes: Dict[str, tuple] = {}
+
+    def route(self, prefix: str, *arg_types, answer_first: Optional[str] = None):
+        """Декоратор: зарегистрировать обработчик для callback_data с префиксом prefix.
+
+        answer_first — для тяжелых обработчиков: ответить на callback этим текстом
+        ("" — без текста) до запуска обработчика, а не после него.
+        """
+        def decorator(handler):
+            if prefix in self._routes:
+                raise ValueError(f"Маршрут callback'а уже зарегистрирован: {prefix}")
+            wants_state = "state" in inspect.signature(handler).parameters
+            self._routes[prefix] = (handler, arg_types, wants_state, answer_first)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Optional[tuple]:
+        """Разобрать callback_data: (обработчик, аргументы, нужен ли state, ответ до обработчика) или None"""
+        prefix, _, rest = data.partition(CALLBACK_SEP)
+        route = self._routes.get(prefix)
+        if route is None:
+            return None
+        handler, arg_types, wants_state, answer_first = route
+        parts = rest.split(CALLBACK_SEP, len(arg_types) - 1) if arg_types else []
+        if len(parts) != len(arg_types) or (not arg_types and rest):
+            return None
+        try:
+            args = tuple(t(p) for t, p in zip(arg_types, parts))
+        except ValueError:
+            return None
+        return handler, args, wants_state, answer_first
+
+
+callbacks = CallbackRoutes()
+
+@router.callback_query()
+async def dispatch_callback(callback: CallbackQuery, state: FSMContext):
+    """Единая точка входа для всех callback'ов: разбор и вызов обработчика по таблице.
+
+    Если обработчик сам не ответил на callback, отвечаем пустым ответом после него,
+    чтобы у пользователя не крутились «часики» до таймаута Telegram.
+    """
+    resolved = callbacks.resolve(callback.data or "")
+    if resolved is None:
+        await callback.answer("Кнопка устарела, откройте меню заново.", show_alert=True)
+        return
+    handler, args, wants_state, answer_first = resolved
+    if answer_first is not None:
+        await callback.answer(answer_first or None)
+    try:
+        if wants_state:
+            return await handler(callback, state, *args)
+        return await handler(callback, *args)
+    finally:
+        if not answer_tracker.is_answered(callback.id):
+            try:
+                await callback.answer()
+            except Exception:
+                logger.exception("Не удалось ответить на callback")
 
 # ========== КЛАВИАТУРЫ ==========
+class KeyboardRegistry:
+    """Статические клавиатуры: каждая строится один раз на (вид, action, роль) и дальше
+    отдается один и тот же объект разметки — общий для всех пользователей.
+
+    Разметка aiogram изменяема, а копия (model_copy(deep=True)) обходится дороже повторной
+    сборки, поэтому объекты не копируются: вызывающий код не должен их менять. Чтобы
+    дополнить клавиатуру, собирайте новую из ее строк (см. bulk_move_start)."""
+
+    def __init__(self):
+        self._builders: Dict[str, Any] = {}
+        self._markups: Dict[tuple, Any] = {}
+        self.build_counts: Dict[str, int] = {}  # роль ('*' — не зависит от роли) -> сколько построено
+
+    def register(self, kind: str, builder) -> None:
+        self._builders[kind] = builder
+
+    def get(self, kind: str, action: Optional[str] = None, role: Optional[str] = None):
+        """Общий объект разметки — только для отправки, не изменять"""
+        key = (kind, action, role)
+        markup = self._markups.get(key)
+        if markup is None:
+            kwargs = {k: v for k, v in (("action", action), ("role", role)) if v is not None}
+            markup = self._markups[key] = self._builders[kind](**kwargs)
+            self.build_counts[role or '*'] = self.build_counts.get(role or '*', 0) + 1
+        return markup
+
+    def prebuild(self) -> None:
+        """Построить все известные варианты заранее (при старте бота)"""
+        for role in ('user', 'admin', 'creator'):
+            self.get("main", role=role)
+        for role in ('admin', 'creator'):
+            self.get("admin", role=role)
+        for action in ('create', 'edit'):
+            self.get("priority", action=action)
+        for action in ('create', 'edit', 'bulk'):
+            self.get("category", action=action)
+        self.get("export")
+
+
+keyboards = KeyboardRegistry()
+
 def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     """Основная клавиатура для пользователя"""
+    return keyboards.get("main", role=db.get_user_role(user_id))
+
+def _build_main_keyboard(role: str) -> ReplyKeyboardMarkup:
     builder = ReplyKeyboardBuilder()
     
     builder.add(KeyboardButton(text="📝 Создать задачу"))
@@ -748,8 +2412,7 @@ def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     builder.add(KeyboardButton(text="📂 По категориям"))
     
     # Админ-кнопки для админов и создателя
-    user_role = db.get_user_role(user_id)
-    if user_role in ['admin', 'creator']:
+    if role in ['admin', 'creator']:
         builder.add(KeyboardButton(text="⚙️ Админ-панель"))
     
     builder.adjust(2, 2, 2)
@@ -757,9 +2420,11 @@ def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
 
 def get_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура админ-панели в зависимости от роли"""
+    return keyboards.get("admin", role=db.get_user_role(user_id))
+
+def _build_admin_keyboard(role: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    
-    user_role = db.get_user_role(user_id)
+    user_role = role
     
     builder.add(InlineKeyboardButton(
         text="📊 Статистика бота",
@@ -812,6 +2477,10 @@ def get_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
             text="📋 Список админов",
             callback_data="admin_list_admins"
         ))
+        builder.add(InlineKeyboardButton(
+            text="🚫 Массовый бан",
+            callback_data="admin_mass_ban"
+        ))
     elif user_role == 'admin':
         builder.add(InlineKeyboardButton(
             text="👑 Назначить админа",
@@ -829,6 +2498,10 @@ def get_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
             text="🚫 Список банов",
             callback_data="admin_bans"
         ))
+        builder.add(InlineKeyboardButton(
+            text="🚫 Массовый бан",
+            callback_data="admin_mass_ban"
+        ))
     
     builder.add(InlineKeyboardButton(
         text="🔙 Главное меню",
@@ -837,29 +2510,50 @@ def get_admin_keyboard(user_id: int) -> InlineKeyboardMarkup:
     
     # Настраиваем расположение кнопок
     if user_role == 'creator':
-        builder.adjust(2, 2, 2, 2, 2, 2, 1)
+        builder.adjust(2, 2, 2, 2, 2, 2, 1, 1)
     elif user_role == 'admin':
-        builder.adjust(2, 2, 2, 2, 2, 1)
+        builder.adjust(2, 2, 2, 2, 2, 1, 1)
     else:
         builder.adjust(2, 1)
     
     return builder.as_markup()
 
-def get_tasks_keyboard(tasks: List[Dict], page: int = 0, tasks_per_page: int = 5) -> InlineKeyboardMarkup:
-    """Клавиатура для списка задач"""
+def get_tasks_keyboard(
+    tasks: List[Task],
+    page: int = 0,
+    tasks_per_page: int = 5,
+    selected: Optional[Set[int]] = None,
+    multiselect: bool = False
+) -> InlineKeyboardMarkup:
+    """Клавиатура для списка задач
+
+    selected:
+        • None -> обычный режим (кнопка открывает задачу)
+        • set  -> режим мультивыбора: чекбоксы и действия над выбранными
+    multiselect — показать кнопку входа в режим мультивыбора.
+    """
     builder = InlineKeyboardBuilder()
+    selecting = selected is not None
+    page_prefix = "bulk_page" if selecting else "tasks_page"
     
     start_idx = page * tasks_per_page
     end_idx = start_idx + tasks_per_page
     page_tasks = tasks[start_idx:end_idx]
     
     for task in page_tasks:
-        status = "✅" if task['completed'] else "⏳"
-        emoji = "🔴" if task['priority'] == 'high' else "🟡" if task['priority'] == 'medium' else "🟢"
-        btn_text = f"{status} {emoji} {task['text'][:30]}"
+        emoji = PRIORITY_EMOJI[task.priority]
+        if selecting:
+            mark = "☑️" if task.id in selected else "⬜"
+            builder.row(InlineKeyboardButton(
+                text=f"{mark} {emoji} {task.text[:30]}",
+                callback_data=cb("bulk_toggle", task.id)
+            ))
+            continue
+        status = "✅" if task.completed else "⏳"
+        btn_text = f"{status} {emoji} {task.text[:30]}"
         builder.row(InlineKeyboardButton(
             text=btn_text,
-            callback_data=f"task_detail_{task['id']}"
+            callback_data=cb("task_detail", task.id)
         ))
     
     # Навигация
@@ -868,23 +2562,35 @@ def get_tasks_keyboard(tasks: List[Dict], page: int = 0, tasks_per_page: int = 5
     if page > 0:
         navigation_buttons.append(InlineKeyboardButton(
             text="⬅️ Назад", 
-            callback_data=f"tasks_page_{page-1}"
+            callback_data=cb(page_prefix, page-1)
         ))
     
-    navigation_buttons.append(InlineKeyboardButton(
-        text="❌ Закрыть", 
-        callback_data="close_menu"
-    ))
+    if not selecting:
+        navigation_buttons.append(InlineKeyboardButton(
+            text="❌ Закрыть", 
+            callback_data="close_menu"
+        ))
     
     if len(tasks) > end_idx:
         navigation_buttons.append(InlineKeyboardButton(
             text="Вперед ➡️", 
-            callback_data=f"tasks_page_{page+1}"
+            callback_data=cb(page_prefix, page+1)
         ))
     
     if navigation_buttons:
         builder.row(*navigation_buttons)
     
+    if selecting:
+        if selected:
+            builder.row(
+                InlineKeyboardButton(text="✅ Выполнить", callback_data="bulk_complete"),
+                InlineKeyboardButton(text="🗑 Удалить", callback_data="bulk_delete"),
+                InlineKeyboardButton(text="📂 Перенести", callback_data="bulk_move")
+            )
+        builder.row(InlineKeyboardButton(text="❌ Отмена выбора", callback_data="bulk_cancel"))
+    elif multiselect:
+        builder.row(InlineKeyboardButton(text="☑️ Выбрать несколько", callback_data="bulk_start"))
+    
     return builder.as_markup()
 
 def get_task_detail_keyboard(task_id: int, is_completed: bool) -> InlineKeyboardMarkup:
@@ -894,21 +2600,21 @@ def get_task_detail_keyboard(task_id: int, is_completed: bool) -> InlineKeyboard
     if not is_completed:
         builder.add(InlineKeyboardButton(
             text="✅ Отметить выполненной",
-            callback_data=f"complete_task_{task_id}"
+            callback_data=cb("complete_task", task_id)
         ))
     else:
         builder.add(InlineKeyboardButton(
             text="↩️ Вернуть в активные",
-            callback_data=f"uncomplete_task_{task_id}"
+            callback_data=cb("uncomplete_task", task_id)
         ))
     
     builder.add(InlineKeyboardButton(
         text="✏️ Редактировать",
-        callback_data=f"edit_task_{task_id}"
+        callback_data=cb("edit_task", task_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🗑 Удалить",
-        callback_data=f"delete_task_{task_id}"
+        callback_data=cb("delete_task", task_id)
     ))
     builder.add(InlineKeyboardButton(
         text="📋 К списку задач",
@@ -920,19 +2626,22 @@ def get_task_detail_keyboard(task_id: int, is_completed: bool) -> InlineKeyboard
 
 def get_priority_keyboard(action: str = "create") -> InlineKeyboardMarkup:
     """Клавиатура для выбора приоритета"""
+    return keyboards.get("priority", action=action)
+
+def _build_priority_keyboard(action: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     builder.add(InlineKeyboardButton(
         text="🔴 Высокий",
-        callback_data=f"priority_{action}_high"
+        callback_data=cb(f"priority_{action}", "high")
     ))
     builder.add(InlineKeyboardButton(
         text="🟡 Средний",
-        callback_data=f"priority_{action}_medium"
+        callback_data=cb(f"priority_{action}", "medium")
     ))
     builder.add(InlineKeyboardButton(
         text="🟢 Низкий",
-        callback_data=f"priority_{action}_low"
+        callback_data=cb(f"priority_{action}", "low")
     ))
     
     builder.adjust(1)
@@ -940,6 +2649,9 @@ def get_priority_keyboard(action: str = "create") -> InlineKeyboardMarkup:
 
 def get_category_keyboard(action: str = "create") -> InlineKeyboardMarkup:
     """Клавиатура для выбора категории"""
+    return keyboards.get("category", action=action)
+
+def _build_category_keyboard(action: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     categories = ["Работа", "Учеба", "Личное", "Здоровье", "Финансы", "Другое"]
@@ -947,18 +2659,18 @@ def get_category_keyboard(action: str = "create") -> InlineKeyboardMarkup:
     for category in categories:
         builder.add(InlineKeyboardButton(
             text=category,
-            callback_data=f"category_{action}_{category}"
+            callback_data=cb(f"category_{action}", category)
         ))
     
     builder.add(InlineKeyboardButton(
         text="✏️ Своя категория",
-        callback_data=f"category_{action}_custom"
+        callback_data=cb(f"category_{action}", "custom")
     ))
     
     builder.adjust(2)
     return builder.as_markup()
 
-def get_admin_tasks_keyboard(tasks: List[Dict], page: int = 0) -> InlineKeyboardMarkup:
+def get_admin_tasks_keyboard(tasks: List[Task], page: int = 0) -> InlineKeyboardMarkup:
     """Клавиатура для админского просмотра задач"""
     builder = InlineKeyboardBuilder()
     
@@ -968,13 +2680,12 @@ def get_admin_tasks_keyboard(tasks: List[Dict], page: int = 0) -> InlineKeyboard
     page_tasks = tasks[start_idx:end_idx]
     
     for task in page_tasks:
-        user = db.users.get(task['user_id'], {})
-        username = user.get('username', 'Без имени')
-        status = "✅" if task['completed'] else "⏳"
-        btn_text = f"{status} @{username}: {task['text'][:25]}"
+        username = getattr(db.users.get(task.user_id), 'username', 'Без имени')
+        status = "✅" if task.completed else "⏳"
+        btn_text = f"{status} @{username}: {task.text[:25]}"
         builder.row(InlineKeyboardButton(
             text=btn_text,
-            callback_data=f"admin_task_detail_{task['id']}"
+            callback_data=cb("admin_task_detail", task.id)
         ))
     
     # Навигация
@@ -982,7 +2693,7 @@ def get_admin_tasks_keyboard(tasks: List[Dict], page: int = 0) -> InlineKeyboard
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(
             text="⬅️ Назад",
-            callback_data=f"admin_tasks_page_{page-1}"
+            callback_data=cb("admin_tasks_page", page-1)
         ))
     
     nav_buttons.append(InlineKeyboardButton(
@@ -993,7 +2704,7 @@ def get_admin_tasks_keyboard(tasks: List[Dict], page: int = 0) -> InlineKeyboard
     if len(tasks) > end_idx:
         nav_buttons.append(InlineKeyboardButton(
             text="Вперед ➡️",
-            callback_data=f"admin_tasks_page_{page+1}"
+            callback_data=cb("admin_tasks_page", page+1)
         ))
     
     builder.row(*nav_buttons)
@@ -1005,15 +2716,12 @@ def get_categories_keyboard(user_id: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     # Получаем все уникальные категории пользователя
-    categories = set()
-    for task in db.tasks.values():
-        if task['user_id'] == user_id:
-            categories.add(task['category'])
+    categories = set(task.category for task in db.get_user_tasks(user_id))
     
     for category in sorted(categories):
         builder.add(InlineKeyboardButton(
             text=category,
-            callback_data=f"view_category_{category}"
+            callback_data=cb("view_category", category)
         ))
     
     builder.add(InlineKeyboardButton(
@@ -1030,19 +2738,19 @@ def get_edit_task_keyboard(task_id: int) -> InlineKeyboardMarkup:
     
     builder.add(InlineKeyboardButton(
         text="📝 Текст",
-        callback_data=f"edit_text_{task_id}"
+        callback_data=cb("edit_text", task_id)
     ))
     builder.add(InlineKeyboardButton(
         text="📂 Категория",
-        callback_data=f"edit_category_{task_id}"
+        callback_data=cb("edit_category", task_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🎯 Приоритет",
-        callback_data=f"edit_priority_{task_id}"
+        callback_data=cb("edit_priority", task_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🔙 Назад",
-        callback_data=f"task_detail_{task_id}"
+        callback_data=cb("task_detail", task_id)
     ))
     
     builder.adjust(2)
@@ -1050,19 +2758,22 @@ def get_edit_task_keyboard(task_id: int) -> InlineKeyboardMarkup:
 
 def get_export_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора формата экспорта"""
+    return keyboards.get("export")
+
+def _build_export_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
     builder.add(InlineKeyboardButton(
         text="📝 JSON",
-        callback_data="export_json"
+        callback_data=cb("export", "json")
     ))
     builder.add(InlineKeyboardButton(
         text="📄 TXT",
-        callback_data="export_txt"
+        callback_data=cb("export", "txt")
     ))
     builder.add(InlineKeyboardButton(
         text="📊 CSV",
-        callback_data="export_csv"
+        callback_data=cb("export", "csv")
     ))
     builder.add(InlineKeyboardButton(
         text="🔙 Назад",
@@ -1072,7 +2783,13 @@ def get_export_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(2)
     return builder.as_markup()
 
-def get_user_list_keyboard(users: List[Dict], page: int = 0, users_per_page: int = 10) -> InlineKeyboardMarkup:
+keyboards.register("main", _build_main_keyboard)
+keyboards.register("admin", _build_admin_keyboard)
+keyboards.register("priority", _build_priority_keyboard)
+keyboards.register("category", _build_category_keyboard)
+keyboards.register("export", _build_export_keyboard)
+
+def get_user_list_keyboard(users: List[User], page: int = 0, users_per_page: int = 10) -> InlineKeyboardMarkup:
     """Клавиатура для списка пользователей с ролями"""
     builder = InlineKeyboardBuilder()
     
@@ -1081,8 +2798,8 @@ def get_user_list_keyboard(users: List[Dict], page: int = 0, users_per_page: int
     page_users = users[start_idx:end_idx]
     
     for user in page_users:
-        user_id = user['user_id']
-        username = user.get('username', 'Без имени')
+        user_id = user.user_id
+        username = user.username
         role = db.get_user_role(user_id)
         banned = db.is_banned(user_id)
         
@@ -1093,7 +2810,7 @@ def get_user_list_keyboard(users: List[Dict], page: int = 0, users_per_page: int
         btn_text = f"{role_emoji} {ban_emoji} @{username}"
         builder.row(InlineKeyboardButton(
             text=btn_text,
-            callback_data=f"admin_user_detail_{user_id}"
+            callback_data=cb("admin_user_detail", user_id)
         ))
     
     # Навигация
@@ -1101,7 +2818,7 @@ def get_user_list_keyboard(users: List[Dict], page: int = 0, users_per_page: int
     if page > 0:
         nav_buttons.append(InlineKeyboardButton(
             text="⬅️ Назад",
-            callback_data=f"admin_users_page_{page-1}"
+            callback_data=cb("admin_users_page", page-1)
         ))
     
     nav_buttons.append(InlineKeyboardButton(
@@ -1112,7 +2829,7 @@ def get_user_list_keyboard(users: List[Dict], page: int = 0, users_per_page: int
     if len(users) > end_idx:
         nav_buttons.append(InlineKeyboardButton(
             text="Вперед ➡️",
-            callback_data=f"admin_users_page_{page+1}"
+            callback_data=cb("admin_users_page", page+1)
         ))
     
     builder.row(*nav_buttons)
@@ -1129,18 +2846,18 @@ def get_ban_list_keyboard(banned_ids: List[int], page: int = 0, per_page: int =
     page_ids = banned_ids[start_idx:end_idx]
 
     for uid in page_ids:
-        user = db.users.get(uid, {})
-        username = user.get('username')
-        name = user.get('full_name')
+        user = db.users.get(uid)
+        username = user.username if user else None
+        name = user.full_name if user else None
         label = f"🚫 @{username}" if username else f"🚫 {name}" if name else f"🚫 ID {uid}"
-        builder.add(InlineKeyboardButton(text=label, callback_data=f"admin_baninfo_{uid}"))
+        builder.add(InlineKeyboardButton(text=label, callback_data=cb("admin_baninfo", uid)))
 
     # Навигация
     nav = []
     if page > 0:
-        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin_bans_page_{page-1}"))
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=cb("admin_bans_page", page-1)))
     if end_idx < len(banned_ids):
-        nav.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"admin_bans_page_{page+1}"))
+        nav.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=cb("admin_bans_page", page+1)))
     if nav:
         builder.row(*nav)
 
@@ -1161,50 +2878,50 @@ def get_user_management_keyboard(user_id: int, manager_id: int) -> InlineKeyboar
         if target_role == 'admin':
             builder.add(InlineKeyboardButton(
                 text="👑 Снять админа",
-                callback_data=f"admin_demote_user_{user_id}"
+                callback_data=cb("admin_demote_user", user_id)
             ))
         elif target_role == 'user':
             builder.add(InlineKeyboardButton(
                 text="⚡ Назначить админом",
-                callback_data=f"admin_promote_user_{user_id}"
+                callback_data=cb("admin_promote_user", user_id)
             ))
         
         if is_banned:
             builder.add(InlineKeyboardButton(
                 text="✅ Разбанить",
-                callback_data=f"admin_unban_user_{user_id}"
+                callback_data=cb("admin_unban_direct", user_id)
             ))
         else:
             builder.add(InlineKeyboardButton(
                 text="🚫 Забанить",
-                callback_data=f"admin_ban_user_{user_id}"
+                callback_data=cb("admin_ban_direct", user_id)
             ))
     
     # Админ может управлять только пользователями
     elif db.get_user_role(manager_id) == 'admin' and target_role == 'user':
         builder.add(InlineKeyboardButton(
             text="⚡ Назначить админом",
-            callback_data=f"admin_promote_user_{user_id}"
+            callback_data=cb("admin_promote_user", user_id)
         ))
         
         if is_banned:
             builder.add(InlineKeyboardButton(
                 text="✅ Разбанить",
-                callback_data=f"admin_unban_user_{user_id}"
+                callback_data=cb("admin_unban_direct", user_id)
             ))
         else:
             builder.add(InlineKeyboardButton(
                 text="🚫 Забанить",
-                callback_data=f"admin_ban_user_{user_id}"
+                callback_data=cb("admin_ban_direct", user_id)
             ))
     
     builder.add(InlineKeyboardButton(
         text="✉️ Написать",
-        callback_data=f"admin_message_{user_id}"
+        callback_data=cb("admin_message", user_id)
     ))
     builder.add(InlineKeyboardButton(
         text="📋 Задачи пользователя",
-        callback_data=f"admin_user_tasks_{user_id}"
+        callback_data=cb("admin_user_tasks", user_id)
     ))
     builder.add(InlineKeyboardButton(
         text="🔙 Назад",
@@ -1215,53 +2932,82 @@ def get_user_management_keyboard(user_id: int, manager_id: int) -> InlineKeyboar
     return builder.as_markup()
 
 # ========== ФОРМАТИРОВАНИЕ ТЕКСТА ==========
-def format_task(task: Dict) -> str:
+def format_task(task: Task) -> str:
     """Форматирование задачи для отображения"""
-    user = db.users.get(task['user_id'], {})
-    username = user.get('username', 'Неизвестно')
+    username = getattr(db.users.get(task.user_id), 'username', 'Неизвестно')
     
-    status = "✅ <b>Выполнена</b>" if task['completed'] else "⏳ <b>В работе</b>"
-    priority_emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}[task['priority']]
-    priority_text = {"high": "Высокий", "medium": "Средний", "low": "Низкий"}[task['priority']]
+    status = "✅ <b>Выполнена</b>" if task.completed else "⏳ <b>В работе</b>"
+    priority_emoji = PRIORITY_EMOJI[task.priority]
+    priority_text = PRIORITY_TITLE[task.priority]
     
-    created = task['created'].strftime("%d.%m.%Y %H:%M")
-    completed = task['completed_at'].strftime("%d.%m.%Y %H:%M") if task['completed_at'] else "Не выполнена"
+    created = _fmt_ts(task.created)
+    completed = _fmt_ts(task.completed_at, default="Не выполнена")
     
-    return f"""<b>📝 Задача #{task['id']}</b>
+    return f"""<b>📝 Задача #{task.id}</b>
 
-<b>Текст:</b> {task['text']}
-<b>Категория:</b> {task['category']}
+<b>Текст:</b> {task.text}
+<b>Категория:</b> {task.category}
 <b>Приоритет:</b> {priority_emoji} {priority_text}
 <b>Статус:</b> {status}
 <b>Создана:</b> {created}
 <b>Выполнена:</b> {completed}
 <b>Автор:</b> @{username}"""
 
+_render_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def render_task_detail(task: Task, view: str = "user") -> tuple:
+    """(текст, клавиатура) карточки задачи из LRU-кэша по (task_id, версия, вид).
+
+    view: 'user' — карточка владельца, 'admin' — карточка в админ-панели
+    Архивные копии (их нет в db.tasks) версии не имеют и в кэш не попадают.
+    """
+    resident = task.id in db.tasks
+    key = (task.id, db.task_version(task.id), view)
+    cached = _render_cache.get(key) if resident else None
+    if cached is not None:
+        _render_cache.move_to_end(key)
+        return cached
+    
+    if view == "admin":
+        markup = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(text="🗑 Удалить", callback_data=cb("admin_delete_task", task.id)),
+                    InlineKeyboardButton(text="✉️ Написать", callback_data=cb("admin_message", task.user_id))
+                ],
+                [
+                    InlineKeyboardButton(text="🔙 Назад", callback_data="admin_tasks")
+                ]
+            ]
+        )
+    else:
+        markup = get_task_detail_keyboard(task.id, task.completed)
+    
+    if not resident:
+        return format_task(task), markup
+    cached = _render_cache[key] = (format_task(task), markup)
+    if len(_render_cache) > RENDER_CACHE_SIZE:
+        _render_cache.popitem(last=False)
+    return cached
+
 def format_user_stats(user_id: int) -> str:
     """Форматирование статистики пользователя"""
     if db.is_banned(user_id):
         return "🚫 <b>Ваш аккаунт заблокирован!</b>\n\nОбратитесь к администратору для разблокировки."
     
-    user = db.users.get(user_id, {})
-    tasks = db.get_user_tasks(user_id)
-    active_tasks = [t for t in tasks if not t['completed']]
-    completed_tasks = [t for t in tasks if t['completed']]
+    user = db.users.get(user_id)
+    summary = db.get_user_summary(user_id)
+    total = summary['total']
     
-    if tasks:
-        progress = (len(completed_tasks) / len(tasks) * 100) if tasks else 0
+    if total:
+        progress = summary['completed'] / total * 100
         
         # Статистика по приоритетам
-        high_priority = len([t for t in tasks if t['priority'] == 'high'])
-        medium_priority = len([t for t in tasks if t['priority'] == 'medium'])
-        low_priority = len([t for t in tasks if t['priority'] == 'low'])
-        
-        # Статистика по категориям
-        categories = {}
-        for task in tasks:
-            cat = task['category']
-            categories[cat] = categories.get(cat, 0) + 1
+        high_priority = summary['by_priority'][Priority.HIGH]
+        medium_priority = summary['by_priority'][Priority.MEDIUM]
+        low_priority = summary['by_priority'][Priority.LOW]
         
-        top_category = max(categories.items(), key=lambda x: x[1]) if categories else ("Нет", 0)
+        top_category = summary['top_category']
         
         # Информация о роли
         role = db.get_user_role(user_id)
@@ -1270,14 +3016,14 @@ def format_user_stats(user_id: int) -> str:
         return f"""<b>📊 Ваша статистика</b>
 
 {role_text}
-👤 <b>Пользователь:</b> @{user.get('username', 'Без имени')}
+👤 <b>Пользователь:</b> @{getattr(user, 'username', 'Без имени')}
 🆔 <b>ID:</b> <code>{user_id}</code>
-📅 <b>С нами с:</b> {user.get('joined').strftime('%d.%m.%Y') if user.get('joined') else 'Неизвестно'}
+📅 <b>С нами с:</b> {_fmt_ts(user.joined, '%d.%m.%Y') if user else 'Неизвестно'}
 
 <b>📈 Активность:</b>
-📝 Всего задач: {len(tasks)}
-✅ Выполнено: {len(completed_tasks)}
-⏳ В работе: {len(active_tasks)}
+📝 Всего задач: {total}
+✅ Выполнено: {summary['completed']}
+⏳ В работе: {summary['active']}
 🎯 Прогресс: {progress:.1f}%
 
 <b>🎯 Приоритеты:</b>
@@ -1293,20 +3039,27 @@ def format_user_stats(user_id: int) -> str:
 def format_admin_stats() -> str:
     """Форматирование статистики для админа"""
     total_users = len(db.users)
-    total_tasks = db.admin_stats['total_tasks']
-    completed_tasks = db.admin_stats['completed_tasks']
+    total_tasks = db.columns.total
+    completed_tasks = db.columns.completed_total
     active_users = len(db.admin_stats['active_users'])
-    tasks_today = db.admin_stats['tasks_today']
-    users_today = len(db.admin_stats['users_today'])
     banned_users = len(db.banned_users)
     admins_count = len(db.get_all_admins())
     
     completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
     
-    # Активность за последние 7 дней
-    week_ago = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    new_users_week = len([u for u in db.users.values() 
-                         if u['joined'] > week_ago])
+    memory_text = ""
+    if PAGING_MAX_RESIDENT_TASKS:
+        paging = db.get_paging_stats()
+        memory_text = (
+            f"\n\n<b>💾 Память:</b>\n"
+            f"• Задач в памяти: {paging['resident_tasks']} / {paging['budget']}\n"
+            f"• Выгружено пользователей: {paging['paged_users']}\n"
+            f"• Попадания LRU: {paging['hit_rate']:.1f}% "
+            f"({paging['hits']} попаданий / {paging['misses']} промахов)"
+        )
+    
+    def by_period(metric: str) -> str:
+        return " / ".join(str(db.daily.total(metric, days)) for days in (1, 7, 30))
     
     return f"""<b>⚙️ Статистика бота</b>
 
@@ -1315,7 +3068,7 @@ def format_admin_stats() -> str:
 • Активных пользователей: {active_users}
 • Заблокированных: {banned_users}
 • Администраторов: {admins_count}
-• Новых за неделю: {new_users_week}
+• Новых за неделю: {db.daily.total('new_users', 7)}
 
 <b>📝 Задачи:</b>
 • Всего задач: {total_tasks}
@@ -1323,15 +3076,29 @@ def format_admin_stats() -> str:
 • В работе: {total_tasks - completed_tasks}
 • Процент выполнения: {completion_rate:.1f}%
 
-<b>📅 За сегодня:</b>
-• Новых пользователей: {users_today}
-• Создано задач: {tasks_today}
-• Выполнено задач: {sum(1 for t in db.tasks.values() 
-                        if t['completed_at'] and t['completed_at'].date() == datetime.now().date())}"""
+<b>📅 Сегодня / 7 дней / 30 дней:</b>
+• Новых пользователей: {by_period('new_users')}
+• Активных пользователей: {by_period('active_users')}
+• Создано задач: {by_period('tasks_created')}
+• Выполнено задач: {by_period('tasks_completed')}{memory_text}"""
+
+_admin_stats_cache: Dict[str, Any] = {"key": None, "at": 0.0, "text": ""}
+
+def get_admin_stats_text() -> str:
+    """Текст админ-статистики из кэша: пересчет только при смене версии данных или дня"""
+    key = (db.version, datetime.now().date())
+    cache = _admin_stats_cache
+    now = time.monotonic()
+    fresh = cache["key"] == key or (
+        cache["key"] is not None and now - cache["at"] < ADMIN_STATS_MAX_STALENESS_SEC
+    )
+    if not fresh:
+        cache.update(key=key, at=now, text=format_admin_stats())
+    return cache["text"]
 
 def format_user_detail(user_id: int) -> str:
     """Форматирование детальной информации о пользователе"""
-    user = db.users.get(user_id, {})
+    user = db.users.get(user_id)
     if not user:
         return "Пользователь не найден"
 
@@ -1349,30 +3116,31 @@ def format_user_detail(user_id: int) -> str:
         until_text = "бессрочно" if not until else until.strftime('%d.%m.%Y %H:%M')
         ban_extra = f"\n<b>Причина бана:</b> {reason}\n<b>Срок бана:</b> {until_text}"
 
-    warnings = user.get('warnings', 0)
+    warnings = user.warnings
 
-    tasks = db.get_user_tasks(user_id)
-    active_tasks = len([t for t in tasks if not t['completed']])
-    completed_tasks = len([t for t in tasks if t['completed']])
+    summary = db.get_user_summary(user_id)
+    total = summary['total']
+    active_tasks = summary['active']
+    completed_tasks = summary['completed']
 
     return f"""<b>👤 Информация о пользователе</b>
 
-<b>Имя:</b> {user.get('full_name', 'Не указано')}
-<b>Username:</b> @{user.get('username', 'Не указано')}
+<b>Имя:</b> {user.full_name or 'Не указано'}
+<b>Username:</b> @{user.username or 'Не указано'}
 <b>ID:</b> <code>{user_id}</code>
 <b>Роль:</b> {role_text}
 <b>Статус:</b> {ban_status}
 <b>⚠️ Предупреждения:</b> {warnings}{ban_extra}
 
 <b>📊 Активность:</b>
-📅 Регистрация: {user.get('joined').strftime('%d.%m.%Y %H:%M') if user.get('joined') else 'Неизвестно'}
-🕐 Последняя активность: {user.get('last_active').strftime('%d.%m.%Y %H:%M') if user.get('last_active') else 'Неизвестно'}
+📅 Регистрация: {_fmt_ts(user.joined)}
+🕐 Последняя активность: {_fmt_ts(user.last_active)}
 
 <b>📝 Задачи:</b>
-• Всего: {len(tasks)}
+• Всего: {total}
 • Активных: {active_tasks}
 • Выполненных: {completed_tasks}
-• Прогресс: {(completed_tasks/len(tasks)*100) if tasks else 0:.1f}%"""
+• Прогресс: {(completed_tasks/total*100) if total else 0:.1f}%"""
 
 # ========== МИДЛВАРЬ ДЛЯ ПРОВЕРКИ БАНА ==========
 @router.message.middleware()
@@ -1398,6 +3166,9 @@ async def ban_check_middleware(handler, event, data):
             )
         return  # Прерываем обработку
     
+    # Подгружаем задачи пользователя, если они выгружены из памяти
+    db.touch_user(user_id)
+    
     # Продолжаем обработку
     return await handler(event, data)
 
@@ -1419,9 +3190,498 @@ async def ban_check_callback_middleware(handler, event, data):
         )
         return  # Прерываем обработку
     
+    # Подгружаем задачи пользователя, если они выгружены из памяти
+    db.touch_user(user_id)
+    
     # Продолжаем обработку
     return await handler(event, data)
 
+# ========== ПЛАНИРОВЩИК ОБНОВЛЕНИЙ ==========
+# Команды модерации: при перегрузке и в хвосте после перезапуска выполняются в первую очередь
+URGENT_COMMANDS = {
+    "ban", "tban", "unban", "warn", "clearwarn",
+    "massban", "masstban", "massunban", "masswarn", "admin",
+}
+
+# Callback'и листания: при перегрузке отбрасываются первыми
+PAGINATION_CALLBACKS = {"tasks_page", "bulk_page", "admin_tasks_page", "admin_users_page", "admin_bans_page", "audit"}
+
+def _update_sender(update: Update) -> Optional[int]:
+    event = update.message or update.edited_message or update.callback_query
+    return event.from_user.id if event and event.from_user else None
+
+def _is_urgent_update(update: Update) -> bool:
+    """Команда модерации или любое действие админа/создателя"""
+    if db.get_user_role(_update_sender(update)) in ('admin', 'creator'):
+        return True
+    text = (update.message.text or "") if update.message else ""
+    if not text.startswith("/"):
+        return False
+    command = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+    return command in URGENT_COMMANDS
+
+# Классы обновлений от самого важного к наименее важному
+UPDATE_CLASSES = ("admin", "fsm", "navigation", "pagination")
+UPDATE_CLASS_RANK = {name: rank for rank, name in enumerate(UPDATE_CLASSES)}
+
+def classify_update(update: Update, raw_state: Optional[str]) -> str:
+    """Класс обновления для допуска и очереди обработки"""
+    if _is_urgent_update(update):
+        return "admin"
+    if raw_state is not None:
+        return "fsm"
+    query = update.callback_query
+    if query and (query.data or "").partition(CALLBACK_SEP)[0] in PAGINATION_CALLBACKS:
+        return "pagination"
+    return "navigation"
+
+class PrioritySlots:
+    """Семафор с приоритетом: освободившийся слот получает ожидающий с наименьшим
+    рангом, внутри ранга — по порядку очереди"""
+
+    def __init__(self, size: int):
+        self._free = size
+        self._waiters: list = []  # куча (ранг, номер, future)
+        self._seq = itertools.count()
+
+    async def acquire(self, rank: int) -> None:
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if not fut.cancelled():
+                # Слот уже был передан этой задаче — возвращаем его следующему
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+async def _answer_busy(update: Update, text: str) -> None:
+    """Короткий ответ на отброшенное обновление"""
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(text)
+        elif update.message:
+            await update.message.answer(text)
+    except Exception:
+        logger.exception(f"Не удалось ответить на отброшенное обновление {update.update_id}")
+
+class AdmissionControl(BaseMiddleware):
+    """Допуск обновлений по классам: у каждого класса свой лимит обновлений в очереди
+    и в работе; сверх лимита обновление не обрабатывается, пользователь получает «бот занят».
+    Класс передается дальше в data["update_class"] для приоритета в UpdateScheduler."""
+
+    def __init__(self, limits: Dict[str, int]):
+        self._limits = limits
+        self.in_flight: Dict[str, int] = {name: 0 for name in UPDATE_CLASSES}
+        self.shed: Dict[str, int] = {name: 0 for name in UPDATE_CLASSES}
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]):
+        update_class = classify_update(event, data.get("raw_state"))
+        limit = self._limits.get(update_class, 0)
+        if limit and self.in_flight[update_class] >= limit:
+            self.shed[update_class] += 1
+            await _answer_busy(event, "⏳ Бот сейчас перегружен, повторите через несколько секунд.")
+            return None
+        
+        data["update_class"] = update_class
+        self.in_flight[update_class] += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight[update_class] -= 1
+
+def _update_chat_id(update: Update) -> Optional[int]:
+    """Чат, к которому относится обновление (для callback'а — чат его сообщения)"""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        query = update.callback_query
+        return query.message.chat.id if query.message else query.from_user.id
+    return None
+
+class UpdateScheduler(BaseMiddleware):
+    """Внешний middleware диспетчера: обновления разных чатов выполняются параллельно
+    (не более max_concurrent одновременно), обновления одного чата — строго по очереди,
+    чтобы FSM-сценарии видели шаги в порядке отправки. Свободный слот обработки первым
+    получает обновление более важного класса (см. AdmissionControl).
+
+    aiogram запускает каждое обновление отдельной задачей в порядке получения, а
+    asyncio.Lock отдает блокировку ожидающим в порядке FIFO — этого достаточно для порядка.
+    Встроенный FSM-middleware aiogram читает состояние до очереди, поэтому после
+    получения очереди состояние перечитывается: предыдущий шаг мог его сменить.
+    """
+
+    def __init__(self, max_concurrent: int, chat_queue_limit: int, on_enqueue=None):
+        self._slots = PrioritySlots(max_concurrent)
+        self._chat_queue_limit = chat_queue_limit
+        self._on_enqueue = on_enqueue  # вызывается для каждого принятого в очередь обновления
+        self._chats: Dict[int, list] = {}  # chat_id -> [Lock, обновлений в очереди и в работе]
+        self.dropped = 0
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]):
+        chat_id = _update_chat_id(event)
+        rank = UPDATE_CLASS_RANK.get(data.get("update_class"), len(UPDATE_CLASSES))
+        if chat_id is None:
+            if self._on_enqueue:
+                self._on_enqueue(event)
+            return await self._run(handler, event, data, rank)
+        
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Lock(), 0]
+        if entry[1] >= self._chat_queue_limit:
+            self.dropped += 1
+            logger.warning(f"Очередь чата {chat_id} переполнена, обновление {event.update_id} отброшено")
+            await _answer_busy(event, "Подождите, предыдущие действия еще выполняются.")
+            return None
+        
+        entry[1] += 1
+        if self._on_enqueue:
+            self._on_enqueue(event)
+        try:
+            async with entry[0]:
+                return await self._run(handler, event, data, rank)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat_id]
+
+    async def _run(self, handler, event: Update, data: Dict[str, Any], rank: int):
+        await self._slots.acquire(rank)
+        try:
+            state = data.get("state")
+            if state is not None:
+                data["raw_state"] = await state.get_state()
+            return await handler(event, data)
+        finally:
+            self._slots.release()
+
+
+class CallbackCoalescer(BaseMiddleware):
+    """Схлопывание быстрых повторных нажатий.
+
+    При поступлении (до очередей): повтор последнего callback_data того же сообщения
+    в пределах окна считается дублем; нажатие с другими данными сбрасывает окно, так
+    что «1 → 0 → 1» — три разных нажатия. При постановке в очередь чата (track_pagination, вызывает
+    UpdateScheduler) запоминается последнее принятое листание сообщения — отброшенные
+    допуском или переполнением очереди нажатия не учитываются. Перед выполнением
+    (skip_superseded): листание, за которым для того же сообщения уже принято более
+    новое, пропускается. Пропущенные нажатия сразу получают пустой ответ, чтобы у
+    пользователя не висели «часики».
+    """
+
+    def __init__(self, window: float, max_tracked: int = 10000):
+        self._window = window
+        self._recent: OrderedDict = OrderedDict()  # (chat_id, message_id) -> (data, время нажатия)
+        # (chat_id, message_id) -> update_id последнего принятого листания (LRU)
+        self._latest_page: OrderedDict = OrderedDict()
+        self._max_tracked = max_tracked
+        self.suppressed = 0
+
+    @staticmethod
+    def _message_key(query: CallbackQuery) -> Optional[tuple]:
+        return (query.message.chat.id, query.message.message_id) if query.message else None
+
+    async def _suppress(self, query: CallbackQuery):
+        self.suppressed += 1
+        try:
+            await query.answer()
+        except Exception:
+            logger.exception("Не удалось ответить на повторное нажатие")
+        return None
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]):
+        query = event.callback_query
+        msg_key = self._message_key(query) if query else None
+        if msg_key is None:
+            return await handler(event, data)
+        
+        now = time.monotonic()
+        while self._recent and now - next(iter(self._recent.values()))[1] >= self._window:
+            self._recent.popitem(last=False)
+        last = self._recent.pop(msg_key, None)
+        self._recent[msg_key] = (query.data, now)
+        if last is not None and last[0] == query.data:
+            return await self._suppress(query)
+        return await handler(event, data)
+
+    def track_pagination(self, event: Update) -> None:
+        """Листание принято в очередь чата — теперь оно последнее для своего сообщения"""
+        query = event.callback_query
+        msg_key = self._message_key(query) if query else None
+        if msg_key is None or (query.data or "").partition(CALLBACK_SEP)[0] not in PAGINATION_CALLBACKS:
+            return
+        self._latest_page[msg_key] = event.update_id
+        self._latest_page.move_to_end(msg_key)
+        if len(self._latest_page) > self._max_tracked:
+            self._latest_page.popitem(last=False)
+
+    async def skip_superseded(self, handler, query: CallbackQuery, data: Dict[str, Any]):
+        """Middleware callback'ов роутера: выполняется уже в очереди чата, перед обработчиком"""
+        msg_key = self._message_key(query)
+        latest = self._latest_page.get(msg_key)
+        if latest is None:
+            return await handler(query, data)
+        update_id = data["event_update"].update_id
+        if (query.data or "").partition(CALLBACK_SEP)[0] in PAGINATION_CALLBACKS and update_id != latest:
+            return await self._suppress(query)
+        try:
+            return await handler(query, data)
+        finally:
+            if self._latest_page.get(msg_key) == update_id:
+                del self._latest_page[msg_key]
+
+
+coalescer = CallbackCoalescer(CALLBACK_COALESCE_WINDOW_SEC)
+admission = AdmissionControl(UPDATE_CLASS_LIMITS)
+update_scheduler = UpdateScheduler(
+    UPDATE_MAX_CONCURRENCY, UPDATE_CHAT_QUEUE_LIMIT, on_enqueue=coalescer.track_pagination
+)
+dp.update.outer_middleware(coalescer)
+dp.update.outer_middleware(admission)
+dp.update.outer_middleware(update_scheduler)
+router.callback_query.outer_middleware(coalescer.skip_superseded)
+
+# ========== ИСХОДЯЩИЕ ЗАПРОСЫ ==========
+def _content_hash(text: Optional[str], markup: Any) -> int:
+    return hash((text, markup.model_dump_json(exclude_none=True) if markup is not None else None))
+
+class EditDeduplicator(BaseRequestMiddleware):
+    """Middleware сессии бота: editMessageText с тем же текстом и клавиатурой, что уже
+    показаны в сообщении, не отправляется в Telegram (иначе — лишний запрос и ошибка
+    «message is not modified»). Помнит хэш содержимого последних сообщений (LRU)."""
+
+    def __init__(self, max_size: int):
+        self._hashes: OrderedDict = OrderedDict()  # (chat_id, message_id) -> хэш текста и клавиатуры
+        self._max_size = max_size
+        self.skipped = 0
+
+    def _remember(self, key: tuple, content_hash: int) -> None:
+        self._hashes[key] = content_hash
+        self._hashes.move_to_end(key)
+        if len(self._hashes) > self._max_size:
+            self._hashes.popitem(last=False)
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            key = (method.chat_id, method.message_id)
+            content_hash = _content_hash(method.text, method.reply_markup)
+            if self._hashes.get(key) == content_hash:
+                self._hashes.move_to_end(key)
+                self.skipped += 1
+                return True
+            try:
+                result = await make_request(bot, method)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    self._hashes.pop(key, None)
+                    raise
+                self.skipped += 1
+                result = True
+            self._remember(key, content_hash)
+            return result
+        
+        if isinstance(method, (EditMessageReplyMarkup, EditMessageCaption, DeleteMessage)):
+            self._hashes.pop((method.chat_id, method.message_id), None)
+        
+        result = await make_request(bot, method)
+        if isinstance(method, SendMessage) and isinstance(result, Message):
+            self._remember((result.chat.id, result.message_id), _content_hash(method.text, method.reply_markup))
+        return result
+
+
+class CallbackAnswerTracker(BaseRequestMiddleware):
+    """Middleware сессии бота: запоминает, на какие callback'и уже ответили, и не шлет
+    повторный answerCallbackQuery (Telegram принимает только первый ответ)"""
+
+    def __init__(self, max_size: int = 10000):
+        self._answered: OrderedDict = OrderedDict()  # id callback'а -> None
+        self._max_size = max_size
+
+    def is_answered(self, query_id: str) -> bool:
+        return query_id in self._answered
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if not isinstance(method, AnswerCallbackQuery):
+            return await make_request(bot, method)
+        if method.callback_query_id in self._answered:
+            return True
+        self._answered[method.callback_query_id] = None
+        if len(self._answered) > self._max_size:
+            self._answered.popitem(last=False)
+        return await make_request(bot, method)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # RetryAfter от Telegram
+
+    def wait_time(self, now: float, reserve: float = 0.0) -> float:
+        """Сколько ждать, пока в ведре будет токен сверх reserve (0 — можно брать сейчас)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(self.paused_until - now, (1 + reserve - self.tokens) / self.rate, 0.0)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+# Очередь исходящих запросов текущей задачи: "interactive" (ответы пользователям) или "bulk"
+_outbound_lane = contextvars.ContextVar("outbound_lane", default="interactive")
+
+@contextlib.contextmanager
+def bulk_sends():
+    """Все запросы внутри блока идут в очередь массовых отправок (рассылки)"""
+    token = _outbound_lane.set("bulk")
+    try:
+        yield
+    finally:
+        _outbound_lane.reset(token)
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """Middleware сессии бота: ограничение скорости запросов с chat_id (общий и по-чатовый
+    token bucket). Массовые отправки ждут, пока есть ожидающие интерактивные запросы, и не
+    расходуют последние OUTBOUND_BULK_RESERVE токенов общего лимита. На RetryAfter чат (а для
+    рассылок — вся очередь рассылок) ставится на паузу, запрос повторяется."""
+
+    def __init__(self, max_chats: int = 10000):
+        self._global = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST)
+        self._bulk_paused_until = 0.0
+        self._chats: OrderedDict = OrderedDict()  # chat_id -> TokenBucket (LRU)
+        self._max_chats = max_chats
+        self._interactive_waiting = 0
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+            if len(self._chats) > self._max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat: TokenBucket, bulk: bool) -> None:
+        reserve = OUTBOUND_BULK_RESERVE if bulk else 0
+        while True:
+            now = time.monotonic()
+            wait = max(self._global.wait_time(now, reserve), chat.wait_time(now))
+            if bulk:
+                wait = max(wait, self._bulk_paused_until - now)
+                if self._interactive_waiting:
+                    wait = max(wait, 1 / self._global.rate)
+            if wait <= 0:
+                self._global.take()
+                chat.take()
+                return
+            if bulk:
+                await asyncio.sleep(wait)
+                continue
+            self._interactive_waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._interactive_waiting -= 1
+
+    async def __call__(self, make_request, bot: Bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        
+        bulk = _outbound_lane.get() == "bulk"
+        chat = self._chat_bucket(chat_id)
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            await self._acquire(chat, bulk)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == OUTBOUND_MAX_RETRIES:
+                    raise
+                self.retries += 1
+                until = time.monotonic() + e.retry_after
+                chat.paused_until = max(chat.paused_until, until)
+                if bulk:
+                    self._bulk_paused_until = max(self._bulk_paused_until, until)
+                logger.warning(f"RetryAfter {e.retry_after} с для чата {chat_id}, повтор {attempt + 1}")
+
+
+class RequestMetrics(BaseRequestMiddleware):
+    """Middleware сессии бота: время HTTP-запросов по методам Bot API (без ожидания в лимитере)"""
+
+    def __init__(self, sample_size: int = 200):
+        self._sample_size = sample_size
+        self.endpoints: Dict[str, dict] = {}
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        if name == "getUpdates":
+            return await make_request(bot, method)  # long polling — это ожидание, а не задержка
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = {
+                "count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                "recent": deque(maxlen=self._sample_size),
+            }
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            stats["recent"].append(elapsed)
+
+    def format_report(self) -> str:
+        """Текст для /apistats: методы по суммарному времени"""
+        if not self.endpoints:
+            return "📡 Запросов к Bot API еще не было."
+        lines = ["📡 <b>Запросы к Bot API</b> (мс: среднее / p95 последних / максимум)\n"]
+        ranked = sorted(self.endpoints.items(), key=lambda item: item[1]["total"], reverse=True)
+        for name, stats in ranked:
+            recent = sorted(stats["recent"])
+            p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+            avg = stats["total"] / stats["count"] if stats["count"] else 0.0
+            lines.append(
+                f"• <code>{name}</code>: {stats['count']} шт., "
+                f"{avg * 1000:.0f} / {p95 * 1000:.0f} / {stats['max'] * 1000:.0f}"
+                + (f", ошибок {stats['errors']}" if stats["errors"] else "")
+            )
+        return "\n".join(lines)
+
+
+edit_dedup = EditDeduplicator(EDIT_HASH_CACHE_SIZE)
+answer_tracker = CallbackAnswerTracker()
+outbound_limiter = OutboundRateLimiter()
+request_metrics = RequestMetrics()
+bot.session.middleware(edit_dedup)
+bot.session.middleware(answer_tracker)
+bot.session.middleware(outbound_limiter)  # сюда доходят только реальные запросы
+bot.session.middleware(request_metrics)  # последним — замер самого HTTP-запроса
+
 # ========== ОБРАБОТЧИКИ КОМАНД ==========
 @router.message(Command("start"))
 async def cmd_start(message: Message):
@@ -1476,6 +3736,7 @@ async def cmd_help(message: Message):
 /tasks - Показать все задачи
 /stats - Ваша статистика
 /search - Поиск задач
+/import - Импорт задач из CSV/JSON
 
 <b>🎯 Как работать с задачами:</b>
 1. Нажмите "📝 Создать задачу"
@@ -1705,6 +3966,103 @@ async def cmd_warn(message: Message):
         f"(Лимит: {WARN_LIMIT}, после него — автобан на {AUTO_BAN_HOURS}ч)"
     )
 
+# ----- Массовая модерация -----
+MASS_ACTION_TITLES = {
+    "ban": "🚫 Массовый бан",
+    "tban": "⏳ Массовый временный бан",
+    "unban": "✅ Массовый разбан",
+    "warn": "⚠️ Массовое предупреждение",
+}
+
+def _parse_id_list(text: str) -> tuple:
+    """'1 2, 3 спам' -> ([1, 2, 3], 'спам'): id — ведущие числа, остальное — причина"""
+    ids: List[int] = []
+    tokens = re.split(r"([\s,;]+)", (text or "").strip())
+    for i in range(0, len(tokens), 2):
+        if not re.fullmatch(r"\d+", tokens[i]):
+            return ids, "".join(tokens[i:]).strip()
+        ids.append(int(tokens[i]))
+    return ids, ""
+
+async def _read_ids_from_document(message: Message) -> List[int]:
+    """Все числа из присланного (или процитированного) текстового файла со списком id"""
+    document = message.document or getattr(message.reply_to_message, "document", None)
+    if document is None:
+        return []
+    if (document.file_size or 0) > 1024 * 1024:
+        raise ValueError("файл со списком id слишком большой (макс. 1 МБ)")
+    buf = await bot.download(document)
+    return [int(x) for x in re.findall(r"\d+", buf.read().decode("utf-8", errors="ignore"))]
+
+def _format_mass_result(action: str, result: Dict[str, List[int]]) -> str:
+    def ids_preview(ids: List[int]) -> str:
+        preview = ", ".join(f"<code>{uid}</code>" for uid in ids[:20])
+        return preview + (f" …и ещё {len(ids) - 20}" if len(ids) > 20 else "")
+
+    text = f"<b>{MASS_ACTION_TITLES[action]}</b>\n\n✅ Выполнено: {len(result['done'])}"
+    if result["skipped"]:
+        text += f"\n⏭ Без изменений: {len(result['skipped'])} — {ids_preview(result['skipped'])}"
+    if result["denied"]:
+        text += f"\n❌ Нет прав: {len(result['denied'])} — {ids_preview(result['denied'])}"
+    return text
+
+async def _run_mass_moderation(message: Message, action: str) -> None:
+    """Общий обработчик /massban, /masstban, /massunban, /masswarn"""
+    manager_id = message.from_user.id
+    if not _is_admin_or_creator(manager_id):
+        return
+
+    parts = (message.text or message.caption or "").split(maxsplit=1)
+    args = parts[1] if len(parts) > 1 else ""
+
+    duration = None
+    if action == "tban":
+        duration_raw, args = (args.split(maxsplit=1) + ["", ""])[:2]
+        duration = _parse_duration_to_seconds(duration_raw)
+        if not duration:
+            await message.answer("Использование: /masstban <30m|2h|1d> <id id ...> [причина]")
+            return
+
+    ids, reason = _parse_id_list(args)
+    try:
+        ids += await _read_ids_from_document(message)
+    except Exception as e:
+        await message.answer(f"❌ Не удалось прочитать список: {html.escape(str(e))}")
+        return
+
+    if not ids:
+        await message.answer(
+            f"Использование: /mass{action} {'<30m|2h|1d> ' if action == 'tban' else ''}<id id ...> [причина]\n"
+            "id через пробел, запятую или с новой строки; можно приложить .txt-файл со списком."
+        )
+        return
+    if len(ids) > MASS_MODERATION_MAX_IDS:
+        await message.answer(f"Слишком длинный список (макс. {MASS_MODERATION_MAX_IDS} id за раз)")
+        return
+
+    result = db.moderate_users(manager_id, action, ids, reason=reason, duration_seconds=duration)
+    await message.answer(_format_mass_result(action, result))
+
+@router.message(Command("massban"))
+async def cmd_massban(message: Message):
+    """/massban <id id ...> [reason]"""
+    await _run_mass_moderation(message, "ban")
+
+@router.message(Command("masstban"))
+async def cmd_masstban(message: Message):
+    """/masstban <duration> <id id ...> [reason]"""
+    await _run_mass_moderation(message, "tban")
+
+@router.message(Command("massunban"))
+async def cmd_massunban(message: Message):
+    """/massunban <id id ...>"""
+    await _run_mass_moderation(message, "unban")
+
+@router.message(Command("masswarn"))
+async def cmd_masswarn(message: Message):
+    """/masswarn <id id ...> [reason]"""
+    await _run_mass_moderation(message, "warn")
+
 @router.message(Command("clearwarn"))
 async def cmd_clearwarn(message: Message):
     """/clearwarn <id>"""
@@ -1729,6 +4087,85 @@ async def cmd_clearwarn(message: Message):
         await message.answer("❌ Не удалось сбросить предупреждения (возможно, нет прав).")
 
 
+# ----- Журнал модерации -----
+AUDIT_ACTION_TITLES = {
+    "ban": "🚫 бан",
+    "unban": "✅ разбан",
+    "warn": "⚠️ предупреждение",
+    "clearwarn": "🧹 сброс предупреждений",
+    "promote": "👑 назначен админом",
+    "demote": "👤 снят с админки",
+}
+
+async def format_audit_page(user_id: int, by_moderator: bool, page: int) -> tuple:
+    """Текст и клавиатура страницы журнала модерации"""
+    records, total = await db.get_audit(user_id, by_moderator, page)
+    who = "Действия модератора" if by_moderator else "История модерации"
+    text = f"📜 <b>{who}</b> <code>{user_id}</code> (записей: {total})\n\n"
+    
+    if not records:
+        text += "Записей нет."
+    for rec in records:
+        at = rec.get("at", "")
+        try:
+            at = datetime.fromisoformat(at).strftime('%d.%m.%Y %H:%M')
+        except (TypeError, ValueError):
+            pass
+        action = AUDIT_ACTION_TITLES.get(rec.get("action")) or html.escape(str(rec.get("action")))
+        other = f"→ <code>{rec.get('user_id')}</code>" if by_moderator else f"от <code>{rec.get('by')}</code>"
+        line = f"• {at} — {action} {other}"
+        details = rec.get("reason") or rec.get("note")
+        if details:
+            line += f" — {html.escape(str(details))}"
+        if rec.get("until"):
+            line += f" (до {_fmt_until(datetime.fromisoformat(rec['until']))})"
+        text += line + "\n"
+    
+    mode = "m" if by_moderator else "t"
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=cb("audit", mode, user_id, page-1)))
+    if (page + 1) * AUDIT_PAGE_SIZE < total:
+        nav.append(InlineKeyboardButton(text="Старее ➡️", callback_data=cb("audit", mode, user_id, page+1)))
+    return text, InlineKeyboardMarkup(inline_keyboard=[nav] if nav else [])
+
+@router.message(Command("audit"))
+async def cmd_audit(message: Message):
+    """/audit <user_id> — история модерации пользователя; /audit by <user_id> — действия модератора"""
+    if not _is_admin_or_creator(message.from_user.id):
+        return
+    
+    parts = (message.text or "").split()
+    by_moderator = len(parts) > 1 and parts[1].lower() == "by"
+    if by_moderator:
+        parts.pop(1)
+    
+    try:
+        target_id = int(parts[1])
+    except (IndexError, ValueError):
+        await message.answer("Использование: /audit <user_id> или /audit by <moderator_id>")
+        return
+    
+    text, keyboard = await format_audit_page(target_id, by_moderator, 0)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.message(Command("apistats"))
+async def cmd_apistats(message: Message):
+    """/apistats — время запросов к Bot API по методам"""
+    if not _is_admin_or_creator(message.from_user.id):
+        return
+    await message.answer(request_metrics.format_report())
+
+@callbacks.route("audit", str, int, int)
+async def audit_page(callback: CallbackQuery, mode: str, target_id: int, page: int):
+    """Смена страницы журнала модерации"""
+    if not _is_admin_or_creator(callback.from_user.id):
+        await callback.answer("Доступ запрещен!", show_alert=True)
+        return
+    
+    text, keyboard = await format_audit_page(target_id, mode == "m", page)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
 @router.message(Command("tasks"))
 async def cmd_tasks(message: Message):
     """Обработчик команды /tasks"""
@@ -1799,7 +4236,7 @@ async def show_search_tasks(message: Message, state: FSMContext):
 @router.message(F.text == "✅ Выполненные")
 async def show_completed_tasks(message: Message):
     """Показать выполненные задачи"""
-    tasks = db.get_user_tasks(message.from_user.id, completed=True)
+    tasks = db.get_user_tasks(message.from_user.id, completed=True, include_archived=True)
     
     if tasks:
         await message.answer(
@@ -1830,12 +4267,12 @@ async def show_categories(message: Message):
         await message.answer("У вас еще нет задач!")
         return
     
-    categories = set(task['category'] for task in tasks)
+    categories = set(task.category for task in tasks)
     
     text = "<b>📂 Ваши категории:</b>\n\n"
     for category in sorted(categories):
         category_tasks = db.get_tasks_by_category(message.from_user.id, category)
-        completed = len([t for t in category_tasks if t['completed']])
+        completed = len([t for t in category_tasks if t.completed])
         text += f"• {category}: {len(category_tasks)} задач ({completed} ✅)\n"
     
     await message.answer(
@@ -1875,11 +4312,9 @@ async def process_task_text(message: Message, state: FSMContext):
     )
     await state.set_state(TaskStates.waiting_for_category)
 
-@router.callback_query(F.data.startswith("category_create_"))
-async def process_category(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("category_create", str)
+async def process_category(callback: CallbackQuery, state: FSMContext, category: str):
     """Обработка выбора категории при создании"""
-    category = callback.data.split("_", 2)[2]
-    
     if category == "custom":
         await callback.message.edit_text(
             "✏️ <b>Введите свою категорию:</b>",
@@ -1921,10 +4356,9 @@ async def process_custom_category(message: Message, state: FSMContext):
     )
     await state.set_state(TaskStates.waiting_for_priority)
 
-@router.callback_query(F.data.startswith("priority_create_"))
-async def process_priority(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("priority_create", str)
+async def process_priority(callback: CallbackQuery, state: FSMContext, priority: str):
     """Обработка выбора приоритета и сохранение задачи"""
-    priority = callback.data.split("_", 2)[2]
     data = await state.get_data()
     
     task_id = db.add_task(
@@ -2002,7 +4436,7 @@ async def show_user_tasks(user_id: int, chat_id: int, page: int = 0):
         await bot.send_message(
             chat_id,
             f"<b>📋 Ваши задачи</b> (всего активных: {len(tasks)})",
-            reply_markup=get_tasks_keyboard(tasks, page)
+            reply_markup=get_tasks_keyboard(tasks, page, multiselect=True)
         )
     else:
         await bot.send_message(
@@ -2016,80 +4450,69 @@ async def show_user_tasks(user_id: int, chat_id: int, page: int = 0):
             )
         )
 
-@router.callback_query(F.data.startswith("task_detail_"))
-async def show_task_detail(callback: CallbackQuery):
+@callbacks.route("task_detail", int)
+async def show_task_detail(callback: CallbackQuery, task_id: int):
     """Показать детали задачи"""
-    task_id = int(callback.data.split("_", 2)[2])
-    task = db.get_task(task_id)
+    # Задача из истории могла уйти в архив — показываем ее оттуда, в работу она вернется
+    # только при изменении (см. Database._task_for_update)
+    task = db.find_task(task_id)
     
-    if not task or task['user_id'] != callback.from_user.id:
+    if not task or task.user_id != callback.from_user.id:
         await callback.answer("Задача не найдена!", show_alert=True)
         return
     
-    await callback.message.edit_text(
-        format_task(task),
-        reply_markup=get_task_detail_keyboard(task_id, task['completed'])
-    )
+    text, markup = render_task_detail(task)
+    await callback.message.edit_text(text, reply_markup=markup)
 
-@router.callback_query(F.data.startswith("complete_task_"))
-async def complete_task(callback: CallbackQuery):
+@callbacks.route("complete_task", int)
+async def complete_task(callback: CallbackQuery, task_id: int):
     """Отметить задачу как выполненную"""
-    task_id = int(callback.data.split("_", 2)[2])
     
     if db.toggle_task(task_id):
-        task = db.get_task(task_id)
-        await callback.message.edit_text(
-            format_task(task),
-            reply_markup=get_task_detail_keyboard(task_id, True)
-        )
+        text, markup = render_task_detail(db.get_task(task_id))
+        await callback.message.edit_text(text, reply_markup=markup)
         await callback.answer("✅ Задача отмечена как выполненная!")
     else:
         await callback.answer("Ошибка!", show_alert=True)
 
-@router.callback_query(F.data.startswith("uncomplete_task_"))
-async def uncomplete_task(callback: CallbackQuery):
+@callbacks.route("uncomplete_task", int)
+async def uncomplete_task(callback: CallbackQuery, task_id: int):
     """Вернуть задачу в активные"""
-    task_id = int(callback.data.split("_", 2)[2])
     
     if db.toggle_task(task_id):
-        task = db.get_task(task_id)
-        await callback.message.edit_text(
-            format_task(task),
-            reply_markup=get_task_detail_keyboard(task_id, False)
-        )
+        text, markup = render_task_detail(db.get_task(task_id))
+        await callback.message.edit_text(text, reply_markup=markup)
         await callback.answer("↩️ Задача возвращена в активные!")
     else:
         await callback.answer("Ошибка!", show_alert=True)
 
-@router.callback_query(F.data.startswith("delete_task_"))
-async def delete_task(callback: CallbackQuery):
+@callbacks.route("delete_task", int)
+async def delete_task(callback: CallbackQuery, task_id: int):
     """Удалить задачу"""
-    task_id = int(callback.data.split("_", 2)[2])
-    task = db.get_task(task_id)
+    task = db.find_task(task_id)
     
-    if not task or task['user_id'] != callback.from_user.id:
+    if not task or task.user_id != callback.from_user.id:
         await callback.answer("Ошибка!", show_alert=True)
         return
     
     # Подтверждение удаления
     await callback.message.edit_text(
         f"🗑 <b>Подтвердите удаление</b>\n\n"
-        f"Задача: {task['text'][:100]}...\n\n"
+        f"Задача: {task.text[:100]}...\n\n"
         f"Это действие нельзя отменить!",
         reply_markup=InlineKeyboardMarkup(
             inline_keyboard=[
                 [
-                    InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"confirm_delete_{task_id}"),
-                    InlineKeyboardButton(text="❌ Отмена", callback_data=f"task_detail_{task_id}")
+                    InlineKeyboardButton(text="✅ Да, удалить", callback_data=cb("confirm_delete", task_id)),
+                    InlineKeyboardButton(text="❌ Отмена", callback_data=cb("task_detail", task_id))
                 ]
             ]
         )
     )
 
-@router.callback_query(F.data.startswith("confirm_delete_"))
-async def confirm_delete(callback: CallbackQuery):
+@callbacks.route("confirm_delete", int)
+async def confirm_delete(callback: CallbackQuery, task_id: int):
     """Подтверждение удаления задачи"""
-    task_id = int(callback.data.split("_", 2)[2])
     
     if db.delete_task(task_id):
         await callback.message.edit_text(
@@ -2104,13 +4527,12 @@ async def confirm_delete(callback: CallbackQuery):
     else:
         await callback.answer("Ошибка удаления!", show_alert=True)
 
-@router.callback_query(F.data.startswith("edit_task_"))
-async def edit_task_start(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_task", int)
+async def edit_task_start(callback: CallbackQuery, state: FSMContext, task_id: int):
     """Начало редактирования задачи"""
-    task_id = int(callback.data.split("_", 2)[2])
-    task = db.get_task(task_id)
+    task = db.find_task(task_id)
     
-    if not task or task['user_id'] != callback.from_user.id:
+    if not task or task.user_id != callback.from_user.id:
         await callback.answer("Ошибка!", show_alert=True)
         return
     
@@ -2118,20 +4540,19 @@ async def edit_task_start(callback: CallbackQuery, state: FSMContext):
     
     await callback.message.edit_text(
         f"✏️ <b>Редактирование задачи #{task_id}</b>\n\n"
-        f"<b>Текущий текст:</b> {task['text']}\n"
-        f"<b>Категория:</b> {task['category']}\n"
-        f"<b>Приоритет:</b> {task['priority']}\n\n"
+        f"<b>Текущий текст:</b> {task.text}\n"
+        f"<b>Категория:</b> {task.category}\n"
+        f"<b>Приоритет:</b> {task.priority.key}\n\n"
         f"Что вы хотите изменить?",
         reply_markup=get_edit_task_keyboard(task_id)
     )
 
-@router.callback_query(F.data.startswith("edit_text_"))
-async def edit_task_text_start(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_text", int)
+async def edit_task_text_start(callback: CallbackQuery, state: FSMContext, task_id: int):
     """Начало редактирования текста задачи"""
-    task_id = int(callback.data.split("_", 2)[2])
-    task = db.get_task(task_id)
+    task = db.find_task(task_id)
     
-    if not task or task['user_id'] != callback.from_user.id:
+    if not task or task.user_id != callback.from_user.id:
         await callback.answer("Ошибка!", show_alert=True)
         return
     
@@ -2141,7 +4562,7 @@ async def edit_task_text_start(callback: CallbackQuery, state: FSMContext):
         "📝 <b>Введите новый текст задачи:</b>",
         reply_markup=InlineKeyboardMarkup(
             inline_keyboard=[[
-                InlineKeyboardButton(text="❌ Отмена", callback_data=f"task_detail_{task_id}")
+                InlineKeyboardButton(text="❌ Отмена", callback_data=cb("task_detail", task_id))
             ]]
         )
     )
@@ -2163,7 +4584,7 @@ async def process_edit_text(message: Message, state: FSMContext):
             "✅ <b>Текст задачи обновлен!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="📋 К задаче", callback_data=f"task_detail_{task_id}")
+                    InlineKeyboardButton(text="📋 К задаче", callback_data=cb("task_detail", task_id))
                 ]]
             )
         )
@@ -2172,13 +4593,12 @@ async def process_edit_text(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("edit_category_"))
-async def edit_task_category_start(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_category", int)
+async def edit_task_category_start(callback: CallbackQuery, state: FSMContext, task_id: int):
     """Начало редактирования категории задачи"""
-    task_id = int(callback.data.split("_", 2)[2])
-    task = db.get_task(task_id)
+    task = db.find_task(task_id)
     
-    if not task or task['user_id'] != callback.from_user.id:
+    if not task or task.user_id != callback.from_user.id:
         await callback.answer("Ошибка!", show_alert=True)
         return
     
@@ -2190,32 +4610,30 @@ async def edit_task_category_start(callback: CallbackQuery, state: FSMContext):
     )
     await state.set_state(TaskStates.editing_category)
 
-@router.callback_query(F.data.startswith("category_edit_"))
-async def process_edit_category(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("category_edit", str)
+async def process_edit_category(callback: CallbackQuery, state: FSMContext, category: str):
     """Обработка изменения категории задачи"""
     data = await state.get_data()
     task_id = data['task_id']
     
-    if callback.data == "category_edit_custom":
+    if category == "custom":
         await callback.message.edit_text(
             "✏️ <b>Введите новую категорию:</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="❌ Отмена", callback_data=f"task_detail_{task_id}")
+                    InlineKeyboardButton(text="❌ Отмена", callback_data=cb("task_detail", task_id))
                 ]]
             )
         )
         return
     
-    category = callback.data.split("_", 2)[2]
-    
     if db.update_task_category(task_id, category):
         task = db.get_task(task_id)
         await callback.message.edit_text(
             "✅ <b>Категория задачи обновлена!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="📋 К задаче", callback_data=f"task_detail_{task_id}")
+                    InlineKeyboardButton(text="📋 К задаче", callback_data=cb("task_detail", task_id))
                 ]]
             )
         )
@@ -2240,7 +4658,7 @@ async def process_edit_custom_category(message: Message, state: FSMContext):
             "✅ <b>Категория задачи обновлена!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="📋 К задаче", callback_data=f"task_detail_{task_id}")
+                    InlineKeyboardButton(text="📋 К задаче", callback_data=cb("task_detail", task_id))
                 ]]
             )
         )
@@ -2249,13 +4667,12 @@ async def process_edit_custom_category(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("edit_priority_"))
-async def edit_task_priority_start(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("edit_priority", int)
+async def edit_task_priority_start(callback: CallbackQuery, state: FSMContext, task_id: int):
     """Начало редактирования приоритета задачи"""
-    task_id = int(callback.data.split("_", 2)[2])
-    task = db.get_task(task_id)
+    task = db.find_task(task_id)
     
-    if not task or task['user_id'] != callback.from_user.id:
+    if not task or task.user_id != callback.from_user.id:
         await callback.answer("Ошибка!", show_alert=True)
         return
     
@@ -2267,12 +4684,11 @@ async def edit_task_priority_start(callback: CallbackQuery, state: FSMContext):
     )
     await state.set_state(TaskStates.editing_priority)
 
-@router.callback_query(F.data.startswith("priority_edit_"))
-async def process_edit_priority(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("priority_edit", str)
+async def process_edit_priority(callback: CallbackQuery, state: FSMContext, priority: str):
     """Обработка изменения приоритета задачи"""
     data = await state.get_data()
     task_id = data['task_id']
-    priority = callback.data.split("_", 2)[2]
     
     if db.update_task_priority(task_id, priority):
         task = db.get_task(task_id)
@@ -2280,7 +4696,7 @@ async def process_edit_priority(callback: CallbackQuery, state: FSMContext):
             "✅ <b>Приоритет задачи обновлен!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="📋 К задаче", callback_data=f"task_detail_{task_id}")
+                    InlineKeyboardButton(text="📋 К задаче", callback_data=cb("task_detail", task_id))
                 ]]
             )
         )
@@ -2289,10 +4705,9 @@ async def process_edit_priority(callback: CallbackQuery, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("view_category_"))
-async def view_category_tasks(callback: CallbackQuery):
+@callbacks.route("view_category", str)
+async def view_category_tasks(callback: CallbackQuery, category: str):
     """Просмотр задач по категории"""
-    category = callback.data.split("_", 2)[2]
     tasks = db.get_tasks_by_category(callback.from_user.id, category)
     
     if tasks:
@@ -2310,8 +4725,359 @@ async def view_category_tasks(callback: CallbackQuery):
             )
         )
 
+# ========== МАССОВЫЕ ОПЕРАЦИИ С ЗАДАЧАМИ ==========
+async def render_bulk_selection(callback: CallbackQuery, state: FSMContext):
+    """Перерисовать список активных задач в режиме мультивыбора"""
+    data = await state.get_data()
+    selected = set(data.get('bulk_selected', []))
+    tasks = db.get_user_tasks(callback.from_user.id, completed=False)
+    
+    if not tasks:
+        await state.clear()
+        await callback.message.edit_text(
+            "У вас нет активных задач! 🎉",
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[[
+                    InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")
+                ]]
+            )
+        )
+        return
+    
+    # Выбранные задачи могли исчезнуть (выполнены/удалены в другом окне)
+    selected &= {task.id for task in tasks}
+    last_page = (len(tasks) - 1) // 5
+    page = min(data.get('bulk_page', 0), last_page)
+    await state.update_data(bulk_selected=sorted(selected), bulk_page=page)
+    
+    await callback.message.edit_text(
+        f"<b>☑️ Выбор задач</b> (выбрано: {len(selected)} из {len(tasks)})\n\n"
+        f"Отметьте задачи и выберите действие:",
+        reply_markup=get_tasks_keyboard(tasks, page, selected=selected)
+    )
+
+async def finish_bulk_action(callback: CallbackQuery, state: FSMContext, text: str):
+    """Итог массового действия и выход из режима мультивыбора"""
+    await state.clear()
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(text="📋 К задачам", callback_data="back_to_tasks")
+            ]]
+        )
+    )
+
+@callbacks.route("bulk_start")
+async def bulk_start(callback: CallbackQuery, state: FSMContext):
+    """Вход в режим мультивыбора"""
+    await state.set_state(TaskStates.selecting_tasks)
+    await state.update_data(bulk_selected=[], bulk_page=0)
+    await render_bulk_selection(callback, state)
+
+@callbacks.route("bulk_toggle", int)
+async def bulk_toggle(callback: CallbackQuery, state: FSMContext, task_id: int):
+    """Отметить/снять отметку с задачи"""
+    data = await state.get_data()
+    selected = set(data.get('bulk_selected', []))
+    selected ^= {task_id}
+    await state.set_state(TaskStates.selecting_tasks)
+    await state.update_data(bulk_selected=sorted(selected))
+    await render_bulk_selection(callback, state)
+
+@callbacks.route("bulk_page", int)
+async def bulk_change_page(callback: CallbackQuery, state: FSMContext, page: int):
+    """Смена страницы в режиме мультивыбора (отметки сохраняются)"""
+    await state.update_data(bulk_page=page)
+    await render_bulk_selection(callback, state)
+
+@callbacks.route("bulk_cancel")
+async def bulk_cancel(callback: CallbackQuery, state: FSMContext):
+    """Выход из режима мультивыбора без изменений"""
+    await state.clear()
+    tasks = db.get_user_tasks(callback.from_user.id, completed=False)
+    await callback.message.edit_text(
+        f"<b>📋 Ваши задачи</b> (всего активных: {len(tasks)})",
+        reply_markup=get_tasks_keyboard(tasks, multiselect=True)
+    )
+
+@callbacks.route("bulk_complete")
+async def bulk_complete(callback: CallbackQuery, state: FSMContext):
+    """Выполнить все выбранные задачи"""
+    data = await state.get_data()
+    count = db.bulk_complete_tasks(callback.from_user.id, data.get('bulk_selected', []))
+    await finish_bulk_action(callback, state, f"✅ <b>Выполнено задач: {count}</b>")
+
+@callbacks.route("bulk_delete")
+async def bulk_delete(callback: CallbackQuery, state: FSMContext):
+    """Подтверждение удаления выбранных задач"""
+    data = await state.get_data()
+    count = len(data.get('bulk_selected', []))
+    if not count:
+        await callback.answer("Ничего не выбрано!", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        f"🗑 <b>Подтвердите удаление</b>\n\n"
+        f"Выбрано задач: {count}\n\n"
+        f"Это действие нельзя отменить!",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(text="✅ Да, удалить", callback_data="bulk_delete_confirm"),
+                    InlineKeyboardButton(text="❌ Отмена", callback_data="bulk_back")
+                ]
+            ]
+        )
+    )
+
+@callbacks.route("bulk_delete_confirm")
+async def bulk_delete_confirm(callback: CallbackQuery, state: FSMContext):
+    """Удаление выбранных задач"""
+    data = await state.get_data()
+    count = db.bulk_delete_tasks(callback.from_user.id, data.get('bulk_selected', []))
+    await finish_bulk_action(callback, state, f"✅ <b>Удалено задач: {count}</b>")
+
+@callbacks.route("bulk_move")
+async def bulk_move_start(callback: CallbackQuery, state: FSMContext):
+    """Выбор категории для переноса выбранных задач"""
+    data = await state.get_data()
+    if not data.get('bulk_selected'):
+        await callback.answer("Ничего не выбрано!", show_alert=True)
+        return
+    
+    categories = get_category_keyboard("bulk").inline_keyboard
+    await callback.message.edit_text(
+        "📂 <b>Выберите категорию для выбранных задач:</b>",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=categories + [[InlineKeyboardButton(text="❌ Отмена", callback_data="bulk_back")]]
+        )
+    )
+
+@callbacks.route("bulk_back")
+async def bulk_back(callback: CallbackQuery, state: FSMContext):
+    """Вернуться к списку с отметками"""
+    await state.set_state(TaskStates.selecting_tasks)
+    await render_bulk_selection(callback, state)
+
+@callbacks.route("category_bulk", str)
+async def bulk_move_category(callback: CallbackQuery, state: FSMContext, category: str):
+    """Перенос выбранных задач в категорию"""
+    if category == "custom":
+        await callback.message.edit_text(
+            "✏️ <b>Введите новую категорию:</b>",
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[[
+                    InlineKeyboardButton(text="❌ Отмена", callback_data="bulk_back")
+                ]]
+            )
+        )
+        await state.set_state(TaskStates.bulk_custom_category)
+        return
+    
+    data = await state.get_data()
+    count = db.bulk_move_tasks(callback.from_user.id, data.get('bulk_selected', []), category)
+    await finish_bulk_action(callback, state, f"✅ <b>Перенесено в '{category}': {count}</b>")
+
+@router.message(TaskStates.bulk_custom_category)
+async def bulk_move_custom_category(message: Message, state: FSMContext):
+    """Перенос выбранных задач в свою категорию"""
+    if len(message.text) > 50:
+        await message.answer("Название категории слишком длинное (макс. 50 символов)")
+        return
+    
+    data = await state.get_data()
+    count = db.bulk_move_tasks(message.from_user.id, data.get('bulk_selected', []), message.text)
+    await state.clear()
+    await message.answer(
+        f"✅ <b>Перенесено в '{message.text}': {count}</b>",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(text="📋 К задачам", callback_data="back_to_tasks")
+            ]]
+        )
+    )
+
+# ========== ИМПОРТ ЗАДАЧ ИЗ ФАЙЛА ==========
+IMPORT_COLUMNS = {
+    "text": "text", "текст": "text", "task": "text", "задача": "text",
+    "category": "category", "категория": "category",
+    "priority": "priority", "приоритет": "priority",
+}
+IMPORT_PRIORITIES = {
+    "": Priority.MEDIUM,
+    "low": Priority.LOW, "низкий": Priority.LOW, "0": Priority.LOW,
+    "medium": Priority.MEDIUM, "средний": Priority.MEDIUM, "1": Priority.MEDIUM,
+    "high": Priority.HIGH, "высокий": Priority.HIGH, "2": Priority.HIGH,
+}
+
+def _validate_import_row(text: Any, category: Any, priority: Any) -> Optional[tuple]:
+    """(text, category, Priority) или None, если строка не проходит проверку"""
+    text = str(text or "").strip()
+    category = str(category or "").strip() or "Общее"
+    priority = IMPORT_PRIORITIES.get(str(priority if priority is not None else "").strip().lower())
+    if not text or len(text) > 500 or len(category) > 50 or priority is None:
+        return None
+    return text, category, priority
+
+def _iter_import_csv(f):
+    """Строки CSV (разделитель ; или ,). С заголовком — колонки по именам, без — text;category;priority"""
+    first = f.readline()
+    delimiter = ";" if first.count(";") >= first.count(",") else ","
+    header = next(csv.reader([first], delimiter=delimiter), [])
+    columns = [IMPORT_COLUMNS.get(h.strip().lower()) for h in header]
+    if "text" not in columns:
+        columns = ["text", "category", "priority"]
+        rows = itertools.chain([header], csv.reader(f, delimiter=delimiter))
+    else:
+        rows = csv.reader(f, delimiter=delimiter)
+    
+    for row in rows:
+        if not any(cell.strip() for cell in row):
+            continue
+        fields = {col: cell for col, cell in zip(columns, row) if col}
+        yield _validate_import_row(fields.get("text"), fields.get("category"), fields.get("priority"))
+
+def _iter_import_json(f):
+    """Записи JSON: массив объектов/строк или объект с массивом «tasks»"""
+    for record in _iter_json_records(f, "tasks"):
+        if isinstance(record, str):
+            yield _validate_import_row(record, None, None)
+        elif isinstance(record, dict):
+            yield _validate_import_row(record.get("text"), record.get("category"), record.get("priority"))
+        else:
+            yield None
+
+def iter_import_file(path: str):
+    """Потоковое чтение файла импорта: по одной проверенной строке (None — невалидная строка)"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".json"):
+            yield from _iter_import_json(f)
+        else:
+            yield from _iter_import_csv(f)
+
+def read_import_batch(rows, batch_size: int) -> tuple:
+    """Следующая пачка валидных строк (выполняется в рабочем потоке). -> (batch, skipped, eof)"""
+    batch, skipped = [], 0
+    for row in rows:
+        if row is None:
+            skipped += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            return batch, skipped, False
+    return batch, skipped, True
+
+async def import_tasks_from_file(user_id: int, path: str, status: Message) -> Dict:
+    """Импорт задач пачками: разбор — в потоке, вставка и сохранение — в цикле событий"""
+    loop = asyncio.get_running_loop()
+    result = {"added": 0, "skipped": 0, "truncated": False}
+    last_progress = loop.time()
+    rows = iter_import_file(path)
+    try:
+        while True:
+            batch, skipped, eof = await asyncio.to_thread(read_import_batch, rows, IMPORT_BATCH_SIZE)
+            result["skipped"] += skipped
+            
+            room = IMPORT_MAX_TASKS - result["added"]
+            if len(batch) > room:
+                batch = batch[:room]
+                result["truncated"] = eof = True
+            result["added"] += db.add_tasks(user_id, batch)
+            
+            if eof:
+                return result
+            if loop.time() - last_progress >= IMPORT_PROGRESS_INTERVAL_SEC:
+                last_progress = loop.time()
+                await status.edit_text(
+                    f"📥 <b>Импорт...</b>\n\n"
+                    f"Добавлено: {result['added']}\n"
+                    f"Пропущено строк: {result['skipped']}"
+                )
+    finally:
+        rows.close()
+
+@router.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    """Импорт задач из CSV/JSON-файла"""
+    await message.answer(
+        "📥 <b>Импорт задач</b>\n\n"
+        "Отправьте файл <b>.csv</b> или <b>.json</b>.\n\n"
+        "<b>CSV:</b> колонки text;category;priority (заголовок необязателен, разделитель ; или ,)\n"
+        "<b>JSON:</b> массив объектов {\"text\", \"category\", \"priority\"} или строк\n\n"
+        f"Приоритет: low/medium/high. Максимум {IMPORT_MAX_TASKS} задач и {IMPORT_MAX_FILE_MB} МБ.",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_import")
+            ]]
+        )
+    )
+    await state.set_state(TaskStates.waiting_import_file)
+
+@callbacks.route("cancel_import")
+async def cancel_import(callback: CallbackQuery, state: FSMContext):
+    """Отмена импорта"""
+    await state.clear()
+    await callback.message.edit_text(
+        "❌ Импорт отменен",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(text="📋 Главное меню", callback_data="back_to_main")
+            ]]
+        )
+    )
+
+@router.message(TaskStates.waiting_import_file, F.document)
+async def process_import_file(message: Message, state: FSMContext):
+    """Обработка присланного файла импорта"""
+    document = message.document
+    ext = os.path.splitext(document.file_name or "")[1].lower()
+    
+    if ext not in (".csv", ".json"):
+        await message.answer("Поддерживаются только файлы .csv и .json")
+        return
+    if (document.file_size or 0) > IMPORT_MAX_FILE_MB * 1024 * 1024:
+        await message.answer(f"Файл слишком большой (макс. {IMPORT_MAX_FILE_MB} МБ)")
+        return
+    
+    await state.clear()
+    status = await message.answer("📥 <b>Импорт...</b>\n\nЗагрузка файла")
+    # Файл скачивается на диск, а не в память: разбор идет потоково
+    path = os.path.join(DATA_DIR, f"import_{message.from_user.id}_{message.message_id}{ext}")
+    try:
+        await bot.download(document, destination=path)
+        result = await import_tasks_from_file(message.from_user.id, path, status)
+    except Exception as e:
+        logger.exception(f"Import failed for user {message.from_user.id}: {e}")
+        await status.edit_text(f"❌ <b>Ошибка импорта:</b> {html.escape(str(e))}")
+        return
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    
+    text = (
+        f"✅ <b>Импорт завершен</b>\n\n"
+        f"Добавлено задач: {result['added']}\n"
+        f"Пропущено строк: {result['skipped']}"
+    )
+    if result["truncated"]:
+        text += f"\n\n⚠️ Достигнут лимит {IMPORT_MAX_TASKS} задач — остаток файла не импортирован"
+    await status.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(text="📋 К задачам", callback_data="back_to_tasks")
+            ]]
+        )
+    )
+
+@router.message(TaskStates.waiting_import_file)
+async def process_import_not_file(message: Message):
+    """В режиме импорта ждем файл"""
+    await message.answer("Отправьте файл .csv или .json (или нажмите «Отмена»)")
+
 # ========== АДМИН ОБРАБОТЧИКИ ==========
-@router.callback_query(F.data == "admin_stats")
+@callbacks.route("admin_stats")
 async def admin_stats_handler(callback: CallbackQuery):
     """Статистика для админа"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
@@ -2319,7 +5085,7 @@ async def admin_stats_handler(callback: CallbackQuery):
         return
     
     await callback.message.edit_text(
-        format_admin_stats(),
+        get_admin_stats_text(),
         reply_markup=InlineKeyboardMarkup(
             inline_keyboard=[[
                 InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_stats"),
@@ -2328,7 +5094,7 @@ async def admin_stats_handler(callback: CallbackQuery):
         )
     )
 
-@router.callback_query(F.data == "admin_tasks")
+@callbacks.route("admin_tasks")
 async def admin_tasks_handler(callback: CallbackQuery):
     """Все задачи для админа"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
@@ -2352,46 +5118,30 @@ async def admin_tasks_handler(callback: CallbackQuery):
             )
         )
 
-@router.callback_query(F.data.startswith("admin_task_detail_"))
-async def admin_task_detail(callback: CallbackQuery):
+@callbacks.route("admin_task_detail", int)
+async def admin_task_detail(callback: CallbackQuery, task_id: int):
     """Детали задачи для админа"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
     
-    task_id = int(callback.data.split("_", 3)[3])
-    task = db.get_task(task_id)
+    task = db.find_task(task_id)
     
     if not task:
         await callback.answer("Задача не найдена!", show_alert=True)
         return
     
-    user = db.users.get(task['user_id'], {})
-    username = user.get('username', 'Неизвестно')
-    
-    await callback.message.edit_text(
-        format_task(task),
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="🗑 Удалить", callback_data=f"admin_delete_task_{task_id}"),
-                    InlineKeyboardButton(text="✉️ Написать", callback_data=f"admin_message_{task['user_id']}")
-                ],
-                [
-                    InlineKeyboardButton(text="🔙 Назад", callback_data="admin_tasks")
-                ]
-            ]
-        )
-    )
+    text, markup = render_task_detail(task, view="admin")
+    await callback.message.edit_text(text, reply_markup=markup)
 
-@router.callback_query(F.data == "admin_users")
+@callbacks.route("admin_users")
 async def admin_users_handler(callback: CallbackQuery):
     """Все пользователи для админа"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
     
-    users = db.get_all_users_with_roles()
+    users = db.get_all_users()
     
     if not users:
         await callback.message.edit_text(
@@ -2409,14 +5159,13 @@ async def admin_users_handler(callback: CallbackQuery):
         reply_markup=get_user_list_keyboard(users)
     )
 
-@router.callback_query(F.data.startswith("admin_user_detail_"))
-async def admin_user_detail(callback: CallbackQuery):
+@callbacks.route("admin_user_detail", int)
+async def admin_user_detail(callback: CallbackQuery, user_id: int):
     """Детали пользователя для админа"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
     
-    user_id = int(callback.data.split("_", 3)[3])
     user = db.users.get(user_id)
     
     if not user:
@@ -2428,14 +5177,13 @@ async def admin_user_detail(callback: CallbackQuery):
         reply_markup=get_user_management_keyboard(user_id, callback.from_user.id)
     )
 
-@router.callback_query(F.data.startswith("admin_user_tasks_"))
-async def admin_user_tasks(callback: CallbackQuery):
+@callbacks.route("admin_user_tasks", int)
+async def admin_user_tasks(callback: CallbackQuery, user_id: int):
     """Задачи конкретного пользователя"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
     
-    user_id = int(callback.data.split("_", 3)[3])
     user = db.users.get(user_id)
     
     if not user:
@@ -2446,20 +5194,20 @@ async def admin_user_tasks(callback: CallbackQuery):
     
     if tasks:
         await callback.message.edit_text(
-            f"<b>📋 Задачи пользователя @{user.get('username', 'Без имени')}</b> (всего: {len(tasks)})",
+            f"<b>📋 Задачи пользователя @{user.username}</b> (всего: {len(tasks)})",
             reply_markup=get_tasks_keyboard(tasks)
         )
     else:
         await callback.message.edit_text(
-            f"У пользователя @{user.get('username', 'Без имени')} нет задач",
+            f"У пользователя @{user.username} нет задач",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="🔙 Назад", callback_data=f"admin_user_detail_{user_id}")
+                    InlineKeyboardButton(text="🔙 Назад", callback_data=cb("admin_user_detail", user_id))
                 ]]
             )
         )
 
-@router.callback_query(F.data == "admin_promote")
+@callbacks.route("admin_promote")
 async def admin_promote_start(callback: CallbackQuery, state: FSMContext):
     """Начало назначения админа"""
     user_id = callback.from_user.id
@@ -2507,10 +5255,10 @@ async def process_admin_promote(message: Message, state: FSMContext):
             return
         
         # Назначаем админа
-        if db.set_admin(target_id):
+        if db.set_admin(target_id, manager_id):
             user = db.users.get(target_id)
             await message.answer(
-                f"✅ <b>Пользователь @{user.get('username', 'Без имени')} назначен администратором!</b>",
+                f"✅ <b>Пользователь @{user.username} назначен администратором!</b>",
                 reply_markup=get_admin_keyboard(manager_id)
             )
             
@@ -2543,11 +5291,10 @@ async def process_admin_promote(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_promote_user_"))
-async def admin_promote_user_direct(callback: CallbackQuery):
+@callbacks.route("admin_promote_user", int)
+async def admin_promote_user_direct(callback: CallbackQuery, target_id: int):
     """Прямое назначение админа из меню пользователя"""
     user_id = callback.from_user.id
-    target_id = int(callback.data.split("_", 3)[3])
     
     # Проверяем права
     if not db.can_manage_user(user_id, target_id):
@@ -2555,14 +5302,14 @@ async def admin_promote_user_direct(callback: CallbackQuery):
         return
     
     # Назначаем админа
-    if db.set_admin(target_id):
+    if db.set_admin(target_id, user_id):
         user = db.users.get(target_id)
         
         await callback.message.edit_text(
-            f"✅ <b>Пользователь @{user.get('username', 'Без имени')} назначен администратором!</b>",
+            f"✅ <b>Пользователь @{user.username} назначен администратором!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="🔙 Назад", callback_data=f"admin_user_detail_{target_id}")
+                    InlineKeyboardButton(text="🔙 Назад", callback_data=cb("admin_user_detail", target_id))
                 ]]
             )
         )
@@ -2580,7 +5327,7 @@ async def admin_promote_user_direct(callback: CallbackQuery):
     else:
         await callback.answer("Не удалось назначить пользователя админом!", show_alert=True)
 
-@router.callback_query(F.data == "admin_demote")
+@callbacks.route("admin_demote")
 async def admin_demote_start(callback: CallbackQuery, state: FSMContext):
     """Начало снятия админа (только для создателя)"""
     user_id = callback.from_user.id
@@ -2635,10 +5382,10 @@ async def process_admin_demote(message: Message, state: FSMContext):
             return
         
         # Снимаем админа
-        if db.remove_admin(target_id):
+        if db.remove_admin(target_id, manager_id):
             user = db.users.get(target_id)
             await message.answer(
-                f"✅ <b>Пользователь @{user.get('username', 'Без имени')} снят с должности администратора!</b>",
+                f"✅ <b>Пользователь @{user.username} снят с должности администратора!</b>",
                 reply_markup=get_admin_keyboard(manager_id)
             )
             
@@ -2670,11 +5417,10 @@ async def process_admin_demote(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_demote_user_"))
-async def admin_demote_user_direct(callback: CallbackQuery):
+@callbacks.route("admin_demote_user", int)
+async def admin_demote_user_direct(callback: CallbackQuery, target_id: int):
     """Прямое снятие админа из меню пользователя"""
     user_id = callback.from_user.id
-    target_id = int(callback.data.split("_", 3)[3])
     
     # Только создатель может снимать админов
     if user_id != CREATOR_ID:
@@ -2687,14 +5433,14 @@ async def admin_demote_user_direct(callback: CallbackQuery):
         return
     
     # Снимаем админа
-    if db.remove_admin(target_id):
+    if db.remove_admin(target_id, user_id):
         user = db.users.get(target_id)
         
         await callback.message.edit_text(
-            f"✅ <b>Пользователь @{user.get('username', 'Без имени')} снят с должности администратора!</b>",
+            f"✅ <b>Пользователь @{user.username} снят с должности администратора!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="🔙 Назад", callback_data=f"admin_user_detail_{target_id}")
+                    InlineKeyboardButton(text="🔙 Назад", callback_data=cb("admin_user_detail", target_id))
                 ]]
             )
         )
@@ -2711,7 +5457,7 @@ async def admin_demote_user_direct(callback: CallbackQuery):
     else:
         await callback.answer("Не удалось снять пользователя с должности администратора!", show_alert=True)
 
-@router.callback_query(F.data == "admin_list_admins")
+@callbacks.route("admin_list_admins")
 async def admin_list_admins_handler(callback: CallbackQuery):
     """Список всех админов"""
     user_id = callback.from_user.id
@@ -2735,8 +5481,7 @@ async def admin_list_admins_handler(callback: CallbackQuery):
     
     text = "<b>👑 Список администраторов:</b>\n\n"
     for admin_id in admins:
-        user = db.users.get(admin_id, {})
-        username = user.get('username', 'Без имени')
+        username = getattr(db.users.get(admin_id), 'username', 'Без имени')
         text += f"• @{username} (ID: <code>{admin_id}</code>)\n"
     
     await callback.message.edit_text(
@@ -2749,7 +5494,7 @@ async def admin_list_admins_handler(callback: CallbackQuery):
     )
 
 
-@router.callback_query(F.data == "admin_bans")
+@callbacks.route("admin_bans")
 async def admin_bans_handler(callback: CallbackQuery):
     """Список текущих банов"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
@@ -2774,18 +5519,13 @@ async def admin_bans_handler(callback: CallbackQuery):
         reply_markup=get_ban_list_keyboard(banned_ids, page=0)
     )
 
-@router.callback_query(F.data.startswith("admin_bans_page_"))
-async def admin_bans_page(callback: CallbackQuery):
+@callbacks.route("admin_bans_page", int)
+async def admin_bans_page(callback: CallbackQuery, page: int):
     """Пагинация списка банов"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
 
-    try:
-        page = int(callback.data.split("_", 3)[3])
-    except:
-        page = 0
-
     banned_ids = sorted(list(db.ban_info.keys()))
     if not banned_ids:
         await callback.message.edit_text(
@@ -2800,14 +5540,13 @@ async def admin_bans_page(callback: CallbackQuery):
         reply_markup=get_ban_list_keyboard(banned_ids, page=page)
     )
 
-@router.callback_query(F.data.startswith("admin_baninfo_"))
-async def admin_baninfo(callback: CallbackQuery):
+@callbacks.route("admin_baninfo", int)
+async def admin_baninfo(callback: CallbackQuery, uid: int):
     """Информация о конкретном бане"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
 
-    uid = int(callback.data.split("_", 2)[2])
 
     if not db.is_banned(uid):
         await callback.answer("Пользователь уже разблокирован.", show_alert=True)
@@ -2822,12 +5561,12 @@ async def admin_baninfo(callback: CallbackQuery):
     until_text = "бессрочно" if not until else until.strftime('%d.%m.%Y %H:%M')
     at_text = at.strftime('%d.%m.%Y %H:%M') if at else "неизвестно"
 
-    user = db.users.get(uid, {})
-    username = user.get('username')
-    full_name = user.get('full_name')
+    user = db.users.get(uid)
+    username = user.username if user else None
+    full_name = user.full_name if user else None
 
-    by_user = db.users.get(by_id, {}) if by_id else {}
-    by_name = by_user.get('full_name') or (f"@{by_user.get('username')}" if by_user.get('username') else None)
+    by_user = db.users.get(by_id) if by_id else None
+    by_name = (by_user.full_name or f"@{by_user.username}") if by_user else None
 
     text = (
         "🚫 <b>Информация о бане</b>\n\n"
@@ -2842,13 +5581,13 @@ async def admin_baninfo(callback: CallbackQuery):
 
     kb = InlineKeyboardBuilder()
     if db.can_unban_user(callback.from_user.id, uid):
-        kb.add(InlineKeyboardButton(text="✅ Разбанить", callback_data=f"admin_unban_user_{uid}"))
+        kb.add(InlineKeyboardButton(text="✅ Разбанить", callback_data=cb("admin_unban_direct", uid)))
     kb.add(InlineKeyboardButton(text="🔙 Назад к списку банов", callback_data="admin_bans"))
     kb.adjust(1)
 
     await callback.message.edit_text(text, reply_markup=kb.as_markup())
 
-@router.callback_query(F.data == "admin_ban_user")
+@callbacks.route("admin_ban_user")
 async def admin_ban_user_start(callback: CallbackQuery, state: FSMContext):
     """Начало бана пользователя"""
     user_id = callback.from_user.id
@@ -2932,7 +5671,7 @@ async def process_ban_reason(message: Message, state: FSMContext):
         user = db.users.get(target_id)
         
         await message.answer(
-            f"✅ <b>Пользователь @{user.get('username', 'Без имени')} заблокирован!</b>\n\n"
+            f"✅ <b>Пользователь @{user.username} заблокирован!</b>\n\n"
             f"Причина: {reason}",
             reply_markup=get_admin_keyboard(manager_id)
         )
@@ -2955,11 +5694,10 @@ async def process_ban_reason(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_ban_user_"))
-async def admin_ban_user_direct(callback: CallbackQuery):
+@callbacks.route("admin_ban_direct", int)
+async def admin_ban_user_direct(callback: CallbackQuery, target_id: int):
     """Прямой бан пользователя из меню"""
     user_id = callback.from_user.id
-    target_id = int(callback.data.split("_", 3)[3])
     
     # Проверяем права
     if not db.can_ban_user(user_id, target_id):
@@ -2971,10 +5709,10 @@ async def admin_ban_user_direct(callback: CallbackQuery):
         user = db.users.get(target_id)
         
         await callback.message.edit_text(
-            f"✅ <b>Пользователь @{user.get('username', 'Без имени')} заблокирован!</b>",
+            f"✅ <b>Пользователь @{user.username} заблокирован!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="🔙 Назад", callback_data=f"admin_user_detail_{target_id}")
+                    InlineKeyboardButton(text="🔙 Назад", callback_data=cb("admin_user_detail", target_id))
                 ]]
             )
         )
@@ -2991,7 +5729,57 @@ async def admin_ban_user_direct(callback: CallbackQuery):
     else:
         await callback.answer("Не удалось заблокировать пользователя!", show_alert=True)
 
-@router.callback_query(F.data == "admin_unban_user")
+@callbacks.route("admin_mass_ban")
+async def admin_mass_ban_start(callback: CallbackQuery, state: FSMContext):
+    """Начало массового бана (рейд)"""
+    if not _is_admin_or_creator(callback.from_user.id):
+        await callback.answer("Доступ запрещен!", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        "🚫 <b>Массовая блокировка</b>\n\n"
+        "Отправьте список ID через пробел, запятую или с новой строки, "
+        "после списка можно указать причину.\n"
+        "Или пришлите .txt-файл со списком ID.\n\n"
+        f"Максимум {MASS_MODERATION_MAX_IDS} ID за раз.",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[
+                InlineKeyboardButton(text="❌ Отмена", callback_data="admin_back")
+            ]]
+        )
+    )
+    await state.set_state(AdminStates.waiting_mass_ban_ids)
+
+@router.message(AdminStates.waiting_mass_ban_ids)
+async def process_mass_ban_ids(message: Message, state: FSMContext):
+    """Обработка списка ID для массового бана"""
+    manager_id = message.from_user.id
+    ids, reason = _parse_id_list(message.text or message.caption or "")
+    try:
+        ids += await _read_ids_from_document(message)
+    except Exception as e:
+        await message.answer(f"❌ Не удалось прочитать список: {html.escape(str(e))}")
+        return
+    
+    if not ids or len(ids) > MASS_MODERATION_MAX_IDS:
+        await message.answer(
+            f"❌ Нужен список от 1 до {MASS_MODERATION_MAX_IDS} числовых ID.",
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[[
+                    InlineKeyboardButton(text="❌ Отмена", callback_data="admin_back")
+                ]]
+            )
+        )
+        return
+    
+    await state.clear()
+    result = db.moderate_users(manager_id, "ban", ids, reason=reason or "Массовая блокировка")
+    await message.answer(
+        _format_mass_result("ban", result),
+        reply_markup=get_admin_keyboard(manager_id)
+    )
+
+@callbacks.route("admin_unban_user")
 async def admin_unban_user_start(callback: CallbackQuery, state: FSMContext):
     """Начало разбана пользователя"""
     user_id = callback.from_user.id
@@ -3043,7 +5831,7 @@ async def process_unban_user(message: Message, state: FSMContext):
 
             if user:
                 await message.answer(
-                    f"✅ <b>Пользователь @{user.get('username', 'Без имени')} разблокирован!</b>",
+                    f"✅ <b>Пользователь @{user.username} разблокирован!</b>",
                     reply_markup=get_admin_keyboard(manager_id)
                 )
 
@@ -3080,11 +5868,10 @@ async def process_unban_user(message: Message, state: FSMContext):
 
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_unban_user_"))
-async def admin_unban_user_direct(callback: CallbackQuery):
+@callbacks.route("admin_unban_direct", int)
+async def admin_unban_user_direct(callback: CallbackQuery, target_id: int):
     """Прямой разбан пользователя из меню"""
     user_id = callback.from_user.id
-    target_id = int(callback.data.split("_", 3)[3])
     
     # Проверяем права на разбан
     if db.get_user_role(user_id) not in ['admin', 'creator'] or not db.can_unban_user(user_id, target_id):
@@ -3096,10 +5883,10 @@ async def admin_unban_user_direct(callback: CallbackQuery):
         user = db.users.get(target_id)
         
         await callback.message.edit_text(
-            f"✅ <b>Пользователь @{user.get('username', 'Без имени')} разблокирован!</b>",
+            f"✅ <b>Пользователь @{user.username} разблокирован!</b>",
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[[
-                    InlineKeyboardButton(text="🔙 Назад", callback_data=f"admin_user_detail_{target_id}")
+                    InlineKeyboardButton(text="🔙 Назад", callback_data=cb("admin_user_detail", target_id))
                 ]]
             )
         )
@@ -3116,7 +5903,7 @@ async def admin_unban_user_direct(callback: CallbackQuery):
     else:
         await callback.answer("Этот пользователь не был заблокирован!", show_alert=True)
 
-@router.callback_query(F.data == "admin_broadcast")
+@callbacks.route("admin_broadcast")
 async def admin_broadcast_start(callback: CallbackQuery, state: FSMContext):
     """Начало рассылки"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
@@ -3143,13 +5930,14 @@ async def process_broadcast(message: Message, state: FSMContext):
     
     await message.answer(f"📤 Начинаю рассылку для {len(users)} пользователей...")
     
-    for user_id in users:
-        try:
-            await bot.send_message(user_id, f"📢 <b>Важное сообщение от администрации:</b>\n\n{message.text}")
-            success += 1
-            await asyncio.sleep(0.05)  # Защита от лимитов
-        except Exception as e:
-            failed += 1
+    # Скорость рассылки ограничивает OutboundRateLimiter; ответы другим пользователям идут вперед
+    with bulk_sends():
+        for user_id in users:
+            try:
+                await bot.send_message(user_id, f"📢 <b>Важное сообщение от администрации:</b>\n\n{message.text}")
+                success += 1
+            except Exception as e:
+                failed += 1
     
     await message.answer(
         f"✅ <b>Рассылка завершена</b>\n\n"
@@ -3160,21 +5948,20 @@ async def process_broadcast(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_message_"))
-async def admin_message_user_start(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("admin_message", int)
+async def admin_message_user_start(callback: CallbackQuery, state: FSMContext, user_id: int):
     """Начало отправки сообщения пользователю"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
     
-    user_id = int(callback.data.split("_", 2)[1])
     await state.update_data(target_user_id=user_id)
     
-    user = db.users.get(user_id, {})
+    username = getattr(db.users.get(user_id), 'username', 'Неизвестно')
     
     await callback.message.edit_text(
         f"✉️ <b>Отправка сообщения пользователю</b>\n\n"
-        f"Пользователь: @{user.get('username', 'Неизвестно')}\n"
+        f"Пользователь: @{username}\n"
         f"ID: <code>{user_id}</code>\n\n"
         f"Введите ваше сообщение:",
         reply_markup=InlineKeyboardMarkup(
@@ -3185,7 +5972,7 @@ async def admin_message_user_start(callback: CallbackQuery, state: FSMContext):
     )
     await state.set_state(AdminStates.waiting_user_message)
 
-@router.callback_query(F.data == "admin_message_user")
+@callbacks.route("admin_message_user")
 async def admin_message_user_general(callback: CallbackQuery, state: FSMContext):
     """Начало отправки сообщения пользователю (общий)"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
@@ -3218,7 +6005,7 @@ async def process_user_id(message: Message, state: FSMContext):
         
         await message.answer(
             f"✉️ <b>Отправка сообщения пользователю</b>\n\n"
-            f"Пользователь: @{user.get('username', 'Неизвестно')}\n"
+            f"Пользователь: @{user.username}\n"
             f"ID: <code>{user_id}</code>\n\n"
             f"Введите ваше сообщение:",
             reply_markup=InlineKeyboardMarkup(
@@ -3254,14 +6041,13 @@ async def process_admin_message(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_delete_task_"))
-async def admin_delete_task(callback: CallbackQuery):
+@callbacks.route("admin_delete_task", int)
+async def admin_delete_task(callback: CallbackQuery, task_id: int):
     """Удаление задачи админом"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
         await callback.answer("Доступ запрещен!", show_alert=True)
         return
     
-    task_id = int(callback.data.split("_", 3)[3])
     
     if db.delete_task(task_id):
         await callback.message.edit_text(
@@ -3276,7 +6062,7 @@ async def admin_delete_task(callback: CallbackQuery):
     else:
         await callback.answer("Ошибка удаления!", show_alert=True)
 
-@router.callback_query(F.data == "admin_export")
+@callbacks.route("admin_export")
 async def admin_export_start(callback: CallbackQuery, state: FSMContext):
     """Начало экспорта данных"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
@@ -3290,21 +6076,18 @@ async def admin_export_start(callback: CallbackQuery, state: FSMContext):
     )
     await state.set_state(AdminStates.waiting_export_format)
 
-@router.callback_query(F.data.startswith("export_"))
-async def process_export(callback: CallbackQuery, state: FSMContext):
-    """Обработка экспорта данных"""
+@callbacks.route("export", str, answer_first="⏳ Начинаю экспорт...")
+async def process_export(callback: CallbackQuery, state: FSMContext, export_format: str):
+    """Обработка экспорта данных (на callback отвечаем сразу, до сборки файла)"""
     if db.get_user_role(callback.from_user.id) not in ['admin', 'creator']:
-        await callback.answer("Доступ запрещен!", show_alert=True)
+        await callback.message.answer("Доступ запрещен!")
         return
     
-    export_format = callback.data.split("_", 1)[1]
-    
-    await callback.answer(f"Начинаю экспорт в формате {export_format.upper()}...", show_alert=True)
-    
     # Подготовка данных с учетом ролей и банов
     data = {
         "users": db.get_all_users_with_roles(),
-        "tasks": db.get_all_tasks(),
+        "tasks": [t.to_dict() for t in db.get_all_tasks()],
+        "archived_tasks": [t.to_dict() for t in db.archive.iter_tasks()],
         "stats": db.admin_stats,
         "banned_users": list(db.banned_users),
         "ban_info": {
@@ -3349,49 +6132,49 @@ async def process_export(callback: CallbackQuery, state: FSMContext):
                 f.write("АДМИНИСТРАТОРЫ:\n")
                 f.write("=" * 30 + "\n")
                 for admin_id in db.get_all_admins():
-                    user = db.users.get(admin_id, {})
+                    user = db.users.get(admin_id)
                     f.write(f"ID: {admin_id}\n")
-                    f.write(f"Имя: {user.get('full_name', 'Неизвестно')}\n")
-                    f.write(f"Username: @{user.get('username', 'нет')}\n")
+                    f.write(f"Имя: {user.full_name if user else 'Неизвестно'}\n")
+                    f.write(f"Username: @{user.username if user else 'нет'}\n")
                     f.write("-" * 30 + "\n")
                 
                 f.write("\nПОЛЬЗОВАТЕЛИ:\n")
                 f.write("=" * 30 + "\n")
-                for user in data['users']:
-                    role = user.get('role', 'user')
-                    banned = user.get('banned', False)
+                for user in db.get_all_users():
+                    role = db.get_user_role(user.user_id)
+                    banned = db.is_banned(user.user_id)
                     
-                    f.write(f"ID: {user['user_id']}\n")
-                    f.write(f"Имя: {user['full_name']}\n")
-                    f.write(f"Username: @{user.get('username', 'нет')}\n")
+                    f.write(f"ID: {user.user_id}\n")
+                    f.write(f"Имя: {user.full_name}\n")
+                    f.write(f"Username: @{user.username or 'нет'}\n")
                     f.write(f"Роль: {role}\n")
                     f.write(f"Статус: {'Заблокирован' if banned else 'Активен'}\n")
-                    f.write(f"Дата регистрации: {user['joined'].strftime('%d.%m.%Y %H:%M')}\n")
-                    f.write(f"Задач создано: {user['task_count']}\n")
-                    f.write(f"Задач выполнено: {user['completed_count']}\n")
+                    f.write(f"Дата регистрации: {_fmt_ts(user.joined)}\n")
+                    f.write(f"Задач создано: {user.task_count}\n")
+                    f.write(f"Задач выполнено: {user.completed_count}\n")
                     f.write("-" * 30 + "\n")
                 
                 f.write("\nЗАБЛОКИРОВАННЫЕ ПОЛЬЗОВАТЕЛИ:\n")
                 f.write("=" * 30 + "\n")
                 for banned_id in db.banned_users:
-                    user = db.users.get(banned_id, {})
+                    user = db.users.get(banned_id)
                     f.write(f"ID: {banned_id}\n")
-                    f.write(f"Имя: {user.get('full_name', 'Неизвестно')}\n")
-                    f.write(f"Username: @{user.get('username', 'нет')}\n")
+                    f.write(f"Имя: {user.full_name if user else 'Неизвестно'}\n")
+                    f.write(f"Username: @{user.username if user else 'нет'}\n")
                     f.write("-" * 30 + "\n")
                 
                 f.write("\nЗАДАЧИ:\n")
                 f.write("=" * 30 + "\n")
-                for task in data['tasks']:
-                    f.write(f"ID: {task['id']}\n")
-                    f.write(f"Пользователь ID: {task['user_id']}\n")
-                    f.write(f"Текст: {task['text']}\n")
-                    f.write(f"Категория: {task['category']}\n")
-                    f.write(f"Приоритет: {task['priority']}\n")
-                    f.write(f"Статус: {'Выполнена' if task['completed'] else 'В работе'}\n")
-                    f.write(f"Создана: {task['created'].strftime('%d.%m.%Y %H:%M')}\n")
-                    if task['completed_at']:
-                        f.write(f"Выполнена: {task['completed_at'].strftime('%d.%m.%Y %H:%M')}\n")
+                for task in itertools.chain(db.get_all_tasks(), db.archive.iter_tasks()):
+                    f.write(f"ID: {task.id}\n")
+                    f.write(f"Пользователь ID: {task.user_id}\n")
+                    f.write(f"Текст: {task.text}\n")
+                    f.write(f"Категория: {task.category}\n")
+                    f.write(f"Приоритет: {task.priority.key}\n")
+                    f.write(f"Статус: {'Выполнена' if task.completed else 'В работе'}\n")
+                    f.write(f"Создана: {_fmt_ts(task.created)}\n")
+                    if task.completed_at:
+                        f.write(f"Выполнена: {_fmt_ts(task.completed_at)}\n")
                     f.write("-" * 30 + "\n")
             
             await bot.send_document(
@@ -3405,12 +6188,12 @@ async def process_export(callback: CallbackQuery, state: FSMContext):
             with open(filename, 'w', encoding='utf-8') as f:
                 # Заголовок для задач
                 f.write("ID;UserID;Text;Category;Priority;Completed;Created;CompletedAt\n")
-                for task in data['tasks']:
-                    completed_at = task['completed_at'].strftime('%Y-%m-%d %H:%M') if task['completed_at'] else ''
-                    f.write(f"{task['id']};{task['user_id']};{task['text']};"
-                           f"{task['category']};{task['priority']};"
-                           f"{'Да' if task['completed'] else 'Нет'};"
-                           f"{task['created'].strftime('%Y-%m-%d %H:%M')};{completed_at}\n")
+                for task in itertools.chain(db.get_all_tasks(), db.archive.iter_tasks()):
+                    completed_at = _fmt_ts(task.completed_at, '%Y-%m-%d %H:%M', default='')
+                    f.write(f"{task.id};{task.user_id};{task.text};"
+                           f"{task.category};{task.priority.key};"
+                           f"{'Да' if task.completed else 'Нет'};"
+                           f"{_fmt_ts(task.created, '%Y-%m-%d %H:%M')};{completed_at}\n")
             
             await bot.send_document(
                 callback.from_user.id,
@@ -3433,7 +6216,7 @@ async def process_export(callback: CallbackQuery, state: FSMContext):
     await state.clear()
 
 # ========== ОБЩИЕ ОБРАБОТЧИКИ ==========
-@router.callback_query(F.data == "back_to_main")
+@callbacks.route("back_to_main")
 async def back_to_main(callback: CallbackQuery):
     """Вернуться в главное меню"""
     await callback.message.edit_text(
@@ -3442,12 +6225,12 @@ async def back_to_main(callback: CallbackQuery):
         reply_markup=get_main_keyboard(callback.from_user.id)
     )
 
-@router.callback_query(F.data == "back_to_tasks")
+@callbacks.route("back_to_tasks")
 async def back_to_tasks(callback: CallbackQuery):
     """Вернуться к списку задач"""
     await show_user_tasks(callback.from_user.id, callback.message.chat.id)
 
-@router.callback_query(F.data == "admin_back")
+@callbacks.route("admin_back")
 async def admin_back(callback: CallbackQuery):
     """Назад в админ-панель"""
     user_id = callback.from_user.id
@@ -3461,12 +6244,12 @@ async def admin_back(callback: CallbackQuery):
         reply_markup=get_admin_keyboard(user_id)
     )
 
-@router.callback_query(F.data == "close_menu")
+@callbacks.route("close_menu")
 async def close_menu(callback: CallbackQuery):
     """Закрыть меню"""
     await callback.message.delete()
 
-@router.callback_query(F.data == "cancel_creation")
+@callbacks.route("cancel_creation")
 async def cancel_creation(callback: CallbackQuery, state: FSMContext):
     """Отмена создания задачи"""
     await state.clear()
@@ -3479,27 +6262,25 @@ async def cancel_creation(callback: CallbackQuery, state: FSMContext):
         )
     )
 
-@router.callback_query(F.data == "create_task_from_empty")
+@callbacks.route("create_task_from_empty")
 async def create_task_from_empty(callback: CallbackQuery, state: FSMContext):
     """Создать задачу из пустого списка"""
     await create_task_start(callback.message, state)
 
-@router.callback_query(F.data == "create_another")
+@callbacks.route("create_another")
 async def create_another_task(callback: CallbackQuery, state: FSMContext):
     """Создать еще одну задачу"""
     await create_task_start(callback.message, state)
 
 # ========== ДОПОЛНИТЕЛЬНЫЕ ОБРАБОТЧИКИ ==========
-@router.callback_query(F.data.startswith("tasks_page_"))
-async def change_tasks_page(callback: CallbackQuery):
+@callbacks.route("tasks_page", int)
+async def change_tasks_page(callback: CallbackQuery, page: int):
     """Смена страницы задач"""
-    page = int(callback.data.split("_", 2)[2])
     await show_user_tasks(callback.from_user.id, callback.message.chat.id, page)
 
-@router.callback_query(F.data.startswith("admin_tasks_page_"))
-async def change_admin_tasks_page(callback: CallbackQuery):
+@callbacks.route("admin_tasks_page", int)
+async def change_admin_tasks_page(callback: CallbackQuery, page: int):
     """Смена страницы админских задач"""
-    page = int(callback.data.split("_", 3)[3])
     tasks = db.get_all_tasks()
     
     await callback.message.edit_text(
@@ -3507,42 +6288,176 @@ async def change_admin_tasks_page(callback: CallbackQuery):
         reply_markup=get_admin_tasks_keyboard(tasks, page)
     )
 
-@router.callback_query(F.data.startswith("admin_users_page_"))
-async def change_admin_users_page(callback: CallbackQuery):
+@callbacks.route("admin_users_page", int)
+async def change_admin_users_page(callback: CallbackQuery, page: int):
     """Смена страницы списка пользователей"""
-    page = int(callback.data.split("_", 3)[3])
-    users = db.get_all_users_with_roles()
+    users = db.get_all_users()
     
     await callback.message.edit_text(
         f"<b>👥 Все пользователи</b> (всего: {len(users)})",
         reply_markup=get_user_list_keyboard(users, page)
     )
 
+# ========== ДОГОНЯЮЩАЯ ОБРАБОТКА ==========
+def _update_timestamp(update: Update) -> Optional[float]:
+    """Время отправки обновления (известно только для сообщений)"""
+    event = update.message or update.edited_message
+    return event.date.timestamp() if event else None
+
+async def fetch_pending_updates() -> tuple:
+    """Забрать накопившиеся обновления через getUpdates: (самые свежие ≤ лимита, всего получено)"""
+    pending = deque(maxlen=CATCHUP_MAX_UPDATES)
+    offset = None
+    fetched = 0
+    while True:
+        batch = await bot.get_updates(
+            offset=offset, limit=100, timeout=0,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        pending.extend(batch)
+        fetched += len(batch)
+        if len(batch) < 100:
+            break
+        offset = batch[-1].update_id + 1
+    if pending:
+        # Подтверждаем получение, чтобы polling/webhook не получили эти обновления повторно
+        await bot.get_updates(offset=pending[-1].update_id + 1, limit=1, timeout=0)
+    return list(pending), fetched
+
+async def catch_up_pending_updates():
+    """Разобрать накопившиеся за перезапуск обновления.
+
+    Устаревшие сообщения (старше CATCHUP_MAX_AGE_SEC) и нажатия кнопок, на которые
+    уже нельзя ответить, пропускаются. Сначала выполняются команды модерации и действия
+    админов, затем остальное. Внутри чата порядок сохраняется, чаты обрабатываются
+    параллельно, но не более CATCHUP_CONCURRENCY одновременно.
+    """
+    updates, fetched = await fetch_pending_updates()
+    if not fetched:
+        return
+    
+    now = time.time()
+    urgent, normal = [], []
+    stale = 0
+    next_dated = None  # время ближайшего более позднего сообщения
+    for update in reversed(updates):
+        date = _update_timestamp(update)
+        if date is not None:
+            next_dated = date if next_dated is None else min(next_dated, date)
+        if update.callback_query is not None:
+            # У callback'а нет даты, но он точно старше следующего за ним сообщения
+            expired = next_dated is not None and now - next_dated > CALLBACK_ANSWER_WINDOW_SEC
+        else:
+            expired = date is not None and now - date > CATCHUP_MAX_AGE_SEC
+        if expired:
+            stale += 1
+        elif _is_urgent_update(update):
+            urgent.append(update)
+        else:
+            normal.append(update)
+    
+    semaphore = asyncio.Semaphore(CATCHUP_CONCURRENCY)
+    
+    async def process_chat(chat_updates: list):
+        async with semaphore:
+            for update in chat_updates:
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception:
+                    logger.exception(f"Ошибка обработки накопившегося обновления {update.update_id}")
+    
+    for group in (urgent, normal):
+        by_chat: Dict[Optional[int], list] = {}
+        for update in reversed(group):
+            by_chat.setdefault(_update_chat_id(update), []).append(update)
+        await asyncio.gather(*(process_chat(chat_updates) for chat_updates in by_chat.values()))
+    
+    logger.info(
+        f"Накопившиеся обновления: получено {fetched}, обработано {len(urgent) + len(normal)} "
+        f"(срочных {len(urgent)}), устаревших {stale}, сверх лимита {fetched - len(updates)}"
+    )
+
 # ========== ЗАПУСК БОТА ==========
+async def archive_worker():
+    """Периодический перенос давно выполненных задач в архив"""
+    while True:
+        await asyncio.sleep(ARCHIVE_CHECK_INTERVAL_HOURS * 3600)
+        try:
+            db.archive_completed_tasks()
+        except Exception as e:
+            logger.exception(f"Archive worker failed: {e}")
+
+async def run_webhook():
+    """Прием обновлений через webhook на встроенном aiohttp-сервере.
+
+    Накопившиеся за время перезапуска обновления к этому моменту уже разобраны
+    (или сброшены) в main(). Сам webhook при остановке не удаляется, чтобы
+    обновления копились у Telegram до следующего запуска.
+    """
+    secret = WEBHOOK_SECRET or None
+    await bot.set_webhook(
+        url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False,
+    )
+    
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_LISTEN_HOST, port=WEBHOOK_LISTEN_PORT)
+    await site.start()
+    logger.info(f"Webhook: слушаю {WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}{WEBHOOK_PATH}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
     """Основная функция запуска бота"""
     logger.info("Бот запускается...")
     
     # Инициализация создателя в базе данных
     if CREATOR_ID not in db.users:
-        db.users[CREATOR_ID] = {
-            'user_id': CREATOR_ID,
-            'username': 'creator',
-            'full_name': 'Создатель бота',
-            'joined': datetime.now(),
-            'task_count': 0,
-            'completed_count': 0,
-            'last_active': datetime.now(),
-            'warnings': 0
-        }
+        now = _now_ts()
+        db.users[CREATOR_ID] = User(
+            user_id=CREATOR_ID,
+            username='creator',
+            full_name='Создатель бота',
+            joined=now,
+            last_active=now,
+        )
         db.roles[CREATOR_ID] = 'creator'
         logger.info(f"Создатель бота (ID: {CREATOR_ID}) инициализирован")
     
-    # Пропускаем накопленные updates
-    await bot.delete_webhook(drop_pending_updates=True)
+    if ARCHIVE_COMPLETED_AFTER_DAYS:
+        asyncio.create_task(archive_worker())
+    
+    # Индекс журнала модерации строится в фоне, /audit дождется его при необходимости
+    asyncio.create_task(db.audit.build_index())
+    
+    keyboards.prebuild()
+    logger.info(f"Статические клавиатуры построены: {keyboards.build_counts}")
+    
+    # Накопленные updates: getUpdates работает только без webhook, поэтому снимаем его
+    # (без сброса очереди), разбираем хвост, а webhook при необходимости ставим заново
+    if CATCHUP_PENDING_UPDATES:
+        await bot.delete_webhook(drop_pending_updates=False)
+        await catch_up_pending_updates()
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+    
+    if WEBHOOK_BASE_URL:
+        await run_webhook()
+        return
     
-    # Запуск polling
-    await dp.start_polling(bot)
+    # Запуск polling: каждое обновление — отдельная задача, порядок и лимиты — в UpdateScheduler
+    await dp.start_polling(bot, handle_as_tasks=True)
 
 if __name__ == "__main__":
     asyncio.run(main())